@@ -1,35 +1,61 @@
 from .amazon import S3BotoStorage, S3BotoStorageFile
+from .asynchronous import AsyncStorage
+from .cache import CachedStorage, CachedStorageFile
 from .cloudfiles import CloudFilesStorage, CloudFilesStorageFile
+from .dedup import ContentAddressedStorage, ContentAddressedStorageFile
 from .filesystem import FileSystemStorage, FileSystemStorageFile
-from .mock import MockStorage, MockStorageFile
+from .helpers import send_storage_file
+from .metadata import MetadataCacheStorage, MetadataCacheStorageFile
+from .mock import MockAsyncStorage, MockStorage, MockStorageFile
+from .naming import HashNaming, ListingNaming, SequentialNaming, UUIDNaming
+from .writebehind import WriteBehindStorage, WriteBehindStorageFile
 from .base import (
     FileExistsError,
     FileNotFoundError,
     PermissionError,
     Storage,
     StorageException,
-    StorageFile
+    StorageFile,
+    StorageFileWrapper,
+    StorageWrapper
 )
 
 
 __all__ = (
+    AsyncStorage,
+    CachedStorage,
+    CachedStorageFile,
     CloudFilesStorage,
     CloudFilesStorageFile,
+    ContentAddressedStorage,
+    ContentAddressedStorageFile,
     FileExistsError,
     FileNotFoundError,
     FileSystemStorage,
     FileSystemStorageFile,
+    HashNaming,
+    ListingNaming,
+    MetadataCacheStorage,
+    MetadataCacheStorageFile,
+    MockAsyncStorage,
     MockStorage,
     MockStorageFile,
     PermissionError,
     S3BotoStorage,
     S3BotoStorageFile,
+    SequentialNaming,
     Storage,
     StorageException,
     StorageFile,
+    StorageFileWrapper,
+    StorageWrapper,
+    UUIDNaming,
+    WriteBehindStorage,
+    WriteBehindStorageFile,
     'STORAGE_DRIVERS',
     'get_default_storage_class',
     'get_filesystem_storage_class',
+    'send_storage_file',
 )
 
 
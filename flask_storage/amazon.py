@@ -1,5 +1,12 @@
+from __future__ import with_statement
 from functools import wraps
+from StringIO import StringIO
+import httplib
 import mimetypes
+import os
+import tempfile
+import threading
+import time
 
 from boto.s3.connection import S3Connection, SubdomainCallingFormat
 from boto.exception import S3ResponseError, S3CreateError
@@ -9,11 +16,79 @@ from flask import current_app
 
 from .base import (
     FileNotFoundError,
+    PermissionError,
     Storage,
     StorageException,
     StorageFile,
     reraise
 )
+from .utils import (
+    ConnectionRegistry,
+    LRUCache,
+    WorkerPool,
+    force_str,
+    gzip_copy
+)
+
+
+#: Connections and buckets shared by all S3BotoStorage instances of the
+#: process.
+connection_registry = ConnectionRegistry()
+
+#: Signed URLs shared by all S3BotoStorage instances of the process.
+signed_url_cache = LRUCache(max_size=10000)
+
+
+class KeyIndex(object):
+    """
+    In-memory index of the keys of a bucket, mapping key names to
+    :class:`~boto.s3.key.Key` objects that carry the size, etag and last
+    modification time returned by S3 LIST responses. The index is shared
+    by threads, so it is only accessed through its methods.
+    """
+
+    def __init__(self):
+        self.keys = {}
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+    def load(self, bucket, prefix='', ttl=None):
+        """
+        Returns the index, listing the bucket (one request per 1000 keys)
+        if it hasn't been listed yet or the listing is older than `ttl`
+        seconds.
+        """
+        with self._lock:
+            if self.loaded_at is None or (
+                    ttl is not None and time.time() - self.loaded_at > ttl):
+                self.keys = dict(
+                    (key.name, key) for key in bucket.list(prefix=prefix)
+                )
+                self.loaded_at = time.time()
+        return self
+
+    def invalidate(self):
+        self.loaded_at = None
+
+    def get(self, name):
+        with self._lock:
+            return self.keys.get(name)
+
+    def add(self, name, key):
+        with self._lock:
+            self.keys[name] = key
+
+    def discard(self, name):
+        with self._lock:
+            self.keys.pop(name, None)
+
+    def names(self, prefix=''):
+        with self._lock:
+            return [name for name in self.keys if name.startswith(prefix)]
+
+    def copy(self):
+        with self._lock:
+            return dict(self.keys)
 
 
 class S3BotoStorage(Storage):
@@ -27,8 +102,10 @@ class S3BotoStorage(Storage):
             headers=None,
             gzip=None,
             gzip_content_types=None,
+            gzip_compression_level=None,
             querystring_auth=None,
             querystring_expire=None,
+            querystring_reuse=None,
             reduced_redundancy=None,
             custom_domain=None,
             secure_urls=None,
@@ -37,12 +114,26 @@ class S3BotoStorage(Storage):
             preload_metadata=None,
             calling_format=None,
             file_overwrite=None,
-            auto_create_bucket=None):
+            auto_create_bucket=None,
+            multipart_threshold=None,
+            multipart_part_size=None,
+            multipart_workers=None,
+            multipart_retries=None,
+            multipart_copy_threshold=None,
+            multipart_copy_part_size=None,
+            preload_metadata_ttl=None,
+            host=None,
+            share_connections=None,
+            connection_pool_size=None,
+            connection_idle_timeout=None,
+            delete_check_exists=None):
 
         self.access_key = access_key or \
             current_app.config.get('AWS_ACCESS_KEY_ID', None)
         self.secret_key = secret_key or \
             current_app.config.get('AWS_SECRET_ACCESS_KEY', None)
+        self.host = host or \
+            current_app.config.get('AWS_S3_HOST', S3Connection.DefaultHost)
         self.calling_format = calling_format or \
             current_app.config.get(
                 'AWS_S3_CALLING_FORMAT',
@@ -62,6 +153,8 @@ class S3BotoStorage(Storage):
             current_app.config.get('AWS_HEADERS', {})
         self.preload_metadata = preload_metadata or \
             current_app.config.get('AWS_PRELOAD_METADATA', False)
+        self.preload_metadata_ttl = preload_metadata_ttl or \
+            current_app.config.get('AWS_PRELOAD_METADATA_TTL', 300)
         self.gzip = gzip or \
             current_app.config.get('AWS_IS_GZIPPED', False)
         self.gzip_content_types = gzip_content_types or \
@@ -72,10 +165,18 @@ class S3BotoStorage(Storage):
                     'application/x-javascript',
                 )
             )
+        self.gzip_compression_level = gzip_compression_level or \
+            current_app.config.get('AWS_GZIP_COMPRESSION_LEVEL', 6)
         self.querystring_auth = querystring_auth or \
             current_app.config.get('AWS_QUERYSTRING_AUTH', True)
         self.querystring_expire = querystring_expire or \
             current_app.config.get('AWS_QUERYSTRING_EXPIRE', 3600)
+        if querystring_reuse is None:
+            querystring_reuse = current_app.config.get(
+                'AWS_QUERYSTRING_REUSE',
+                0.5
+            )
+        self.querystring_reuse = querystring_reuse
         self.reduced_redundancy = reduced_redundancy or \
             current_app.config.get('AWS_REDUCED_REDUNDANCY', False)
         self.custom_domain = custom_domain or \
@@ -86,19 +187,86 @@ class S3BotoStorage(Storage):
         self.location = self.location.lstrip('/')
         self.file_name_charset = file_name_charset or \
             current_app.config.get('AWS_S3_FILE_NAME_CHARSET', 'utf-8')
+        self.multipart_threshold = multipart_threshold or \
+            current_app.config.get(
+                'AWS_S3_MULTIPART_THRESHOLD',
+                8 * 1024 * 1024
+            )
+        self.multipart_part_size = multipart_part_size or \
+            current_app.config.get(
+                'AWS_S3_MULTIPART_PART_SIZE',
+                8 * 1024 * 1024
+            )
+        self.multipart_workers = multipart_workers or \
+            current_app.config.get('AWS_S3_MULTIPART_WORKERS', 4)
+        self.multipart_retries = multipart_retries or \
+            current_app.config.get('AWS_S3_MULTIPART_RETRIES', 3)
+        self.multipart_copy_threshold = multipart_copy_threshold or \
+            current_app.config.get(
+                'AWS_S3_MULTIPART_COPY_THRESHOLD',
+                1024 * 1024 * 1024
+            )
+        self.multipart_copy_part_size = multipart_copy_part_size or \
+            current_app.config.get(
+                'AWS_S3_MULTIPART_COPY_PART_SIZE',
+                256 * 1024 * 1024
+            )
+        if share_connections is None:
+            share_connections = current_app.config.get(
+                'AWS_S3_SHARE_CONNECTIONS',
+                True
+            )
+        self.share_connections = share_connections
+        self.connection_pool_size = connection_pool_size or \
+            current_app.config.get('AWS_S3_CONNECTION_POOL_SIZE', 32)
+        self.connection_idle_timeout = connection_idle_timeout or \
+            current_app.config.get('AWS_S3_CONNECTION_IDLE_TIMEOUT', 300)
+        if delete_check_exists is None:
+            delete_check_exists = current_app.config.get(
+                'AWS_S3_DELETE_CHECK_EXISTS',
+                True
+            )
+        self.delete_check_exists = delete_check_exists
 
         self._connection = None
-        self._entries = {}
+        self._index = None
 
     @property
     def connection(self):
         if self._connection is None:
-            self._connection = S3Connection(
-                self.access_key, self.secret_key,
-                calling_format=self.calling_format
+            self._connection = self._shared(
+                ('connection', ),
+                self._create_connection
             )
         return self._connection
 
+    def _create_connection(self):
+        return S3Connection(
+            self.access_key, self.secret_key,
+            host=self.host,
+            calling_format=self.calling_format
+        )
+
+    def _shared(self, key, factory):
+        """
+        Returns the object created by `factory` from the process wide
+        connection registry when `share_connections` is enabled, otherwise
+        a new object.
+        """
+        if not self.share_connections:
+            return factory()
+        return connection_registry.get(
+            (
+                self.access_key,
+                self.secret_key,
+                self.host,
+                self.calling_format.__class__
+            ) + key,
+            factory,
+            max_size=self.connection_pool_size,
+            idle_timeout=self.connection_idle_timeout
+        )
+
     @property
     def folder_name(self):
         return self.bucket_name
@@ -110,9 +278,53 @@ class S3BotoStorage(Storage):
         create it.
         """
         if not hasattr(self, '_bucket'):
-            self._bucket = self._get_or_create_bucket(self.bucket_name)
+            self._bucket = self._shared(
+                ('bucket', self.bucket_name),
+                lambda: self._get_or_create_bucket(self.bucket_name)
+            )
         return self._bucket
 
+    @property
+    def entries(self):
+        """
+        A copy of the index of the keys under `location` when
+        `preload_metadata` is enabled. The index is built with a paginated
+        LIST on first use, shared by the storages of the process, kept up
+        to date by saves and deletes made through them and rebuilt every
+        `preload_metadata_ttl` seconds (5 minutes by default, None never
+        rebuilds it). Keys missing from the index are looked up with a HEAD
+        request, since other processes might have created them since the
+        listing.
+        """
+        if not self.preload_metadata:
+            return {}
+        return self._key_index().copy()
+
+    def _key_index(self):
+        """
+        Returns the loaded :class:`KeyIndex` described in :attr:`entries`,
+        or None if `preload_metadata` is disabled.
+        """
+        if not self.preload_metadata:
+            return None
+        if self._index is None:
+            self._index = self._shared(
+                ('index', self.bucket_name, self.location),
+                KeyIndex
+            )
+        return self._index.load(
+            self.bucket,
+            self._encode_name(self.location),
+            self.preload_metadata_ttl
+        )
+
+    def refresh_metadata(self):
+        """
+        Forces the preloaded metadata to be listed again on next use.
+        """
+        if self._index is not None:
+            self._index.invalidate()
+
     def list_folders(self):
         return [bucket.name for bucket in self.connection.get_all_buckets()]
 
@@ -162,11 +374,15 @@ class S3BotoStorage(Storage):
         encoded_name = self._encode_name(name)
 
         key = self.bucket.new_key(encoded_name)
-        if self.preload_metadata:
-            self._entries[encoded_name] = key
 
         key.set_metadata('Content-Type', content_type)
-        if isinstance(content, basestring):
+        if self.gzip and content_type in self.gzip_content_types:
+            compressed = self._compress(content)
+            if compressed is not None:
+                content = compressed
+                headers['Content-Encoding'] = 'gzip'
+        if isinstance(content, basestring) and \
+                len(content) < self.multipart_threshold:
             key.set_contents_from_string(
                 content,
                 headers=headers,
@@ -174,15 +390,142 @@ class S3BotoStorage(Storage):
                 reduced_redundancy=self.reduced_redundancy
             )
         else:
-            content.name = cleaned_name
-            key.set_contents_from_file(
-                content,
-                headers=headers,
-                policy=self.acl,
-                reduced_redundancy=self.reduced_redundancy
+            if isinstance(content, basestring):
+                content = StringIO(force_str(content))
+            else:
+                try:
+                    content.name = cleaned_name
+                except (AttributeError, TypeError):
+                    # real and spooled temporary files have read-only names
+                    pass
+            size = self._content_size(content)
+            if size is None or size >= self.multipart_threshold:
+                headers['Content-Type'] = content_type
+                key.size = self._save_multipart(encoded_name, content, headers)
+            else:
+                key.set_contents_from_file(
+                    content,
+                    headers=headers,
+                    policy=self.acl,
+                    reduced_redundancy=self.reduced_redundancy
+                )
+        if self.preload_metadata:
+            key.last_modified = time.strftime(
+                '%Y-%m-%dT%H:%M:%S.000Z',
+                time.gmtime()
             )
+            self._key_index().add(encoded_name, key)
         return self.open(encoded_name)
 
+    def save_many(self, items, workers=None):
+        # look the bucket up once before the workers start sharing it
+        self.bucket
+        return Storage.save_many(self, items, workers)
+
+    def _compress(self, content):
+        """
+        Compresses the content in chunks into a spooled temporary file.
+        Returns None, with file-like content rewound to where it was, if
+        compressing doesn't make the content smaller.
+        """
+        if isinstance(content, basestring):
+            source = StringIO(force_str(content))
+        else:
+            source = content
+        position = source.tell()
+        compressed = tempfile.SpooledTemporaryFile(
+            max_size=self.multipart_part_size
+        )
+        read, written = gzip_copy(
+            source, compressed, self.gzip_compression_level
+        )
+        if written >= read:
+            source.seek(position)
+            return None
+        compressed.seek(0)
+        return compressed
+
+    def _content_size(self, content):
+        """
+        Returns the number of bytes left in given file-like object or None
+        if the object is not seekable.
+        """
+        try:
+            position = content.tell()
+            content.seek(0, os.SEEK_END)
+            size = content.tell() - position
+            content.seek(position)
+        except (AttributeError, IOError):
+            return None
+        return size
+
+    def _save_multipart(self, name, content, headers):
+        """
+        Uploads the content in parts of `multipart_part_size` bytes using
+        `multipart_workers` threads. Parts are read sequentially and only a
+        bounded number of them is held in memory at once. Failed parts are
+        retried individually and the whole upload is aborted if a part runs
+        out of retries.
+        """
+        upload = self.bucket.initiate_multipart_upload(
+            name,
+            headers=headers,
+            reduced_redundancy=self.reduced_redundancy,
+            policy=self.acl
+        )
+        try:
+            tasks = []
+            with WorkerPool(self.multipart_workers) as pool:
+                for part_number, data in self._iter_parts(content):
+                    if any(task.done() and task.exception for task in tasks):
+                        break
+                    tasks.append(pool.submit(
+                        self._upload_part, upload, part_number, data
+                    ))
+            size = sum(task.result() for task in tasks)
+            upload.complete_upload()
+        except Exception:
+            upload.cancel_upload()
+            raise
+        return size
+
+    def _iter_parts(self, content):
+        part_number = 1
+        data = content.read(self.multipart_part_size)
+        # S3 needs at least one part, even if it is empty
+        yield part_number, data
+        while len(data) == self.multipart_part_size:
+            data = content.read(self.multipart_part_size)
+            if not data:
+                break
+            part_number += 1
+            yield part_number, data
+
+    def _upload_part(self, upload, part_number, data):
+        self._with_retries(
+            lambda: upload.upload_part_from_file(
+                StringIO(data),
+                part_number,
+                size=len(data)
+            )
+        )
+        return len(data)
+
+    def _with_retries(self, func):
+        """
+        Calls given function retrying it up to `multipart_retries` times on
+        connection errors and 5xx responses.
+        """
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except (S3ResponseError, IOError, httplib.HTTPException), e:
+                attempt += 1
+                if attempt > self.multipart_retries or \
+                        getattr(e, 'status', 500) < 500:
+                    raise
+
     def _open(self, name, mode='r'):
         return self.file_class(self, name=name, mode=mode)
 
@@ -194,29 +537,252 @@ class S3BotoStorage(Storage):
     def delete(self, name):
         name = self._encode_name(self._normalize_name(self._clean_name(name)))
 
-        if self.bucket.lookup(name) is None:
+        if self.delete_check_exists and not self._key_exists(name):
             raise FileNotFoundError(name, 404)
 
         self.bucket.delete_key(name)
+        if self.preload_metadata:
+            self._key_index().discard(name)
+
+    def copy(self, src, dst):
+        """
+        Copies the file on the server side. Objects of at least
+        `multipart_copy_threshold` bytes are copied in parts of
+        `multipart_copy_part_size` bytes using `multipart_workers`
+        concurrent requests; single requests can't copy more than 5 GB.
+        """
+        src_name = self._encode_name(
+            self._normalize_name(self._clean_name(src))
+        )
+        dst = self._clean_name(dst)
+        dst_name = self._encode_name(self._normalize_name(dst))
+        source = self.bucket.get_key(src_name)
+        if source is None:
+            raise FileNotFoundError(src, 404)
+        try:
+            if source.size >= self.multipart_copy_threshold:
+                self._copy_multipart(source, dst_name)
+            else:
+                self.bucket.copy_key(
+                    dst_name,
+                    self.bucket.name,
+                    src_name,
+                    storage_class=self._storage_class,
+                    headers={'x-amz-acl': self.acl}
+                )
+        except S3ResponseError, e:
+            reraise(e)
+        if self.preload_metadata:
+            key = self.bucket.new_key(dst_name)
+            key.size = source.size
+            key.etag = source.etag
+            key.last_modified = time.strftime(
+                '%Y-%m-%dT%H:%M:%S.000Z',
+                time.gmtime()
+            )
+            self._key_index().add(dst_name, key)
+        return self.open(dst)
+
+    def _copy_multipart(self, source, name):
+        headers = {'Content-Type': source.content_type}
+        if source.content_encoding:
+            headers['Content-Encoding'] = source.content_encoding
+        upload = self.bucket.initiate_multipart_upload(
+            name,
+            headers=headers,
+            reduced_redundancy=self.reduced_redundancy,
+            policy=self.acl
+        )
+        part_size = self.multipart_copy_part_size
+
+        def copy_part(part_number, start):
+            end = min(start + part_size, source.size) - 1
+            self._with_retries(
+                lambda: upload.copy_part_from_key(
+                    self.bucket.name, source.name, part_number, start, end
+                )
+            )
+
+        try:
+            tasks = []
+            with WorkerPool(self.multipart_workers) as pool:
+                for start in xrange(0, source.size, part_size):
+                    if any(task.done() and task.exception for task in tasks):
+                        break
+                    tasks.append(pool.submit(
+                        copy_part, len(tasks) + 1, start
+                    ))
+            for task in tasks:
+                task.result()
+            upload.complete_upload()
+        except Exception:
+            upload.cancel_upload()
+            raise
+
+    @property
+    def _storage_class(self):
+        if self.reduced_redundancy:
+            return 'REDUCED_REDUNDANCY'
+        return 'STANDARD'
+
+    def delete_many(self, names):
+        """
+        Deletes the files with multi-object delete requests of up to 1000
+        keys each. Unlike :meth:`delete`, names that don't exist are
+        reported as deleted since S3 doesn't tell them apart.
+        """
+        results = {}
+        names = list(names)
+        for start in xrange(0, len(names), 1000):
+            keys = {}
+            for name in names[start:start + 1000]:
+                keys[self._encode_name(
+                    self._normalize_name(self._clean_name(name))
+                )] = name
+            try:
+                result = self.bucket.delete_keys(keys.keys(), quiet=True)
+            except S3ResponseError, e:
+                error = self._exception(e)
+                results.update((name, error) for name in keys.values())
+                continue
+            index = self._key_index()
+            for key_name, name in keys.items():
+                results[name] = None
+                if index is not None:
+                    index.discard(key_name)
+            for error in result.errors:
+                results[keys[error.key]] = self._delete_error(error)
+        return results
+
+    def _exception(self, exception):
+        try:
+            reraise(exception)
+        except StorageException, e:
+            return e
+
+    def _delete_error(self, error):
+        if error.code == 'AccessDenied':
+            exception_class = PermissionError
+        else:
+            exception_class = StorageException
+        return exception_class(message='%s: %s' % (error.key, error.message))
 
     def exists(self, name):
         name = self._normalize_name(self._clean_name(name))
-        return bool(self.bucket.lookup(self._encode_name(name)))
+        return self._key_exists(self._encode_name(name))
+
+    def _key_exists(self, name):
+        index = self._key_index()
+        if index is not None and index.get(name) is not None:
+            return True
+        key = self.bucket.lookup(name)
+        if key is None:
+            return False
+        if index is not None:
+            index.add(name, key)
+        return True
+
+    def _names_with_prefix(self, prefix):
+        cleaned_prefix = self._clean_name(prefix)
+        normalized_prefix = self._normalize_name(cleaned_prefix)
+        full_prefix = self._encode_name(normalized_prefix)
+        # strip the location so that returned names are comparable with
+        # the ones given to exists()
+        offset = len(normalized_prefix) - len(cleaned_prefix)
+        if self.preload_metadata:
+            names = self._key_index().names(full_prefix)
+        else:
+            names = [
+                key.name for key in self.bucket.list(prefix=full_prefix)
+            ]
+        return [self._decode_name(name)[offset:] for name in names]
+
+    def list_page(self, prefix=None, delimiter=None, page_size=1000,
+                  marker=None):
+        location = self.location + '/' if self.location else ''
+        result = self.bucket.get_all_keys(
+            prefix=self._encode_name(location + (prefix or '')),
+            delimiter=delimiter or '',
+            max_keys=page_size,
+            marker=self._encode_name(location + marker) if marker else ''
+        )
+        names = [
+            self._decode_name(key.name)[len(location):] for key in result
+        ]
+        if not result.is_truncated or not names:
+            return names, None
+        next_marker = getattr(result, 'next_marker', None)
+        if next_marker:
+            return names, self._decode_name(next_marker)[len(location):]
+        return names, names[-1]
 
     def url(self, name):
+        return self._url(name, time.time())
+
+    def urls(self, names):
+        """
+        Returns the URLs of given names. All signed URLs share the same
+        expiry time so that they can be served from the cache together.
+        """
+        now = time.time()
+        return [self._url(name, now) for name in names]
+
+    def _url(self, name, now, method='GET'):
+        """
+        Returns the URL of given name.
+
+        Signed URLs expire at the end of the window of
+        ``querystring_reuse * querystring_expire`` seconds `now` falls
+        into plus ``querystring_expire`` seconds. The same URL is returned
+        for the whole window, so that browsers and CDNs can cache the
+        file, and is valid for at least ``(1 - querystring_reuse) *
+        querystring_expire`` seconds whenever it is handed out. A reuse
+        fraction of 0 signs a fresh URL on every call.
+        """
         name = self._normalize_name(self._clean_name(name))
 
         if self.custom_domain:
             return "%s://%s/%s" % ('https' if self.secure_urls else 'http',
                                    self.custom_domain, name)
-        return self.connection.generate_url(
-            self.querystring_expire,
-            method='GET',
-            bucket=self.bucket.name,
-            key=self._encode_name(name),
-            query_auth=self.querystring_auth,
-            force_http=not self.secure_urls
+        encoded_name = self._encode_name(name)
+        if not self.querystring_auth or not self.querystring_reuse:
+            return self.connection.generate_url(
+                self.querystring_expire,
+                method=method,
+                bucket=self.bucket.name,
+                key=encoded_name,
+                query_auth=self.querystring_auth,
+                force_http=not self.secure_urls
+            )
+
+        window = self.querystring_expire * self.querystring_reuse
+        window_start = now - now % window
+        expires_at = int(window_start + self.querystring_expire)
+        cache_key = (
+            self.access_key,
+            self.host,
+            self.bucket_name,
+            encoded_name,
+            method,
+            expires_at,
+            self.secure_urls
         )
+        url = signed_url_cache.get(cache_key)
+        if url is None:
+            url = self.connection.generate_url(
+                expires_at,
+                method=method,
+                bucket=self.bucket.name,
+                key=encoded_name,
+                force_http=not self.secure_urls,
+                expires_in_absolute=True
+            )
+            signed_url_cache.set(
+                cache_key,
+                url,
+                ttl=window_start + window - now
+            )
+        return url
 
     @property
     def file_class(self):
@@ -227,8 +793,7 @@ def require_opening(func):
     @wraps(func)
     def wrapper(self, *args, **kwargs):
         if not self._is_open:
-            self._key.open(self._mode)
-            self._is_open = True
+            self._open_stream()
         return func(self, *args, **kwargs)
     return wrapper
 
@@ -245,7 +810,11 @@ class S3BotoStorageFile(StorageFile):
         if name is not None:
             self.name = name
         self._pos = 0
+        self._stream_pos = 0
         self._is_open = False
+        self._head_key = None
+        # position known to be at the end of the file
+        self._end = None
 
     @property
     def content_type(self):
@@ -260,14 +829,42 @@ class S3BotoStorageFile(StorageFile):
         return self._key
 
     @property
-    @require_opening
+    def _entry(self):
+        if not self._storage.preload_metadata or not self._key.name:
+            return None
+        return self._storage._key_index().get(
+            self._storage._encode_name(self._key.name)
+        )
+
+    @property
     def size(self):
-        return self._key.size
+        return self._metadata_key.size
 
     @property
-    @require_opening
     def last_modified(self):
-        return self._key.last_modified
+        return self._metadata_key.last_modified
+
+    @property
+    def etag(self):
+        return self._metadata_key.etag
+
+    @property
+    def _metadata_key(self):
+        """
+        The key carrying the metadata of the file: the preloaded index
+        entry, the key of an open stream or else a key fetched with a HEAD
+        request, so that metadata never opens a GET stream.
+        """
+        if self._entry is not None:
+            return self._entry
+        if self._is_open:
+            return self._key
+        if self._head_key is None:
+            key = self._storage.bucket.get_key(self._key.name)
+            if key is None:
+                raise FileNotFoundError(self.name, 404)
+            self._head_key = key
+        return self._head_key
 
     @property
     def url(self):
@@ -282,12 +879,106 @@ class S3BotoStorageFile(StorageFile):
         self._name = self.prefix + self._storage._clean_name(value)
         self._key.name = self._name
 
-    @require_opening
+    def rename(self, name):
+        if self._is_open:
+            self._close_stream()
+        moved = self._storage.move(self.name, name)
+        self._key = moved._key
+        self._name = moved.name
+        self._head_key = None
+        self._end = None
+
+    def _open_stream(self):
+        """
+        Opens a GET stream starting at the current position. Positions past
+        the beginning of the file are requested with an HTTP Range header so
+        that the skipped bytes are never downloaded.
+        """
+        headers = {}
+        if self._pos:
+            headers['Range'] = 'bytes=%d-' % self._pos
+        self._key.open(self._mode, headers=headers)
+        self._is_open = True
+        self._stream_pos = self._pos
+
+    def _close_stream(self):
+        # close the response without draining the rest of the body
+        resp = getattr(self._key, 'resp', None)
+        if resp is not None:
+            resp.close()
+        self._key.close()
+        self._is_open = False
+
     def read(self, size=0):
-        return self.file.read(size)
+        if self._is_open and self._stream_pos != self._pos:
+            self._close_stream()
+        if not self._is_open:
+            if self._end is not None and self._pos >= self._end:
+                return ''
+            try:
+                self._open_stream()
+            except S3ResponseError, e:
+                # requested range starts past the end of the file
+                if e.status == 416:
+                    self._end = self._pos
+                    return ''
+                reraise(e)
+        data = self.file.read(size)
+        if not data:
+            # boto closes the key at the end of the stream, and reading it
+            # again would start over from the beginning of the file
+            self._is_open = False
+            self._end = self._pos
+            return data
+        self._pos += len(data)
+        self._stream_pos = self._pos
+        return data
+
+    def download_to(self, path_or_fileobj, workers=None, part_size=None):
+        """
+        Downloads the whole file into given path or seekable file object.
+        The file is split into ranges of `part_size` bytes which are fetched
+        concurrently by `workers` threads and written in place.
+        """
+        workers = workers or self._storage.multipart_workers
+        part_size = part_size or self._storage.multipart_part_size
+        key = self._storage.bucket.get_key(self._key.name)
+        if key is None:
+            raise FileNotFoundError(self.name, 404)
+
+        if isinstance(path_or_fileobj, basestring):
+            with open(path_or_fileobj, 'wb') as fileobj:
+                self._download_ranges(fileobj, key.size, workers, part_size)
+        else:
+            self._download_ranges(
+                path_or_fileobj, key.size, workers, part_size
+            )
 
-    def seek(self, *args, **kw):
-        raise NotImplementedError
+    def _download_ranges(self, fileobj, size, workers, part_size):
+        offset = fileobj.tell()
+        lock = threading.Lock()
+
+        def fetch(start):
+            end = min(start + part_size, size) - 1
+            key = Key(self._storage.bucket, self._key.name)
+            data = self._storage._with_retries(
+                lambda: key.get_contents_as_string(
+                    headers={'Range': 'bytes=%d-%d' % (start, end)}
+                )
+            )
+            with lock:
+                fileobj.seek(offset + start)
+                fileobj.write(data)
+
+        tasks = []
+        with WorkerPool(workers) as pool:
+            for start in xrange(0, size, part_size):
+                if any(task.done() and task.exception for task in tasks):
+                    break
+                tasks.append(pool.submit(fetch, start))
+        for task in tasks:
+            task.result()
+        fileobj.seek(offset + size)
 
     def write(self, *args, **kw):
         raise NotImplementedError
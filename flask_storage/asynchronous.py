@@ -0,0 +1,102 @@
+from __future__ import with_statement
+
+from flask import current_app
+
+from .utils import WorkerPool
+
+
+__all__ = ('AsyncStorage',)
+
+
+class AsyncStorage(object):
+    """
+    Runs the blocking operations of a storage on a bounded pool of worker
+    threads so that they don't stall event loops.
+
+    Every method returns a :class:`~flask_storage.utils.Task` right away.
+    Its result can be waited for with ``task.result()`` or handed over to
+    an event loop with ``task.add_done_callback``; the callback runs in the
+    worker thread, so it should use the thread safe scheduling method of
+    the loop (e.g. ``IOLoop.add_callback`` of tornado). While all workers
+    are busy and `queue_size` operations are waiting, new operations block
+    the caller.
+
+    The operations run inside the application context of the app that
+    created the storage.
+    """
+
+    def __init__(self, storage, workers=None, queue_size=None):
+        self.storage = storage
+        self.app = current_app._get_current_object()
+        self.workers = workers or current_app.config.get(
+            'STORAGE_ASYNC_WORKERS', 8)
+        self.pool = WorkerPool(self.workers, queue_size)
+
+    def save(self, name, content, overwrite=False):
+        return self._submit(self.storage.save, name, content, overwrite)
+
+    def open(self, name, mode='rb'):
+        return self._submit(self.storage.open, name, mode)
+
+    def read(self, file_or_name, size=-1):
+        """
+        Reads from given file, or the whole file with given name.
+        """
+        return self._submit(self._read, file_or_name, size)
+
+    def _read(self, file_or_name, size):
+        if isinstance(file_or_name, basestring):
+            file_or_name = self.storage.open(file_or_name)
+        return file_or_name.read(size)
+
+    def exists(self, name):
+        return self._submit(self.storage.exists, name)
+
+    def delete(self, name):
+        return self._submit(self.storage.delete, name)
+
+    def url(self, name):
+        return self._submit(self.storage.url, name)
+
+    def iter_files(self, prefix=None, delimiter=None, page_size=1000,
+                   marker=None):
+        """
+        Yields a task for every page of at most `page_size` file objects.
+        The next page is requested when the generator is resumed, so the
+        task yielded before should be done by then to avoid blocking.
+        """
+        while True:
+            page = {}
+            task = self._submit(
+                self._list_files, page, prefix, delimiter, page_size, marker
+            )
+            yield task
+            task.result()
+            marker = page['marker']
+            if marker is None:
+                break
+
+    def _list_files(self, page, prefix, delimiter, page_size, marker):
+        names, page['marker'] = self.storage.list_page(
+            prefix, delimiter, page_size, marker
+        )
+        return [
+            self.storage.file_class(self.storage, name) for name in names
+            if not delimiter or not name.endswith(delimiter)
+        ]
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait)
+
+    def _submit(self, func, *args, **kwargs):
+        return self.pool.submit(self._call, func, args, kwargs)
+
+    def _call(self, func, args, kwargs):
+        with self.app.app_context():
+            return func(*args, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
@@ -1,13 +1,32 @@
+from __future__ import absolute_import, with_statement
+import httplib
 import os
-import itertools
-from urlparse import urljoin
 
-from .utils import force_str, force_unicode
+from boto.exception import BotoClientError, BotoServerError
+from cloudfiles.errors import Error as CloudFilesError
+from flask import current_app
+
+from .naming import NAMING_STRATEGIES
+from .utils import WorkerPool, force_str, force_unicode, safe_join
 
 
 __all__ = ('Storage')
 
 
+#: Connection errors of the backend clients, including socket errors.
+CONNECTION_ERRORS = (IOError, httplib.HTTPException)
+
+#: Errors of the backend clients and the filesystem, which :func:`reraise`
+#: wraps in a :class:`StorageException`. Other exceptions are programming
+#: errors.
+CLIENT_ERRORS = CONNECTION_ERRORS + (
+    OSError,
+    BotoClientError,
+    BotoServerError,
+    CloudFilesError
+)
+
+
 def reraise(exception):
     kwargs = {
         'message': exception.message,
@@ -26,39 +45,6 @@ def reraise(exception):
     raise StorageException(**kwargs)
 
 
-def safe_join(base, *paths):
-    """
-    A version of django.utils._os.safe_join for S3 paths.
-
-    Joins one or more path components to the base path component
-    intelligently. Returns a normalized version of the final path.
-
-    The final path must be located inside of the base path component
-    (otherwise a ValueError is raised).
-
-    Paths outside the base path indicate a possible security
-    sensitive operation.
-    """
-    base_path = force_unicode(base)
-    base_path = base_path.rstrip('/')
-    paths = [force_unicode(p) for p in paths]
-
-    final_path = base_path
-    for path in paths:
-        final_path = urljoin(final_path.rstrip('/') + "/", path.rstrip("/"))
-
-    # Ensure final_path starts with base_path and that the next character after
-    # the final path is '/' (or nothing, in which case final_path must be
-    # equal to base_path).
-    base_path_len = len(base_path)
-    if not final_path.startswith(base_path) \
-            or final_path[base_path_len:base_path_len + 1] not in ('', '/'):
-        raise ValueError('the joined path is located outside of the base path'
-                         ' component')
-
-    return final_path.lstrip('/')
-
-
 class StorageException(Exception):
     def __init__(self, message='', status_code=None, wrapped_exception=None):
         self.status_code = status_code
@@ -94,6 +80,7 @@ class Storage(object):
     A base storage class, providing some default behaviors that all other
     storage systems can inherit or override, as necessary.
     """
+    _naming_strategy = None
 
     def open(self, name, mode='rb'):
         """
@@ -112,7 +99,7 @@ class Storage(object):
         name = os.path.normpath(name)
 
         if not overwrite:
-            name = self.get_available_name(name)
+            name = self.get_available_name(name, content)
         name = self._save(name, content)
 
         return name
@@ -120,22 +107,112 @@ class Storage(object):
     def _save(self, name, content):
         raise NotImplementedError
 
-    def get_available_name(self, name):
+    def save_many(self, items, workers=None):
+        """
+        Saves the ``(name, content)`` or ``(name, content, overwrite)``
+        tuples of given iterable concurrently with `workers` threads
+        (defaults to the ``STORAGE_SAVE_MANY_WORKERS`` config value, 8).
+        The iterable is consumed only as fast as the files get saved.
+
+        Returns a list with the saved file or the
+        :class:`StorageException` raised while saving it for every item,
+        in order; one failure doesn't stop the other items from being
+        saved.
+        """
+        workers = workers or current_app.config.get(
+            'STORAGE_SAVE_MANY_WORKERS',
+            8
+        )
+        # the naming strategy is read from the config of the current app,
+        # which isn't available in the worker threads
+        self.naming_strategy
+        return self._map(lambda item: self.save(*item), items, workers)
+
+    @property
+    def naming_strategy(self):
+        """
+        The naming strategy used by :meth:`get_available_name`. Defaults to
+        the strategy named by the ``STORAGE_NAMING_STRATEGY`` config value
+        ('sequential', 'listing', 'uuid' or 'hash').
+        """
+        if self._naming_strategy is None:
+            self.naming_strategy = current_app.config.get(
+                'STORAGE_NAMING_STRATEGY',
+                'sequential'
+            )
+        return self._naming_strategy
+
+    @naming_strategy.setter
+    def naming_strategy(self, value):
+        if isinstance(value, basestring):
+            value = NAMING_STRATEGIES[value]()
+        self._naming_strategy = value
+
+    def get_available_name(self, name, content=None):
         """
         Returns a filename that's free on the target storage system, and
         available for new content to be written to.
         """
-        dir_name, file_name = os.path.split(name)
-        file_root, file_ext = os.path.splitext(file_name)
-        # If the filename already exists, add an underscore and a number
-        # (before the file extension, if one exists) to the filename until the
-        # generated filename doesn't exist.
-        count = itertools.count(1)
-        while self.exists(name):
-            # file_ext includes the dot.
-            newname = "%s_%s%s" % (file_root, count.next(), file_ext)
-            name = safe_join(dir_name, newname)
-        return name
+        return self.naming_strategy.get_available_name(self, name, content)
+
+    def _names_with_prefix(self, prefix):
+        """
+        Returns the names of all files starting with given prefix using as
+        few requests as the storage system allows. Used by the 'listing'
+        naming strategy.
+        """
+        raise NotImplementedError
+
+    def list_page(self, prefix=None, delimiter=None, page_size=1000,
+                  marker=None):
+        """
+        Returns a tuple of at most `page_size` sorted names that start with
+        given prefix and come after given marker, and the marker of the
+        next page (None if this is the last page).
+
+        If a delimiter is given, names containing the delimiter after the
+        prefix are rolled up into a single name ending with the delimiter,
+        like folders.
+        """
+        raise NotImplementedError
+
+    def iter_files(self, prefix=None, delimiter=None, page_size=1000,
+                   marker=None):
+        """
+        Lazily yields file objects for the files that start with given
+        prefix, fetching `page_size` names at a time. The name of the last
+        yielded file can be given as `marker` to resume the iteration.
+        """
+        while True:
+            names, marker = self.list_page(
+                prefix, delimiter, page_size, marker
+            )
+            for name in names:
+                if not delimiter or not name.endswith(delimiter):
+                    yield self.file_class(self, name)
+            if marker is None:
+                break
+
+    def _paginate(self, names, prefix, delimiter, page_size, marker):
+        """
+        Implements :meth:`list_page` over an iterable of sorted names.
+        """
+        prefix = prefix or ''
+        page = []
+        for name in names:
+            if not name.startswith(prefix):
+                continue
+            if delimiter and delimiter in name[len(prefix):]:
+                rest = name[len(prefix):]
+                name = prefix + rest[:rest.index(delimiter) + len(delimiter)]
+                if page and page[-1] == name:
+                    continue
+            if marker is not None and name <= marker:
+                continue
+            page.append(name)
+            if len(page) == page_size:
+                return page, name
+        return page, None
 
     def path(self, name):
         """
@@ -177,6 +254,66 @@ class Storage(object):
         """
         raise NotImplementedError
 
+    def delete_many(self, names):
+        """
+        Deletes the specified files from the storage system. Returns a dict
+        mapping every name to None if the file was deleted or to the
+        :class:`StorageException` raised while deleting it; one failure
+        doesn't stop the others from being deleted.
+        """
+        return self._delete_each(names, workers=1)
+
+    def _delete_each(self, names, workers):
+        """
+        Implements :meth:`delete_many` with one :meth:`delete` call per name
+        on a pool of `workers` threads.
+        """
+        names = list(names)
+        return dict(zip(names, self._map(self.delete, names, workers)))
+
+    def _map(self, func, items, workers):
+        """
+        Calls `func` for every item on a pool of `workers` threads and
+        returns the results in order. A :class:`StorageException` raised by
+        a call becomes its result, as do the errors of the backend clients
+        (:data:`CLIENT_ERRORS`), wrapped like :func:`reraise` does. Other
+        exceptions are programming errors and propagate.
+        """
+        def call(item):
+            try:
+                return func(item)
+            except StorageException, e:
+                return e
+            except CLIENT_ERRORS, e:
+                try:
+                    reraise(e)
+                except StorageException, wrapped:
+                    return wrapped
+
+        if workers <= 1:
+            return [call(item) for item in items]
+        with WorkerPool(workers) as pool:
+            tasks = [pool.submit(call, item) for item in items]
+        return [task.result() for task in tasks]
+
+    def copy(self, src, dst):
+        """
+        Copies the file `src` to `dst`, replacing `dst` if it exists, and
+        returns the new file. This implementation streams the content
+        through the application; storages override it with copies that
+        don't.
+        """
+        return self.save(dst, self.open(src), overwrite=True)
+
+    def move(self, src, dst):
+        """
+        Moves the file `src` to `dst`, replacing `dst` if it exists, and
+        returns the moved file.
+        """
+        file_ = self.copy(src, dst)
+        self.delete(src)
+        return file_
+
     def exists(self, name):
         """
         Returns True if a file referened by the given name already exists in
@@ -191,6 +328,13 @@ class Storage(object):
         """
         raise NotImplementedError
 
+    def urls(self, names):
+        """
+        Returns the URLs of given names. Storages override this if they can
+        produce many URLs cheaper than one at a time.
+        """
+        return [self.url(name) for name in names]
+
     def _clean_name(self, name):
         """
         Cleans the name so that Windows style paths work
@@ -239,6 +383,7 @@ class StorageFile(object):
     _name = None
     prefix = ''
     _pos = 0
+    chunk_size = 65536
 
     @property
     def url(self):
@@ -268,7 +413,10 @@ class StorageFile(object):
         self._name = self.prefix + self._storage._clean_name(value)
 
     def rename(self, name):
-        raise NotImplementedError
+        """
+        Moves the file to given name with :meth:`Storage.move`.
+        """
+        self._name = self._storage.move(self.name, name).name
 
     def save(self, content, name=None):
         if name:
@@ -281,6 +429,30 @@ class StorageFile(object):
     def read(self, size=None):
         raise NotImplementedError
 
+    def iter_chunks(self, chunk_size=None):
+        """
+        Yields the rest of the file in chunks of at most `chunk_size` bytes
+        (defaults to :attr:`chunk_size`) without loading it into memory.
+        """
+        chunk_size = chunk_size or self.chunk_size
+        while True:
+            data = self.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+    def readinto(self, buffer):
+        """
+        Reads up to ``len(buffer)`` bytes into given writable buffer (e.g. a
+        bytearray) and returns the number of bytes read.
+        """
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def __iter__(self):
+        return self.iter_chunks()
+
     def seek(self, offset, whence=os.SEEK_SET):
         if whence == os.SEEK_SET:
             self._pos = offset
@@ -313,3 +485,102 @@ class StorageFile(object):
 
     def __bool__(self):
         return self._name is not None
+
+
+class StorageWrapper(Storage):
+    """
+    Base class for storages adding behavior on top of another storage.
+    Everything that isn't overridden is delegated to the wrapped storage.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __getattr__(self, name):
+        if name == 'storage':
+            raise AttributeError(name)
+        return getattr(self.storage, name)
+
+    @property
+    def folder_name(self):
+        return self.storage.folder_name
+
+    def _open(self, name, mode='rb'):
+        return self.storage.open(name, mode)
+
+    def _save(self, name, content):
+        # the name has already been made available by this storage
+        return self.storage.save(name, content, overwrite=True)
+
+    def _names_with_prefix(self, prefix):
+        return self.storage._names_with_prefix(prefix)
+
+    def path(self, name):
+        return self.storage.path(name)
+
+    def create_folder(self, name=None):
+        return self.storage.create_folder(name)
+
+    def delete_folder(self, name=None):
+        return self.storage.delete_folder(name)
+
+    def delete(self, name):
+        return self.storage.delete(name)
+
+    def delete_many(self, names):
+        return self.storage.delete_many(names)
+
+    def copy(self, src, dst):
+        return self.storage.copy(src, dst)
+
+    def move(self, src, dst):
+        return self.storage.move(src, dst)
+
+    def exists(self, name):
+        return self.storage.exists(name)
+
+    def url(self, name):
+        return self.storage.url(name)
+
+    def urls(self, names):
+        return self.storage.urls(names)
+
+
+class StorageFileWrapper(StorageFile):
+    """
+    A file of a wrapped storage exposed through a :class:`StorageWrapper`.
+    Everything that isn't overridden is delegated to the wrapped file.
+    """
+
+    def __init__(self, storage, file_, name=None):
+        self._storage = storage
+        self._file = file_
+        self._name = name or file_.name
+
+    def __getattr__(self, name):
+        if name == '_file':
+            raise AttributeError(name)
+        return getattr(self._file, name)
+
+    @property
+    def file(self):
+        return self._file
+
+    @property
+    def last_modified(self):
+        return self._file.last_modified
+
+    def read(self, *args, **kwargs):
+        return self._file.read(*args, **kwargs)
+
+    def iter_chunks(self, chunk_size=None):
+        return self._file.iter_chunks(chunk_size)
+
+    def readinto(self, buffer):
+        return self._file.readinto(buffer)
+
+    def seek(self, *args, **kwargs):
+        return self._file.seek(*args, **kwargs)
+
+    def tell(self):
+        return self._file.tell()
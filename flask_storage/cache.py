@@ -0,0 +1,414 @@
+from __future__ import with_statement
+import errno
+import hashlib
+import json
+import os
+import random
+import tempfile
+from contextlib import contextmanager
+
+from flask import current_app
+
+from .base import StorageFile, StorageFileWrapper, StorageWrapper, reraise
+from .helpers import _timestamp
+from .utils import force_str
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+__all__ = ('CachedStorage', 'CachedStorageFile')
+
+
+class CachedStorage(StorageWrapper):
+    """
+    Keeps local copies of the files of a remote storage in `cache_dir`, so
+    that files read over and over are downloaded only once and can be
+    opened by their :meth:`path`.
+
+    The cache holds at most `max_size` bytes. The total size is kept in a
+    counter file, and once it exceeds `max_size` the least recently used
+    (`policy` 'lru') or least frequently used ('lfu') files are evicted
+    until the cache is 90% full, so the cache is only scanned once in a
+    while. Unless `validate` is disabled, cached files are checked against
+    the ETag (or last modification time and size) of the remote file every
+    time they are opened.
+
+    Processes on one host can share a cache directory: downloads are
+    serialized with lock files and placed atomically, so readers never see
+    partial files. Locking requires :mod:`fcntl`; without it concurrent
+    processes might download the same file twice.
+    """
+
+    def __init__(self, storage, cache_dir=None, max_size=None, policy=None,
+                 validate=None):
+        StorageWrapper.__init__(self, storage)
+        self.cache_dir = cache_dir or current_app.config.get(
+            'STORAGE_CACHE_DIR',
+            os.path.join(tempfile.gettempdir(), 'flask-storage-cache')
+        )
+        self.max_size = max_size or current_app.config.get(
+            'STORAGE_CACHE_MAX_SIZE', 1024 * 1024 * 1024)
+        self.policy = policy or current_app.config.get(
+            'STORAGE_CACHE_POLICY', 'lru')
+        if self.policy not in ('lru', 'lfu'):
+            raise ValueError('Unknown cache policy %r' % self.policy)
+        if validate is None:
+            validate = current_app.config.get('STORAGE_CACHE_VALIDATE', True)
+        self.validate = validate
+        self._storage_key = '%s:%s' % (
+            type(storage).__name__, storage.folder_name
+        )
+        _ensure_directory(os.path.join(self.cache_dir, 'locks'))
+
+    def path(self, name):
+        """
+        Returns the path of the cached copy of given file, downloading it
+        first if needed.
+        """
+        return self._fetch(name)
+
+    def invalidate(self, name=None):
+        """
+        Removes given file, or every file of the wrapped storage if no name
+        is given, from the cache.
+        """
+        if name is not None:
+            path = self._entry_path(name)
+            with self._lock(path):
+                size = self._remove_entry(path)
+            if size:
+                self._update_size(-size)
+            return
+        for path in self._entries():
+            meta = self._read_meta(path)
+            if meta is not None and meta.get('storage') == self._storage_key:
+                self.invalidate(meta['name'])
+
+    def _open(self, name, mode='rb'):
+        return self.file_class(self, self.storage.open(name, mode))
+
+    def _save(self, name, content):
+        try:
+            file_ = self.storage.save(name, content, overwrite=True)
+        finally:
+            self.invalidate(name)
+        return self.file_class(self, file_)
+
+    def copy(self, src, dst):
+        self.invalidate(dst)
+        return self.file_class(self, self.storage.copy(src, dst))
+
+    def move(self, src, dst):
+        self.invalidate(dst)
+        try:
+            return self.file_class(self, self.storage.move(src, dst))
+        finally:
+            self.invalidate(src)
+
+    def delete(self, name):
+        try:
+            return self.storage.delete(name)
+        finally:
+            self.invalidate(name)
+
+    def delete_many(self, names):
+        names = list(names)
+        try:
+            return self.storage.delete_many(names)
+        finally:
+            for name in names:
+                self.invalidate(name)
+
+    def delete_folder(self, name=None):
+        try:
+            return self.storage.delete_folder(name)
+        finally:
+            self.invalidate()
+
+    def new_file(self, prefix=''):
+        return self.storage.file_class(self, prefix=prefix)
+
+    @property
+    def file_class(self):
+        return CachedStorageFile
+
+    def _fetch(self, name, remote=None):
+        """
+        Returns the path of an up to date cached copy of given file.
+        """
+        path = self._entry_path(name)
+        meta = self._read_meta(path)
+        if meta is not None and not self.validate:
+            self._touch(path, meta)
+            return path
+        if remote is None:
+            remote = self.storage.open(name)
+        validator = _validator(remote)
+        if meta is not None and meta['validator'] == validator:
+            self._touch(path, meta)
+            return path
+        total = None
+        with self._lock(path):
+            # another process might have downloaded it in the meantime
+            meta = self._read_meta(path)
+            if meta is None or meta['validator'] != validator:
+                total = self._download(name, remote, path, validator)
+        if total is not None and total > self.max_size:
+            self._evict(keep=path)
+        return path
+
+    def _download(self, name, remote, path, validator):
+        """
+        Downloads given file into place and returns the new total size of
+        the cache.
+        """
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix='.', suffix='.tmp'
+        )
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as destination:
+                remote.seek(0)
+                for chunk in remote.iter_chunks():
+                    destination.write(chunk)
+                    size += len(chunk)
+            replaced = _file_size(path)
+            os.rename(temp_path, path)
+        except (IOError, OSError), e:
+            _remove_quietly(temp_path)
+            reraise(e)
+        self._write_meta(path, {
+            'storage': self._storage_key,
+            'name': name,
+            'validator': validator,
+            'hits': 0
+        })
+        return self._update_size(size - replaced)
+
+    def _touch(self, path, meta):
+        try:
+            os.utime(path, None)
+        except OSError:
+            return
+        # hits are counted logarithmically: the counter is incremented
+        # with a probability of 1 / 2 ** hits, so that frequently used
+        # files don't rewrite their metadata on every hit. Concurrent
+        # increments might get lost, which is fine for a heuristic.
+        if self.policy == 'lfu':
+            hits = meta.get('hits', 0)
+            if random.random() < 1.0 / 2 ** hits:
+                meta['hits'] = hits + 1
+                self._write_meta(path, meta)
+
+    def _evict(self, keep=None):
+        """
+        Removes the least recently or least frequently used files until
+        the cache is 90% full and resets the size counter to the scanned
+        total.
+        """
+        with _locked(os.path.join(self.cache_dir, 'locks', 'evict.lock')):
+            entries = []
+            total = 0
+            for path in self._entries():
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                total += stat.st_size
+                if path == keep:
+                    continue
+                if self.policy == 'lfu':
+                    meta = self._read_meta(path) or {}
+                    rank = (meta.get('hits', 0), stat.st_mtime)
+                else:
+                    rank = (stat.st_mtime,)
+                entries.append((rank, path))
+            for rank, path in sorted(entries):
+                if total <= self.max_size * 0.9:
+                    break
+                with self._lock(path):
+                    total -= self._remove_entry(path)
+            # changes made by other processes during the scan might be
+            # miscounted; the next scan corrects that
+            self._update_size(total=total)
+
+    def _update_size(self, delta=0, total=None):
+        """
+        Adds `delta` bytes to the size counter of the cache, or sets it to
+        `total`, and returns the new total. A missing counter is
+        initialized by scanning the cache.
+        """
+        counter = os.path.join(self.cache_dir, 'locks', 'size')
+        with _locked(counter + '.lock'):
+            if total is None:
+                try:
+                    with open(counter, 'rb') as counter_file:
+                        total = int(counter_file.read()) + delta
+                except (IOError, ValueError):
+                    total = sum(
+                        _file_size(path) for path in self._entries()
+                    )
+            total = max(total, 0)
+            with open(counter, 'wb') as counter_file:
+                counter_file.write(str(total))
+        return total
+
+    def _remove_entry(self, path):
+        """
+        Removes a cached file and returns its size. Callers hold the lock
+        of the entry.
+        """
+        size = _file_size(path)
+        _remove_quietly(path + '.json')
+        if not _remove_quietly(path):
+            return 0
+        return size
+
+    def _entries(self):
+        """
+        Yields the path of every file of the cache.
+        """
+        for directory, dirnames, filenames in os.walk(self.cache_dir):
+            dirnames[:] = [name for name in dirnames if name != 'locks']
+            for filename in filenames:
+                # skip metadata and temporary files
+                if filename.startswith('.') or filename.endswith('.json'):
+                    continue
+                yield os.path.join(directory, filename)
+
+    def _entry_path(self, name):
+        digest = hashlib.sha1(
+            force_str(u'%s\0%s' % (self._storage_key, name))
+        ).hexdigest()
+        directory = os.path.join(self.cache_dir, digest[:2])
+        _ensure_directory(directory)
+        return os.path.join(directory, digest)
+
+    def _read_meta(self, path):
+        try:
+            with open(path + '.json', 'rb') as meta_file:
+                meta = json.load(meta_file)
+        except (IOError, ValueError):
+            return None
+        if not os.path.exists(path):
+            return None
+        return meta
+
+    def _write_meta(self, path, meta):
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix='.', suffix='.tmp'
+        )
+        try:
+            with os.fdopen(fd, 'wb') as meta_file:
+                json.dump(meta, meta_file)
+            os.rename(temp_path, path + '.json')
+        except (IOError, OSError), e:
+            _remove_quietly(temp_path)
+            reraise(e)
+
+    def _lock(self, path):
+        # entries share 256 lock files, so lock files never have to be
+        # removed while another process might be waiting for them
+        return _locked(os.path.join(
+            self.cache_dir, 'locks', os.path.basename(path)[:2] + '.lock'
+        ))
+
+
+class CachedStorageFile(StorageFileWrapper):
+    """
+    A file of the wrapped storage whose content is read from the local
+    copy of a :class:`CachedStorage`. The file is downloaded when its
+    content or path is first needed.
+    """
+
+    _local = None
+
+    @property
+    def path(self):
+        return self._storage._fetch(self.name, self._file)
+
+    @property
+    def local(self):
+        if self._local is None:
+            try:
+                self._local = open(self.path, 'rb')
+            except IOError, e:
+                if e.errno != errno.ENOENT:
+                    reraise(e)
+                # evicted right after it was fetched
+                self._local = open(self.path, 'rb')
+        return self._local
+
+    @property
+    def size(self):
+        if self._local is not None:
+            return os.fstat(self._local.fileno()).st_size
+        return self._file.size
+
+    def read(self, size=-1):
+        return self.local.read(size)
+
+    def iter_chunks(self, chunk_size=None):
+        return StorageFile.iter_chunks(self, chunk_size)
+
+    def readinto(self, buffer):
+        return self.local.readinto(buffer)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.local.seek(offset, whence)
+
+    def tell(self):
+        return self.local.tell()
+
+    def close(self):
+        if self._local is not None:
+            self._local.close()
+            self._local = None
+
+
+def _validator(file_):
+    """
+    Returns a string that changes whenever the content of given file
+    changes.
+    """
+    etag = getattr(file_, 'etag', None)
+    if etag:
+        return 'etag:%s' % etag.strip('"')
+    return 'modified:%s:%s' % (
+        _timestamp(getattr(file_, 'last_modified', None)),
+        file_.size
+    )
+
+
+@contextmanager
+def _locked(path):
+    with open(path, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+def _ensure_directory(directory):
+    try:
+        os.makedirs(directory)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            reraise(e)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        return False
+    return True
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
@@ -1,24 +1,50 @@
 from __future__ import absolute_import
 
+from StringIO import StringIO
 import mimetypes
+import os
+import threading
+import time
+from contextlib import contextmanager
 import cloudfiles
 from cloudfiles.errors import NoSuchObject, ResponseError, NoSuchContainer
 from flask import current_app, request
 from werkzeug.utils import cached_property
 
 from .base import Storage, StorageFile, reraise
+from .utils import ObjectPool, force_str
 
 __all__ = ('CloudFilesStorage',)
 
 
+#: Times when containers were last verified to be public, keyed by
+#: (username, container name). Shared by all storages of the process.
+_public_containers = {}
+
+
 class CloudFilesStorage(Storage):
     def __init__(self,
                  folder_name=None,
                  username=None,
                  api_key=None,
-                 timeout=None):
+                 timeout=None,
+                 delete_workers=None,
+                 read_ahead=None,
+                 read_ahead_max=None,
+                 connection_pool_size=None):
         """
         Initialize the settings for the connection and container.
+
+        cloudfiles connections aren't thread safe, so every operation
+        borrows a container with a connection of its own from a pool of the
+        storage and returns it afterwards. At most `connection_pool_size`
+        idle connections are kept for the worker threads of later
+        operations.
+
+        Small reads are served from a read-ahead buffer of files that is
+        filled with ranged requests of at least `read_ahead` bytes. The
+        window doubles on every sequential refill up to `read_ahead_max`
+        bytes. A `read_ahead` of 0 disables buffering.
         """
         self.username = username or current_app.config.get(
             'CLOUDFILES_USERNAME', None)
@@ -28,12 +54,31 @@ class CloudFilesStorage(Storage):
             current_app.config.get('CLOUDFILES_CONTAINER', None)
         self.timeout = timeout or current_app.config.get(
             'CLOUDFILES_TIMEOUT', 5)
+        self.delete_workers = delete_workers or current_app.config.get(
+            'CLOUDFILES_DELETE_WORKERS', 8)
+        if read_ahead is None:
+            read_ahead = current_app.config.get(
+                'CLOUDFILES_READ_AHEAD', 64 * 1024)
+        self.read_ahead = read_ahead
+        self.read_ahead_max = read_ahead_max or current_app.config.get(
+            'CLOUDFILES_READ_AHEAD_MAX', 4 * 1024 * 1024)
         self.use_servicenet = current_app.config.get(
             'CLOUDFILES_SERVICENET', False)
         self.auto_create_container = current_app.config.get(
             'CLOUDFILES_AUTO_CREATE_CONTAINER', False)
         self.secure_uris = current_app.config.get(
             'CLOUDFILES_SECURE_URIS', False)
+        self.make_container_public = current_app.config.get(
+            'CLOUDFILES_MAKE_CONTAINER_PUBLIC', True)
+        self.public_check_ttl = current_app.config.get(
+            'CLOUDFILES_PUBLIC_CHECK_TTL', 300)
+        self.connection_pool_size = connection_pool_size or \
+            current_app.config.get('CLOUDFILES_CONNECTION_POOL_SIZE', 8)
+        self._containers = ObjectPool(
+            self._connect, self.connection_pool_size
+        )
+        # the container lent to the current thread
+        self._local = threading.local()
 
     @property
     def folder_name(self):
@@ -43,22 +88,65 @@ class CloudFilesStorage(Storage):
     def folder(self):
         return self.container
 
-    @cached_property
+    @property
     def connection(self):
-        return cloudfiles.get_connection(
+        return self.container.conn
+
+    @property
+    def container(self):
+        """
+        The container lent to the current thread. Threads using it outside
+        of the operations of the storage keep one for good.
+        """
+        container = getattr(self._local, 'container', None)
+        if container is None:
+            container = self._local.container = self._containers.acquire()
+        if self.make_container_public:
+            self._ensure_public(container)
+        return container
+
+    @contextmanager
+    def _checkout(self):
+        """
+        Lends a container of the pool to the current thread until the
+        block exits, unless the thread already has one.
+        """
+        if getattr(self._local, 'container', None) is not None:
+            yield self.container
+            return
+        self._local.container = self._containers.acquire()
+        try:
+            yield self.container
+        finally:
+            self._containers.release(self._local.container)
+            self._local.container = None
+
+    def _connect(self):
+        connection = cloudfiles.get_connection(
             username=self.username,
             api_key=self.api_key,
             timeout=self.timeout,
             servicenet=self.use_servicenet
         )
+        return self._get_or_create_container(connection, self.container_name)
 
-    @property
-    def container(self):
-        if not hasattr(self, '_container'):
-            self._container = self._get_or_create_container(self.container_name)
-        if not self._container.is_public():
-            self._container.make_public()
-        return self._container
+    def _ensure_public(self, container):
+        """
+        Makes sure the container is public. The check is done at most once
+        per `public_check_ttl` seconds (or only once if the ttl is None)
+        for each container in the process.
+        """
+        checked_at = _public_containers.get(
+            (self.username, self.container_name)
+        )
+        now = time.time()
+        if checked_at is not None and (
+                self.public_check_ttl is None or
+                now - checked_at < self.public_check_ttl):
+            return
+        if not container.is_public():
+            container.make_public()
+        _public_containers[(self.username, self.container_name)] = now
 
     @cached_property
     def container_url(self):
@@ -66,18 +154,23 @@ class CloudFilesStorage(Storage):
             'CLOUDFILES_CONTAINER_URIS', {})
         if self.container_name in container_uris:
             return container_uris[self.container_name]
-        if self.secure_uris or request.is_secure:
-            return self.container.public_ssl_uri()
-        else:
-            return self.container.public_uri()
+        with self._checkout() as container:
+            if self.secure_uris or request.is_secure:
+                return container.public_ssl_uri()
+            else:
+                return container.public_uri()
 
-    def _get_or_create_container(self, name):
+    def _get_or_create_container(self, connection, name):
         """Retrieves a bucket if it exists, otherwise creates it."""
         try:
-            return self.connection.get_container(name)
+            return connection.get_container(name)
         except NoSuchContainer:
             if self.auto_create_container:
-                return self.connection.create_container(name)
+                container = connection.create_container(name)
+                if self.make_container_public:
+                    container.make_public()
+                    _public_containers[(self.username, name)] = time.time()
+                return container
             else:
                 raise RuntimeError(
                     "Container specified by "
@@ -90,35 +183,110 @@ class CloudFilesStorage(Storage):
         Use the Cloud Files service to write a `werkzeug.FileStorage`
         (called ``file``) to a remote file (called ``name``).
         """
-        cloud_obj = self.container.create_object(name)
-        mimetype, _ = mimetypes.guess_type(name)
-        cloud_obj.content_type = mimetype
-        cloud_obj.send(content)
-        return self.open(name)
+        if isinstance(content, basestring):
+            content = StringIO(force_str(content))
+        with self._checkout() as container:
+            cloud_obj = container.create_object(name)
+            mimetype, _ = mimetypes.guess_type(name)
+            cloud_obj.content_type = mimetype
+            # with a known size the content is sent with a Content-Length
+            # instead of chunked transfer encoding
+            cloud_obj.size = self._content_size(content)
+            cloud_obj.send(content)
+        # the upload doesn't tell the modification time (nor the size of
+        # chunked content) of the object, so it is fetched when needed
+        return self.file_class(self, name)
+
+    def _content_size(self, content):
+        """
+        Returns the number of bytes left in given file-like object or None
+        if the object is not seekable.
+        """
+        try:
+            position = content.tell()
+            content.seek(0, os.SEEK_END)
+            size = content.tell() - position
+            content.seek(position)
+        except (AttributeError, IOError):
+            return None
+        return size
 
     def _open(self, name, mode='rb'):
-        return self.file_class(self, name)
+        file_ = self.file_class(self, name)
+        # make sure the object exists
+        file_.file
+        return file_
 
     def delete(self, name):
         """
         Deletes the specified file from the storage system.
         """
         try:
-            self.container.delete_object(name)
+            with self._checkout() as container:
+                container.delete_object(name)
         except ResponseError, e:
             reraise(e)
 
+    def delete_many(self, names):
+        """
+        Deletes the specified files using `delete_workers` concurrent
+        requests.
+        """
+        return self._delete_each(names, self.delete_workers)
+
+    def copy(self, src, dst):
+        """
+        Copies the object on the server side.
+        """
+        try:
+            with self._checkout():
+                self.get_object(src).copy_to(self.container_name, dst)
+        except ResponseError, e:
+            reraise(e)
+        return self.file_class(self, dst)
+
     def exists(self, name):
         """
         Returns True if a file referenced by the given name already exists in
         the storage system, or False if the name is available for a new file.
         """
         try:
-            self.container.get_object(name)
+            with self._checkout() as container:
+                container.get_object(name)
             return True
         except NoSuchObject:
             return False
 
+    def _names_with_prefix(self, prefix):
+        # listings are capped at 10000 names, so they are paginated
+        names = []
+        marker = None
+        while True:
+            page, marker = self.list_page(
+                prefix, page_size=10000, marker=marker
+            )
+            names.extend(page)
+            if marker is None:
+                return names
+
+    def list_page(self, prefix=None, delimiter=None, page_size=1000,
+                  marker=None):
+        params = {'limit': page_size}
+        if prefix:
+            params['prefix'] = prefix
+        if delimiter:
+            params['delimiter'] = delimiter
+        if marker:
+            params['marker'] = marker
+        try:
+            with self._checkout() as container:
+                names = container.list_objects(**params)
+        except ResponseError, e:
+            reraise(e)
+        if len(names) < page_size:
+            return names, None
+        return names, names[-1]
+
     def url(self, name):
         """
         Returns an absolute URL where the file's contents can be accessed
@@ -128,8 +296,10 @@ class CloudFilesStorage(Storage):
 
     def get_object(self, name):
         try:
-            return self.container.get_object(name)
+            with self._checkout() as container:
+                return container.get_object(name)
         except NoSuchObject, e:
+            e.status = 404
             reraise(e)
         except ResponseError, e:
             reraise(e)
@@ -141,14 +311,20 @@ class CloudFilesStorage(Storage):
 
 class CloudFilesStorageFile(StorageFile):
     _file = None
+    _buffer = ''
+    _buffer_start = 0
+    _window = 0
 
-    def __init__(self, storage, name=None, prefix=''):
+    def __init__(self, storage, name=None, prefix='', cloud_obj=None):
+        """
+        The cloudfiles object is fetched lazily when content or metadata
+        is needed, unless an already fetched `cloud_obj` is given.
+        """
         self._storage = storage
         self.prefix = prefix
         if name is not None:
             self.name = name
-        if self._name:
-            self.file
+        self._file = cloud_obj
         self._pos = 0
 
     @property
@@ -157,8 +333,110 @@ class CloudFilesStorageFile(StorageFile):
             self._file = self._storage.get_object(self.name)
         return self._file
 
+    @property
+    def etag(self):
+        return self.file.etag
+
+    @property
+    def last_modified(self):
+        return self.file.last_modified
+
+    def rename(self, name):
+        StorageFile.rename(self, name)
+        self._file = None
+        self._buffer = ''
+
     def read(self, size=-1, **kw):
-        kw['offset'] = self._pos
-        data = self.file.read(size, **kw)
+        """
+        Reads from the read-ahead buffer, refilling it with a single
+        ranged request when it runs out. Extra keyword arguments are
+        passed to the read method of the cloudfiles object and bypass the
+        buffer.
+        """
+        if kw or not self._storage.read_ahead:
+            kw['offset'] = self._pos
+            with self._request() as cloud_obj:
+                data = cloud_obj.read(size, **kw)
+            self._pos += len(data)
+            return data
+        data = self._read_buffer(size)
+        if size is None or size < 0:
+            rest = self._fetch(self.size - self._pos)
+            self._pos += len(rest)
+            data += rest
+        elif len(data) < size:
+            self._fill(size - len(data))
+            data += self._read_buffer(size - len(data))
+        return data
+
+    def _read_buffer(self, size):
+        """
+        Returns at most `size` buffered bytes at the current position.
+        """
+        offset = self._pos - self._buffer_start
+        if not 0 <= offset < len(self._buffer):
+            return ''
+        if size is None or size < 0:
+            data = self._buffer[offset:]
+        else:
+            data = self._buffer[offset:offset + size]
         self._pos += len(data)
         return data
+
+    def _fill(self, size):
+        """
+        Buffers at least `size` bytes at the current position. The window
+        grows while the file is read sequentially and is reset by seeks
+        outside of the buffer.
+        """
+        if self._buffer and \
+                self._pos == self._buffer_start + len(self._buffer):
+            self._window = min(self._window * 2, self._storage.read_ahead_max)
+        else:
+            self._window = self._storage.read_ahead
+        self._buffer = self._fetch(max(size, self._window))
+        self._buffer_start = self._pos
+
+    def _fetch(self, size):
+        size = min(size, self.size - self._pos)
+        if size <= 0:
+            return ''
+        with self._request() as cloud_obj:
+            return cloud_obj.read(size, offset=self._pos)
+
+    @contextmanager
+    def _request(self):
+        """
+        Makes the object use a container lent to the current thread, so
+        that it never shares a connection with another thread.
+        """
+        with self._storage._checkout() as container:
+            cloud_obj = self.file
+            cloud_obj.container = container
+            yield cloud_obj
+
+    def iter_chunks(self, chunk_size=None):
+        """
+        Streams the rest of the object with a single GET request instead of
+        one ranged request per chunk.
+
+        The connection can't be used for anything else until the stream
+        has been consumed; cloudfiles reconnects if the stream is left
+        unfinished.
+        """
+        chunk_size = chunk_size or self.chunk_size
+        while True:
+            data = self._read_buffer(chunk_size)
+            if not data:
+                break
+            yield data
+        if self._pos >= self.size:
+            return
+        headers = {'Range': 'bytes=%d-' % self._pos} if self._pos else None
+        try:
+            with self._request() as cloud_obj:
+                for data in cloud_obj.stream(chunk_size, headers):
+                    self._pos += len(data)
+                    yield data
+        except ResponseError, e:
+            reraise(e)
@@ -0,0 +1,218 @@
+import hashlib
+import tempfile
+
+from flask import current_app
+
+from .base import (
+    FileNotFoundError,
+    Storage,
+    StorageException,
+    StorageFileWrapper,
+    StorageWrapper
+)
+from .utils import force_str
+
+
+__all__ = ('ContentAddressedStorage', 'ContentAddressedStorageFile')
+
+
+class ContentAddressedStorage(StorageWrapper):
+    """
+    Stores every distinct content only once in the wrapped storage.
+
+    The content of a file is stored as a blob named by its digest. Each
+    file name gets a small reference object containing the digest and a
+    link marker listed under the digest, so that the blob can be deleted
+    once the last name referring to it is deleted::
+
+        blobs/<digest[:2]>/<digest>
+        refs/<name>
+        links/<digest>/<sha1 of name>
+
+    The content is hashed while it is read once and spooled into a
+    temporary file that stays in memory up to `spool_size` bytes. Uploads
+    of content that already exists are skipped.
+
+    Deleting the last name of some content while the same content is
+    being saved from another process may leave the new name without a
+    blob; the wrapper doesn't lock across processes.
+    """
+
+    blob_prefix = 'blobs'
+    ref_prefix = 'refs'
+    link_prefix = 'links'
+    chunk_size = 65536
+
+    def __init__(self, storage, hash_name=None, spool_size=None):
+        StorageWrapper.__init__(self, storage)
+        self.hash_name = hash_name or current_app.config.get(
+            'STORAGE_CONTENT_HASH', 'sha256')
+        self.spool_size = spool_size or current_app.config.get(
+            'STORAGE_CONTENT_SPOOL_SIZE', 1024 * 1024)
+
+    def digest(self, name):
+        """
+        Returns the digest of the content stored under given name.
+        """
+        try:
+            return self.storage.open(self._ref_name(name)).read().strip()
+        except FileNotFoundError:
+            raise FileNotFoundError(name, 404)
+
+    def exists(self, name):
+        return self.storage.exists(self._ref_name(name))
+
+    def _open(self, name, mode='rb'):
+        blob = self.storage.open(self._blob_name(self.digest(name)), mode)
+        return self.file_class(self, blob, name)
+
+    def _save(self, name, content):
+        digest, spooled = self._hash(content)
+        try:
+            old_digest = self.digest(name)
+        except FileNotFoundError:
+            old_digest = None
+
+        # link before checking the blob so that a concurrent delete of the
+        # last other name doesn't remove it
+        self.storage.save(self._link_name(digest, name), '', overwrite=True)
+        blob_name = self._blob_name(digest)
+        if not self.storage.exists(blob_name):
+            self.storage.save(blob_name, spooled, overwrite=True)
+        self.storage.save(self._ref_name(name), digest, overwrite=True)
+
+        if old_digest is not None and old_digest != digest:
+            self._unlink(old_digest, name)
+        return self.file_class(self, self.storage.open(blob_name), name)
+
+    def copy(self, src, dst):
+        """
+        Adds `dst` as another name of the content of `src`; the blob itself
+        isn't copied.
+        """
+        digest = self.digest(src)
+        try:
+            old_digest = self.digest(dst)
+        except FileNotFoundError:
+            old_digest = None
+        self.storage.save(self._link_name(digest, dst), '', overwrite=True)
+        self.storage.save(self._ref_name(dst), digest, overwrite=True)
+        if old_digest is not None and old_digest != digest:
+            self._unlink(old_digest, dst)
+        return self.open(dst)
+
+    def move(self, src, dst):
+        return Storage.move(self, src, dst)
+
+    def delete(self, name):
+        digest = self.digest(name)
+        self.storage.delete(self._ref_name(name))
+        self._unlink(digest, name)
+
+    def delete_many(self, names):
+        return Storage.delete_many(self, names)
+
+    def url(self, name):
+        return self.storage.url(self._blob_name(self.digest(name)))
+
+    def urls(self, names):
+        return self.storage.urls([
+            self._blob_name(self.digest(name)) for name in names
+        ])
+
+    def path(self, name):
+        return self.storage.path(self._blob_name(self.digest(name)))
+
+    def _names_with_prefix(self, prefix):
+        offset = len(self.ref_prefix) + 1
+        return [
+            name[offset:] for name in
+            self.storage._names_with_prefix(self._ref_name(prefix))
+        ]
+
+    def list_page(self, prefix=None, delimiter=None, page_size=1000,
+                  marker=None):
+        offset = len(self.ref_prefix) + 1
+        names, marker = self.storage.list_page(
+            self._ref_name(prefix or ''),
+            delimiter,
+            page_size,
+            self._ref_name(marker) if marker else None
+        )
+        return (
+            [name[offset:] for name in names],
+            marker[offset:] if marker else None
+        )
+
+    def _hash(self, content):
+        """
+        Returns the digest of given content and the content ready to be
+        read from the beginning, reading the content only once.
+        """
+        digest = hashlib.new(self.hash_name)
+        if isinstance(content, basestring):
+            content = force_str(content)
+            digest.update(content)
+            return digest.hexdigest(), content
+
+        spooled = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        content.seek(0)
+        for chunk in iter(lambda: content.read(self.chunk_size), ''):
+            digest.update(chunk)
+            spooled.write(chunk)
+        spooled.seek(0)
+        return digest.hexdigest(), spooled
+
+    def _unlink(self, digest, name):
+        try:
+            self.storage.delete(self._link_name(digest, name))
+        except FileNotFoundError:
+            pass
+        remaining, marker = self.storage.list_page(
+            self._link_name(digest, ''),
+            page_size=1
+        )
+        if not remaining:
+            try:
+                self.storage.delete(self._blob_name(digest))
+            except FileNotFoundError:
+                pass
+
+    def _blob_name(self, digest):
+        return '%s/%s/%s' % (self.blob_prefix, digest[:2], digest)
+
+    def _ref_name(self, name):
+        return '%s/%s' % (self.ref_prefix, name)
+
+    def _link_name(self, digest, name):
+        if not name:
+            return '%s/%s/' % (self.link_prefix, digest)
+        return '%s/%s/%s' % (
+            self.link_prefix,
+            digest,
+            hashlib.sha1(force_str(name)).hexdigest()
+        )
+
+    def new_file(self, prefix=''):
+        raise StorageException(
+            'Files of a content addressed storage are created with save().'
+        )
+
+    @property
+    def file_class(self):
+        return ContentAddressedStorageFile
+
+
+class ContentAddressedStorageFile(StorageFileWrapper):
+    """
+    A file of a :class:`ContentAddressedStorage`. The content is read from
+    the blob of the wrapped storage.
+    """
+
+    @property
+    def url(self):
+        return self._file.url
+
+    @property
+    def digest(self):
+        return self._storage.digest(self.name)
@@ -1,11 +1,47 @@
 from __future__ import with_statement
 import errno
+import itertools
+import mimetypes
 import os
+import re
 import shutil
-import StringIO
+import stat
+import sys
+import threading
+import time
+import uuid
 
 from flask import current_app, url_for
 from .base import Storage, StorageFile, StorageException, reraise as _reraise
+from .utils import LRUCache, force_str, gzip_copy
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from os import sendfile
+except ImportError:
+    try:
+        from sendfile import sendfile
+    except ImportError:
+        sendfile = None
+
+#: The ioctl request cloning a file on Linux, _IOW(0x94, 9, int).
+FICLONE = 0x40049409
+
+#: Names of the temporary files that saves are written to before they are
+#: renamed into place.
+TEMP_FILE_PATTERN = re.compile(r'^\..+\.[0-9a-f]{32}\.tmp$')
 
 
 def reraise(exception):
@@ -17,12 +53,142 @@ def reraise(exception):
     _reraise(exception)
 
 
+class DirEntry(object):
+    """
+    A minimal stand-in for the entries returned by scandir, used when
+    neither os.scandir nor the scandir package is available. The stat
+    result is fetched once and reused for all type and size checks.
+    """
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._stat = None
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_dir(self):
+        try:
+            return stat.S_ISDIR(self.stat().st_mode)
+        except OSError:
+            return False
+
+    def is_file(self):
+        try:
+            return stat.S_ISREG(self.stat().st_mode)
+        except OSError:
+            return False
+
+
+def temporary_path(path):
+    """
+    Returns the path of a new temporary file next to given path.
+    """
+    directory, name = os.path.split(path)
+    return os.path.join(directory, '.%s.%s.tmp' % (name, uuid.uuid4().hex))
+
+
+def is_temp_file(name):
+    return TEMP_FILE_PATTERN.match(name) is not None
+
+
+def scan_directory(path):
+    """
+    Returns the entries of given directory using scandir when available,
+    so that entry types come from the directory listing itself instead
+    of one stat call per entry.
+    """
+    if scandir is not None:
+        return scandir(path)
+    return [DirEntry(path, name) for name in os.listdir(path)]
+
+
+def fsync_path(path):
+    """
+    Flushes given file or directory to disk.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DirectorySync(object):
+    """
+    Serializes the fsync calls of a single directory. A thread asking for a
+    sync while another sync is running waits for it and then runs a single
+    sync on behalf of everyone who arrived in the meantime.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._requested = 0
+        self._completed = 0
+        self._running = False
+
+    def sync(self, path):
+        with self._condition:
+            self._requested += 1
+            ticket = self._requested
+            while self._completed < ticket:
+                if self._running:
+                    self._condition.wait()
+                    continue
+                self._running = True
+                covered = self._requested
+                self._condition.release()
+                try:
+                    fsync_path(path)
+                finally:
+                    self._condition.acquire()
+                    self._running = False
+                    self._condition.notify_all()
+                self._completed = covered
+
+
+class GroupCommit(object):
+    """
+    Batches directory fsyncs of concurrent saves. Every call to
+    :meth:`sync` returns only after a fsync of the directory that started
+    after the call was made, but concurrent callers share the same fsync.
+    """
+
+    def __init__(self, max_directories=1024):
+        self._lock = threading.Lock()
+        self._directories = LRUCache(max_directories)
+
+    def sync(self, path):
+        with self._lock:
+            directory_sync = self._directories.get(path)
+            if directory_sync is None:
+                directory_sync = DirectorySync()
+                self._directories.set(path, directory_sync)
+        directory_sync.sync(path)
+
+
+#: Shared by all storages of the process so that saves made through
+#: different storage instances are batched too.
+directory_group_commit = GroupCommit()
+
+#: Absolute paths of directories known to exist, so that saves don't need
+#: to try to create their directory every time.
+known_directories = LRUCache(max_size=4096)
+
+
 class FileSystemStorage(Storage):
     """
     Standard filesystem storage
     """
 
-    def __init__(self, folder_name=None, file_view=None):
+    def __init__(self, folder_name=None, file_view=None, buffer_size=None,
+                 hard_link=None, durability=None, group_commit=None,
+                 gzip=None, gzip_content_types=None,
+                 gzip_compression_level=None, delete_workers=None,
+                 temp_file_max_age=None):
         if folder_name is None:
             folder_name = current_app.config.get(
                 'UPLOADS_FOLDER',
@@ -33,6 +199,52 @@ class FileSystemStorage(Storage):
                 'FILE_SYSTEM_STORAGE_FILE_VIEW',
                 'uploads.uploaded_file'
             )
+        self.buffer_size = buffer_size or current_app.config.get(
+            'FILE_SYSTEM_STORAGE_BUFFER_SIZE',
+            65536
+        )
+        self.hard_link = hard_link or current_app.config.get(
+            'FILE_SYSTEM_STORAGE_HARD_LINK',
+            False
+        )
+        self.durability = durability or current_app.config.get(
+            'FILE_SYSTEM_STORAGE_DURABILITY',
+            'none'
+        )
+        if self.durability not in ('none', 'file', 'directory'):
+            raise StorageException(
+                "Durability must be one of 'none', 'file' or 'directory'."
+            )
+        self.group_commit = group_commit or current_app.config.get(
+            'FILE_SYSTEM_STORAGE_GROUP_COMMIT',
+            False
+        )
+        self.gzip = gzip or current_app.config.get(
+            'FILE_SYSTEM_STORAGE_GZIP',
+            False
+        )
+        self.gzip_content_types = gzip_content_types or \
+            current_app.config.get(
+                'GZIP_CONTENT_TYPES', (
+                    'text/css',
+                    'application/javascript',
+                    'application/x-javascript',
+                )
+            )
+        self.gzip_compression_level = gzip_compression_level or \
+            current_app.config.get(
+                'FILE_SYSTEM_STORAGE_GZIP_COMPRESSION_LEVEL',
+                6
+            )
+        self.delete_workers = delete_workers or current_app.config.get(
+            'FILE_SYSTEM_STORAGE_DELETE_WORKERS',
+            4
+        )
+        self.temp_file_max_age = temp_file_max_age or \
+            current_app.config.get(
+                'FILE_SYSTEM_STORAGE_TEMP_FILE_MAX_AGE',
+                24 * 60 * 60
+            )
         self._folder_name = folder_name
         self._file_view = file_view
         self._absolute_path = os.path.abspath(folder_name)
@@ -44,43 +256,274 @@ class FileSystemStorage(Storage):
     def list_folders(self):
         if not self._absolute_path:
             raise StorageException('No folder given in class constructor.')
-        return filter(
-            lambda a: os.path.isdir(os.path.join(self._absolute_path, a)),
-            os.listdir(self._absolute_path)
-        )
+        return [
+            entry.name for entry in scan_directory(self._absolute_path)
+            if entry.is_dir()
+        ]
 
     def list_files(self):
         if not self._absolute_path:
             raise StorageException('No folder given in class constructor.')
-        return filter(
-            lambda a: not os.path.isdir(os.path.join(self._absolute_path, a)),
-            os.listdir(self._absolute_path)
-        )
+        return [
+            entry.name for entry in scan_directory(self._absolute_path)
+            if not entry.is_dir() and not is_temp_file(entry.name)
+        ]
+
+    def walk_files(self, prefix=''):
+        """
+        Recursively yields a (name, size, last_modified) tuple for every
+        file whose name starts with given prefix, in no particular order.
+        Every folder is listed once and sizes and modification times come
+        from the stat results of the directory entries.
+        """
+        stack = [os.path.split(prefix)]
+        while stack:
+            directory, name_prefix = stack.pop()
+            try:
+                entries = scan_directory(self.path(directory))
+            except OSError, e:
+                if e.errno == errno.ENOENT:
+                    continue
+                reraise(e)
+            for entry in entries:
+                if not entry.name.startswith(name_prefix):
+                    continue
+                if directory:
+                    name = '%s/%s' % (directory, entry.name)
+                else:
+                    name = entry.name
+                if entry.is_dir():
+                    stack.append((name, ''))
+                elif not is_temp_file(entry.name):
+                    stat_result = entry.stat()
+                    yield name, stat_result.st_size, stat_result.st_mtime
 
     def _save(self, name, content):
         full_path = self.path(name)
         directory = os.path.dirname(full_path)
-        try:
-            self.create_folder(directory)
-        except StorageException, e:
-            if e.status_code != 409:
-                raise e
+        self._ensure_directory(directory)
 
-        with open(full_path, 'wb') as destination:
-            buffer_size = 16384
-            # we should allow strings to be passed as content since the other
-            # drivers support this too
+        # write into a temporary file next to the destination and rename it
+        # into place so that readers never see a partially written file.
+        # Listings skip temporary files and remove_temp_files cleans up the
+        # ones left behind by crashes.
+        temp_path = temporary_path(full_path)
+        try:
+            # we should allow strings to be passed as content since the
+            # other drivers support this too
             if isinstance(content, basestring):
-                io = StringIO.StringIO()
-                io.write(content)
-                content = io
+                with self._create(temp_path) as destination:
+                    destination.write(force_str(content))
+            elif not self._link(content, temp_path):
+                content.seek(0)
+                with self._create(temp_path) as destination:
+                    self._copy(content, destination)
+            if self.durability != 'none':
+                fsync_path(temp_path)
+            os.rename(temp_path, full_path)
+        except (IOError, OSError), e:
+            self._remove_quietly(temp_path)
+            reraise(e)
+        except:
+            self._remove_quietly(temp_path)
+            raise
+
+        content_type = mimetypes.guess_type(full_path)[0]
+        if self.gzip and content_type in self.gzip_content_types:
+            self._save_gzipped(full_path)
+        self._sync_directory(directory)
+        return self.file_class(self, name)
+
+    def copy(self, src, dst):
+        """
+        Copies the file with a hard link when `hard_link` is enabled, a
+        reflink on filesystems supporting them (btrfs, XFS) or sendfile.
+        """
+        try:
+            source = open(self.path(src), 'rb')
+        except IOError, e:
+            reraise(e)
+        with source:
+            return self._save(os.path.normpath(dst), source)
 
-            content.seek(0)
+    def move(self, src, dst):
+        """
+        Moves the file with a rename, falling back to copying it when the
+        destination is on another filesystem.
+        """
+        source_path = self.path(src)
+        full_path = self.path(dst)
+        directory = os.path.dirname(full_path)
+        self._ensure_directory(directory)
+        try:
             try:
-                shutil.copyfileobj(content, destination, buffer_size)
+                os.rename(source_path, full_path)
             except OSError, e:
+                if e.errno != errno.ENOENT or \
+                        not os.path.exists(source_path):
+                    raise
+                # the directory was removed behind our back
+                known_directories.delete(directory)
+                self._ensure_directory(directory)
+                os.rename(source_path, full_path)
+        except OSError, e:
+            if e.errno != errno.EXDEV:
                 reraise(e)
-        return self.file_class(self, name)
+            file_ = self.copy(src, dst)
+            self.delete(src)
+            return file_
+        if self.gzip:
+            try:
+                os.rename(source_path + '.gz', full_path + '.gz')
+            except OSError:
+                self._remove_quietly(full_path + '.gz')
+        self._sync_directory(directory)
+        self._sync_directory(os.path.dirname(source_path))
+        return self.file_class(self, os.path.normpath(dst))
+
+    def _sync_directory(self, directory):
+        if self.durability == 'directory':
+            if self.group_commit:
+                directory_group_commit.sync(directory)
+            else:
+                fsync_path(directory)
+
+    def _save_gzipped(self, full_path):
+        """
+        Writes a precompressed ``.gz`` sibling of the saved file for web
+        servers serving precompressed files (e.g. nginx's gzip_static).
+        The sibling is left out, and a stale one removed, if compressing
+        doesn't make the file smaller.
+        """
+        gzip_path = full_path + '.gz'
+        temp_path = temporary_path(gzip_path)
+        try:
+            with open(full_path, 'rb') as source:
+                with self._create(temp_path) as destination:
+                    read, written = gzip_copy(
+                        source,
+                        destination,
+                        self.gzip_compression_level,
+                        self.buffer_size
+                    )
+            if written >= read:
+                self._remove_quietly(temp_path)
+                self._remove_quietly(gzip_path)
+                return
+            if self.durability != 'none':
+                fsync_path(temp_path)
+            os.rename(temp_path, gzip_path)
+        except (IOError, OSError), e:
+            self._remove_quietly(temp_path)
+            reraise(e)
+
+    def _ensure_directory(self, directory):
+        if directory in known_directories:
+            return
+        try:
+            os.makedirs(directory)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                reraise(e)
+        known_directories.set(directory, True)
+
+    def _create(self, path):
+        # unlike tempfile.mkstemp this respects the umask like open() does
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL
+        try:
+            fd = os.open(path, flags, 0666)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            # the directory was removed behind our back
+            directory = os.path.dirname(path)
+            known_directories.delete(directory)
+            self._ensure_directory(directory)
+            fd = os.open(path, flags, 0666)
+        return os.fdopen(fd, 'wb')
+
+    def _remove_quietly(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _link(self, content, full_path):
+        """
+        Hard links the file backing given content to the destination when
+        `hard_link` is enabled. The source file must not be modified in place
+        afterwards. Returns False if the content isn't backed by a named file
+        or the file is on another filesystem.
+        """
+        source = getattr(content, 'name', None)
+        if not self.hard_link or not isinstance(source, basestring) or \
+                not os.path.isabs(source) or not os.path.isfile(source):
+            return False
+        try:
+            os.link(source, full_path)
+        except OSError:
+            return False
+        return True
+
+    def _copy(self, source, destination):
+        """
+        Copies the content of the source file object to the destination,
+        in the kernel with sendfile if the source is backed by a real file
+        and otherwise through a single reused buffer.
+        """
+        if self._reflink(source, destination) or \
+                self._sendfile(source, destination):
+            return
+        readinto = getattr(source, 'readinto', None)
+        if readinto is None:
+            shutil.copyfileobj(source, destination, self.buffer_size)
+            return
+        buffer = bytearray(self.buffer_size)
+        view = memoryview(buffer)
+        while True:
+            length = readinto(buffer)
+            if not length:
+                break
+            destination.write(view[:length])
+
+    def _reflink(self, source, destination):
+        """
+        Makes the destination share the blocks of the whole source file
+        (copy-on-write) with the FICLONE ioctl of Linux. Returns False if
+        the filesystem doesn't support it.
+        """
+        if fcntl is None or not sys.platform.startswith('linux') or \
+                not self._has_file(source):
+            return False
+        try:
+            if source.tell() != 0:
+                return False
+            fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+        except (AttributeError, IOError, ValueError):
+            return False
+        return True
+
+    def _sendfile(self, source, destination):
+        if sendfile is None or not self._has_file(source):
+            return False
+        try:
+            source_fd = source.fileno()
+            offset = source.tell()
+        except (AttributeError, IOError, ValueError):
+            return False
+        size = os.fstat(source_fd).st_size
+        destination_fd = destination.fileno()
+        while offset < size:
+            sent = sendfile(destination_fd, source_fd, offset, size - offset)
+            if not sent:
+                break
+            offset += sent
+        return True
+
+    def _has_file(self, source):
+        # fileno() of a SpooledTemporaryFile still held in memory (e.g.
+        # werkzeug uploads) would write it to a temporary file first
+        return getattr(source, '_rolled', True)
 
     def open(self, name, mode='rb'):
         try:
@@ -92,6 +535,7 @@ class FileSystemStorage(Storage):
 
     def delete_folder(self, name):
         path = self.path(name)
+        known_directories.clear()
         try:
             return shutil.rmtree(path)
         except OSError, e:
@@ -106,13 +550,116 @@ class FileSystemStorage(Storage):
     def delete(self, name):
         name = self.path(name)
         try:
-            return os.remove(name)
+            os.remove(name)
         except OSError, e:
             reraise(e)
+        if self.gzip:
+            self._remove_quietly(name + '.gz')
+
+    def delete_many(self, names):
+        """
+        Deletes the specified files using `delete_workers` threads, which
+        overlaps the metadata updates on filesystems with high latency
+        such as network filesystems.
+        """
+        return self._delete_each(names, self.delete_workers)
+
+    def remove_temp_files(self, max_age=None):
+        """
+        Removes the temporary files of saves that were interrupted by a
+        crash and returns their paths. Only files older than `max_age`
+        seconds (`temp_file_max_age` by default, one day) are removed,
+        since younger ones might still be written to.
+        """
+        if max_age is None:
+            max_age = self.temp_file_max_age
+        expires_at = time.time() - max_age
+        removed = []
+        for directory, dirnames, filenames in os.walk(self._absolute_path):
+            for filename in filenames:
+                if not is_temp_file(filename):
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    if os.path.getmtime(path) > expires_at:
+                        continue
+                    os.remove(path)
+                except OSError:
+                    # removed or renamed into place in the meantime
+                    continue
+                removed.append(path)
+        return removed
 
     def exists(self, name):
         return os.path.exists(self.path(name))
 
+    def _names_with_prefix(self, prefix):
+        directory, file_prefix = os.path.split(prefix)
+        try:
+            names = os.listdir(self.path(directory))
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                return []
+            reraise(e)
+        return [
+            os.path.join(directory, name)
+            for name in names
+            if name.startswith(file_prefix) and not is_temp_file(name)
+        ]
+
+    def list_page(self, prefix=None, delimiter=None, page_size=1000,
+                  marker=None):
+        if delimiter not in (None, '/'):
+            raise ValueError("Only '/' is supported as a delimiter.")
+        directory, name_prefix = os.path.split(prefix or '')
+        names = list(itertools.islice(
+            self._iter_names(
+                directory,
+                name_prefix,
+                recursive=delimiter is None,
+                marker=tuple(marker.split('/')) if marker else ()
+            ),
+            page_size
+        ))
+        if len(names) < page_size:
+            return names, None
+        return names, names[-1].rstrip('/')
+
+    def _iter_names(self, directory, name_prefix, recursive, marker):
+        """
+        Yields the names in given directory in sorted order, descending into
+        subdirectories if `recursive` is True. Names are compared as tuples
+        of path components so that whole subdirectories that come before
+        the marker can be skipped without listing them.
+        """
+        try:
+            entries = sorted(
+                scan_directory(self.path(directory)),
+                key=lambda entry: entry.name
+            )
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                return
+            reraise(e)
+        for entry in entries:
+            if not entry.name.startswith(name_prefix) or \
+                    is_temp_file(entry.name):
+                continue
+            if directory:
+                name = '%s/%s' % (directory, entry.name)
+            else:
+                name = entry.name
+            parts = tuple(name.split('/'))
+            if not entry.is_dir():
+                if parts > marker:
+                    yield name
+            elif not recursive:
+                if parts > marker:
+                    yield name + '/'
+            elif parts > marker or marker[:len(parts)] == parts:
+                for name in self._iter_names(name, '', True, marker):
+                    yield name
+
     def path(self, name):
         return os.path.normpath(os.path.join(self._absolute_path, name))
 
@@ -161,5 +708,8 @@ class FileSystemStorageFile(StorageFile):
     def read(self, size=-1):
         return self.file.read(size)
 
+    def readinto(self, buffer):
+        return self.file.readinto(buffer)
+
     def seek(self, offset, whence=os.SEEK_SET):
         self.file.seek(offset, whence)
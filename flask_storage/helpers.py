@@ -0,0 +1,191 @@
+from __future__ import with_statement
+import calendar
+import mimetypes
+import os
+import zlib
+from datetime import datetime
+
+from flask import current_app, request
+from werkzeug.http import (
+    http_date,
+    is_resource_modified,
+    parse_date,
+    quote_etag,
+    unquote_etag
+)
+from werkzeug.wsgi import wrap_file
+
+from .utils import force_str
+
+
+__all__ = ('send_storage_file',)
+
+
+def send_storage_file(storage_file, mimetype=None, as_attachment=False,
+                      attachment_filename=None, chunk_size=65536):
+    """
+    Returns a response streaming given storage file in chunks of
+    `chunk_size` bytes.
+
+    Conditional requests (If-None-Match, If-Modified-Since) are answered
+    with 304 responses and single byte ranges (Range, If-Range) with 206
+    responses. Files with a local path are handed over to the web server
+    with X-Sendfile when ``USE_X_SENDFILE`` is enabled or X-Accel-Redirect
+    when ``STORAGE_X_ACCEL_REDIRECT_PREFIX`` is set (the internal nginx
+    location aliasing the storage folder, e.g. '/protected/'), and are
+    otherwise sent with the ``wsgi.file_wrapper`` of the server.
+    """
+    name = storage_file.name
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    size = storage_file.size
+    last_modified = _timestamp(getattr(storage_file, 'last_modified', None))
+    etag = getattr(storage_file, 'etag', None)
+    if etag:
+        etag = unquote_etag(etag)[0]
+    else:
+        etag = '%s-%s-%s' % (
+            last_modified or 0,
+            size,
+            zlib.adler32(force_str(name)) & 0xffffffff
+        )
+
+    headers = {'Accept-Ranges': 'bytes', 'ETag': quote_etag(etag)}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    if as_attachment:
+        headers['Content-Disposition'] = 'attachment; filename="%s"' % (
+            attachment_filename or name.rsplit('/', 1)[-1]
+        )
+
+    modified = is_resource_modified(
+        request.environ,
+        etag=etag,
+        last_modified=(
+            datetime.utcfromtimestamp(last_modified)
+            if last_modified is not None else None
+        )
+    )
+    if not modified:
+        return _response(None, 304, headers, mimetype)
+
+    path = _local_path(storage_file)
+    if path is not None:
+        if current_app.use_x_sendfile:
+            headers['X-Sendfile'] = path
+            return _response(None, 200, headers, mimetype)
+        prefix = current_app.config.get('STORAGE_X_ACCEL_REDIRECT_PREFIX')
+        if prefix:
+            root = os.path.abspath(storage_file.storage.folder_name)
+            relative_path = os.path.relpath(path, root)
+            # files outside the storage folder (e.g. cached copies of
+            # remote files) aren't reachable through the internal location
+            if not relative_path.startswith(os.pardir):
+                headers['X-Accel-Redirect'] = '%s/%s' % (
+                    prefix.rstrip('/'),
+                    relative_path.replace(os.sep, '/')
+                )
+                return _response(None, 200, headers, mimetype)
+
+    byte_range = _requested_range(size, etag, last_modified)
+    if byte_range is False:
+        headers['Content-Range'] = 'bytes */%d' % size
+        return _response(None, 416, headers, mimetype)
+    if byte_range is None:
+        start, stop, status = 0, size, 200
+    else:
+        start, stop = byte_range
+        status = 206
+        headers['Content-Range'] = 'bytes %d-%d/%d' % (start, stop - 1, size)
+    headers['Content-Length'] = str(stop - start)
+
+    if path is not None:
+        file_ = open(path, 'rb')
+        if status == 200:
+            body = wrap_file(request.environ, file_, chunk_size)
+        else:
+            file_.seek(start)
+            body = _iter_range(
+                iter(lambda: file_.read(chunk_size), ''),
+                stop - start,
+                file_.close
+            )
+    else:
+        storage_file.seek(start)
+        body = _iter_range(
+            storage_file.iter_chunks(chunk_size),
+            stop - start
+        )
+    return _response(body, status, headers, mimetype)
+
+
+def _response(body, status, headers, mimetype):
+    return current_app.response_class(
+        body or '',
+        status=status,
+        headers=headers,
+        mimetype=mimetype,
+        direct_passthrough=True
+    )
+
+
+def _requested_range(size, etag, last_modified):
+    """
+    Returns the (start, stop) tuple of the requested byte range, None if
+    the whole file should be sent or False if the range can't be
+    satisfied. Multiple ranges are answered with the whole file.
+    """
+    requested = request.range
+    if requested is None or len(requested.ranges) != 1:
+        return None
+    if_range = request.if_range
+    if if_range.etag is not None and if_range.etag != etag:
+        return None
+    if if_range.date is not None and (
+            last_modified is None or
+            calendar.timegm(if_range.date.utctimetuple()) != last_modified):
+        return None
+    return requested.range_for_length(size) or False
+
+
+def _iter_range(chunks, length, close=None):
+    """
+    Yields the first `length` bytes of given chunks.
+    """
+    try:
+        for data in chunks:
+            if len(data) >= length:
+                yield data[:length]
+                break
+            length -= len(data)
+            yield data
+    finally:
+        if close is not None:
+            close()
+
+
+def _local_path(storage_file):
+    try:
+        return storage_file.path
+    except (AttributeError, NotImplementedError):
+        return None
+
+
+def _timestamp(value):
+    """
+    Converts the last modification times of the backends (timestamps,
+    datetimes and HTTP or ISO 8601 date strings) to integer timestamps.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, long, float)):
+        return int(value)
+    if isinstance(value, basestring):
+        parsed = parse_date(value)
+        if parsed is None:
+            try:
+                parsed = datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
+            except ValueError:
+                return None
+        value = parsed
+    return calendar.timegm(value.utctimetuple())
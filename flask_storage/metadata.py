@@ -0,0 +1,133 @@
+from flask import current_app
+
+from .base import FileNotFoundError, StorageFileWrapper, StorageWrapper
+from .utils import LRUCache
+
+
+__all__ = ('MetadataCacheStorage', 'MetadataCacheStorageFile')
+
+
+class MetadataCacheStorage(StorageWrapper):
+    """
+    Caches the results of exists() and the size and last modification time
+    of files of the wrapped storage.
+
+    The cache holds at most `max_size` names for `ttl` seconds. Saves and
+    deletes made through this storage invalidate the affected names. Names
+    that don't exist are cached for `negative_ttl` seconds; negative
+    caching is disabled by default since another process might create the
+    file in the meantime.
+    """
+
+    def __init__(self, storage, max_size=None, ttl=None, negative_ttl=None):
+        StorageWrapper.__init__(self, storage)
+        self.max_size = max_size or current_app.config.get(
+            'STORAGE_METADATA_CACHE_SIZE', 10000)
+        self.ttl = ttl or current_app.config.get(
+            'STORAGE_METADATA_CACHE_TTL', 60)
+        self.negative_ttl = negative_ttl or current_app.config.get(
+            'STORAGE_METADATA_CACHE_NEGATIVE_TTL', None)
+        self._cache = LRUCache(self.max_size, self.ttl)
+
+    def exists(self, name):
+        return self._entry(name)['exists']
+
+    def size(self, name):
+        return self._file_metadata(name, 'size')
+
+    def last_modified(self, name):
+        return self._file_metadata(name, 'last_modified')
+
+    def invalidate(self, name=None):
+        """
+        Removes given name, or every name if no name is given, from the
+        cache.
+        """
+        if name is None:
+            self._cache.clear()
+        else:
+            self._cache.delete(name)
+
+    def _entry(self, name):
+        entry = self._cache.get(name)
+        if entry is None:
+            entry = {'exists': self.storage.exists(name)}
+            self._store(name, entry)
+        return entry
+
+    def _file_metadata(self, name, attr):
+        entry = self._entry(name)
+        if not entry['exists']:
+            raise FileNotFoundError(name, 404)
+        if attr not in entry:
+            entry[attr] = getattr(self.storage.open(name), attr)
+            self._store(name, entry)
+        return entry[attr]
+
+    def _store(self, name, entry):
+        if entry['exists']:
+            self._cache.set(name, entry)
+        elif self.negative_ttl:
+            self._cache.set(name, entry, ttl=self.negative_ttl)
+
+    def _open(self, name, mode='rb'):
+        return self.file_class(self, self.storage.open(name, mode))
+
+    def _save(self, name, content):
+        self.invalidate(name)
+        file_ = self.storage.save(name, content, overwrite=True)
+        self.invalidate(file_.name)
+        return self.file_class(self, file_)
+
+    def copy(self, src, dst):
+        self.invalidate(dst)
+        return self.file_class(self, self.storage.copy(src, dst))
+
+    def move(self, src, dst):
+        self.invalidate(dst)
+        try:
+            return self.file_class(self, self.storage.move(src, dst))
+        finally:
+            self.invalidate(src)
+
+    def delete(self, name):
+        try:
+            return self.storage.delete(name)
+        finally:
+            self.invalidate(name)
+
+    def delete_many(self, names):
+        names = list(names)
+        try:
+            return self.storage.delete_many(names)
+        finally:
+            for name in names:
+                self.invalidate(name)
+
+    def delete_folder(self, name=None):
+        try:
+            return self.storage.delete_folder(name)
+        finally:
+            self.invalidate()
+
+    def new_file(self, prefix=''):
+        return self.storage.file_class(self, prefix=prefix)
+
+    @property
+    def file_class(self):
+        return MetadataCacheStorageFile
+
+
+class MetadataCacheStorageFile(StorageFileWrapper):
+    """
+    A file of the wrapped storage whose size and last modification time
+    are read through the cache of a :class:`MetadataCacheStorage`.
+    """
+
+    @property
+    def size(self):
+        return self._storage.size(self.name)
+
+    @property
+    def last_modified(self):
+        return self._storage.last_modified(self.name)
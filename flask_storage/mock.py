@@ -1,6 +1,8 @@
 import os
 from datetime import datetime
+from .asynchronous import AsyncStorage
 from .base import Storage, StorageFile, FileNotFoundError
+from .utils import Task
 
 
 class MockStorage(Storage):
@@ -46,6 +48,15 @@ class MockStorage(Storage):
         """
         return name in self._files
 
+    def _names_with_prefix(self, prefix):
+        return [name for name in self._files if name.startswith(prefix)]
+
+    def list_page(self, prefix=None, delimiter=None, page_size=1000,
+                  marker=None):
+        return self._paginate(
+            sorted(self._files), prefix, delimiter, page_size, marker
+        )
+
     def url(self, name):
         """
         Returns an absolute URL where the file's contents can be accessed
@@ -74,9 +85,6 @@ class MockStorageFile(StorageFile):
         self._pos = 0
         self.last_modified = datetime.now()
 
-    def rename(self, name):
-        self._name = name
-
     @property
     def file(self):
         try:
@@ -96,3 +104,21 @@ class MockStorageFile(StorageFile):
         end = min(self.size, self._pos + size)
         self._pos = end
         return self.file[start:end]
+
+
+class MockAsyncStorage(AsyncStorage):
+    """
+    An async storage for testing. Operations run right away in the calling
+    thread, so the returned tasks are always done.
+    """
+
+    def __init__(self, storage=None):
+        self.storage = storage or MockStorage()
+
+    def _submit(self, func, *args, **kwargs):
+        task = Task(func, args, kwargs)
+        task.run()
+        return task
+
+    def shutdown(self, wait=True):
+        pass
@@ -0,0 +1,116 @@
+import hashlib
+import itertools
+import os
+import uuid
+
+from .utils import safe_join
+
+
+__all__ = (
+    'HashNaming',
+    'ListingNaming',
+    'NAMING_STRATEGIES',
+    'SequentialNaming',
+    'UUIDNaming',
+)
+
+
+class NamingStrategy(object):
+    """
+    Base class for strategies used by :meth:`Storage.get_available_name`
+    to turn a requested file name into one that is free on the storage.
+    """
+
+    def get_available_name(self, storage, name, content=None):
+        raise NotImplementedError
+
+    def _split(self, name):
+        dir_name, file_name = os.path.split(name)
+        file_root, file_ext = os.path.splitext(file_name)
+        return dir_name, file_root, file_ext
+
+    def _candidate(self, dir_name, file_root, suffix, file_ext):
+        # file_ext includes the dot.
+        return safe_join(dir_name, "%s_%s%s" % (file_root, suffix, file_ext))
+
+
+class SequentialNaming(NamingStrategy):
+    """
+    Adds an underscore and a number (before the file extension, if one
+    exists) to the filename until the generated filename doesn't exist.
+
+    Every candidate costs one :meth:`Storage.exists` call.
+    """
+
+    def get_available_name(self, storage, name, content=None):
+        dir_name, file_root, file_ext = self._split(name)
+        count = itertools.count(1)
+        while storage.exists(name):
+            name = self._candidate(dir_name, file_root, count.next(), file_ext)
+        return name
+
+
+class ListingNaming(NamingStrategy):
+    """
+    Produces the same names as :class:`SequentialNaming` but fetches all
+    names sharing the file root with a single listing call instead of
+    probing every candidate separately.
+    """
+
+    def get_available_name(self, storage, name, content=None):
+        dir_name, file_root, file_ext = self._split(name)
+        taken = set(
+            storage._names_with_prefix(safe_join(dir_name, file_root))
+        )
+        count = itertools.count(1)
+        while name in taken:
+            name = self._candidate(dir_name, file_root, count.next(), file_ext)
+        return name
+
+
+class UUIDNaming(NamingStrategy):
+    """
+    Adds a random UUID to every filename. Never checks the storage.
+    """
+
+    def get_available_name(self, storage, name, content=None):
+        dir_name, file_root, file_ext = self._split(name)
+        return self._candidate(dir_name, file_root, uuid.uuid4().hex, file_ext)
+
+
+class HashNaming(NamingStrategy):
+    """
+    Adds the SHA-1 digest of the content to every filename. Never checks
+    the storage; saving identical content twice yields the same name.
+    """
+
+    chunk_size = 65536
+
+    def get_available_name(self, storage, name, content=None):
+        if content is None:
+            raise ValueError('HashNaming needs the content of the file.')
+        dir_name, file_root, file_ext = self._split(name)
+        return self._candidate(
+            dir_name, file_root, self._digest(content), file_ext
+        )
+
+    def _digest(self, content):
+        digest = hashlib.sha1()
+        if isinstance(content, basestring):
+            if isinstance(content, unicode):
+                content = content.encode('utf-8')
+            digest.update(content)
+        else:
+            content.seek(0)
+            for chunk in iter(lambda: content.read(self.chunk_size), ''):
+                digest.update(chunk)
+            content.seek(0)
+        return digest.hexdigest()
+
+
+NAMING_STRATEGIES = {
+    'hash': HashNaming,
+    'listing': ListingNaming,
+    'sequential': SequentialNaming,
+    'uuid': UUIDNaming,
+}
@@ -1,3 +1,14 @@
+from __future__ import with_statement
+from collections import OrderedDict
+import os
+import Queue
+import sys
+import threading
+import time
+import zlib
+from urlparse import urljoin
+
+
 def force_str(name, encoding='utf-8'):
     if isinstance(name, str):
         return name
@@ -10,3 +21,338 @@ def force_unicode(name, encoding='utf-8'):
         return name
     else:
         return name.decode(encoding)
+
+
+def safe_join(base, *paths):
+    """
+    A version of django.utils._os.safe_join for S3 paths.
+
+    Joins one or more path components to the base path component
+    intelligently. Returns a normalized version of the final path.
+
+    The final path must be located inside of the base path component
+    (otherwise a ValueError is raised).
+
+    Paths outside the base path indicate a possible security
+    sensitive operation.
+    """
+    base_path = force_unicode(base)
+    base_path = base_path.rstrip('/')
+    paths = [force_unicode(p) for p in paths]
+
+    final_path = base_path
+    for path in paths:
+        final_path = urljoin(final_path.rstrip('/') + "/", path.rstrip("/"))
+
+    # Ensure final_path starts with base_path and that the next character after
+    # the final path is '/' (or nothing, in which case final_path must be
+    # equal to base_path).
+    base_path_len = len(base_path)
+    if not final_path.startswith(base_path) \
+            or final_path[base_path_len:base_path_len + 1] not in ('', '/'):
+        raise ValueError('the joined path is located outside of the base path'
+                         ' component')
+
+    return final_path.lstrip('/')
+
+
+class Task(object):
+    """
+    A unit of work submitted to a :class:`WorkerPool`.
+    """
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def run(self):
+        try:
+            self._result = self.func(*self.args, **self.kwargs)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        finally:
+            # don't keep the arguments (e.g. file contents) alive
+            self.args = self.kwargs = None
+            with self._lock:
+                self._done.set()
+                callbacks, self._callbacks = self._callbacks, []
+            for callback in callbacks:
+                callback(self)
+
+    def done(self):
+        return self._done.is_set()
+
+    def add_done_callback(self, func):
+        """
+        Calls `func` with the task once it is done, right away if it
+        already is. Callbacks run in the thread that ran the task.
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    @property
+    def exception(self):
+        self._done.wait()
+        if self._exc_info:
+            return self._exc_info[1]
+
+    def result(self):
+        """
+        Waits for the task to finish and returns its result, re-raising the
+        exception if the task failed.
+        """
+        self._done.wait()
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+class WorkerPool(object):
+    """
+    A fixed size pool of daemon threads fed through a bounded queue.
+
+    :meth:`submit` blocks while the queue is full, so producers can never
+    get more than ``workers + queue_size`` tasks ahead of the workers.
+    """
+
+    def __init__(self, workers, queue_size=None):
+        self.workers = workers
+        if queue_size is None:
+            queue_size = workers
+        self._queue = Queue.Queue(queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        task = Task(func, args, kwargs)
+        self._start()
+        self._queue.put(task)
+        return task
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            task.run()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+class ConnectionRegistry(object):
+    """
+    A process wide, thread safe registry of shared objects such as
+    connections and buckets.
+
+    Entries are kept in least recently used order. When `max_size` is
+    exceeded the least recently used entries are evicted and entries that
+    haven't been used for `idle_timeout` seconds are evicted on the next
+    access. Evicted objects are closed if they have a ``close`` method.
+
+    The registry notices when it is used in a forked child process (e.g.
+    gunicorn or uwsgi workers) and starts from scratch there instead of
+    sharing sockets with the parent process.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, factory, max_size=None, idle_timeout=None):
+        """
+        Returns the object registered with given key, creating it with
+        `factory` if it doesn't exist yet.
+        """
+        if self._pid != os.getpid():
+            self._reset()
+        now = time.time()
+        with self._lock:
+            self._evict_idle(now, idle_timeout)
+            if key in self._entries:
+                value = self._entries.pop(key)[0]
+                self._entries[key] = (value, now)
+                return value
+
+        # create the object outside of the lock since it might need to
+        # talk to the network
+        created = value = factory()
+        with self._lock:
+            if key in self._entries:
+                # another thread won the race
+                value = self._entries.pop(key)[0]
+            self._entries[key] = (value, now)
+            while max_size and len(self._entries) > max_size:
+                self._close(self._entries.popitem(last=False)[1][0])
+        if created is not value:
+            self._close(created)
+        return value
+
+    def clear(self):
+        with self._lock:
+            entries, self._entries = self._entries, OrderedDict()
+        for value, last_used in entries.values():
+            self._close(value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict_idle(self, now, idle_timeout):
+        if not idle_timeout:
+            return
+        for key, (value, last_used) in self._entries.items():
+            if now - last_used > idle_timeout:
+                del self._entries[key]
+                self._close(value)
+
+    def _close(self, value):
+        close = getattr(value, 'close', None)
+        if close is not None:
+            close()
+
+
+class ObjectPool(object):
+    """
+    A thread safe pool of objects that can't be shared by threads, such as
+    connections. :meth:`acquire` lends an idle object, creating one with
+    `factory` if there is none, and :meth:`release` takes it back. At most
+    `max_idle` idle objects are kept; extra ones are closed if they have a
+    ``close`` method.
+
+    Like :class:`ConnectionRegistry` the pool starts from scratch in forked
+    child processes.
+    """
+
+    def __init__(self, factory, max_idle=None):
+        self.factory = factory
+        self.max_idle = max_idle
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def acquire(self):
+        if self._pid != os.getpid():
+            self._reset()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self.factory()
+
+    def release(self, value):
+        if self._pid == os.getpid():
+            with self._lock:
+                if not self.max_idle or len(self._idle) < self.max_idle:
+                    self._idle.append(value)
+                    return
+        close = getattr(value, 'close', None)
+        if close is not None:
+            close()
+
+    def __len__(self):
+        return len(self._idle)
+
+
+_missing = object()
+
+
+class LRUCache(object):
+    """
+    A thread safe mapping with a bounded number of entries evicted in least
+    recently used order. Entries expire after `ttl` seconds unless a ttl
+    is given for the entry itself; ``None`` means never.
+    """
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at = self._entries.pop(key)
+            except KeyError:
+                return default
+            if expires_at is not None and expires_at <= time.time():
+                return default
+            self._entries[key] = (value, expires_at)
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires_at)
+            while self.max_size and len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def gzip_copy(source, destination, level=6, chunk_size=65536):
+    """
+    Compresses the rest of the source file object into the destination
+    file object in gzip format, `chunk_size` bytes at a time. Returns the
+    number of bytes read and the number of bytes written.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    read = written = 0
+    for chunk in iter(lambda: source.read(chunk_size), ''):
+        read += len(chunk)
+        data = compressor.compress(chunk)
+        written += len(data)
+        destination.write(data)
+    data = compressor.flush()
+    destination.write(data)
+    return read, written + len(data)
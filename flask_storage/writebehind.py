@@ -0,0 +1,328 @@
+from __future__ import with_statement
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from flask import current_app
+
+from .base import (
+    CONNECTION_ERRORS,
+    FileNotFoundError,
+    StorageException,
+    StorageFileWrapper,
+    StorageWrapper
+)
+from .filesystem import FileSystemStorage
+from .utils import WorkerPool
+
+
+__all__ = ('WriteBehindStorage', 'WriteBehindStorageFile')
+
+
+class WriteBehindStorage(StorageWrapper):
+    """
+    Saves files to a local `staging` storage and uploads them to the wrapped
+    storage in the background, so that saving doesn't wait for the remote
+    storage.
+
+    Staged files are written durably before :meth:`save` returns (the
+    default staging storage is a :class:`FileSystemStorage` in
+    ``STORAGE_WRITE_BEHIND_DIR`` with directory durability). `workers`
+    threads upload them, retrying connection errors and 5xx responses
+    `retries` times with exponential backoff starting at `retry_delay`
+    seconds. Uploads of one
+    name happen in the order of the saves; a save superseded before its
+    upload started isn't uploaded at all. Until its upload is done a file
+    is read from staging.
+
+    Uploads that still fail stay staged and are listed by
+    :meth:`failures`. :meth:`recover` queues them again, together with the
+    files staged by processes that exited before uploading them, so it
+    should be called once when the uploading process starts.
+    """
+
+    def __init__(self, storage, staging=None, workers=None, retries=None,
+                 retry_delay=None):
+        StorageWrapper.__init__(self, storage)
+        if staging is None:
+            staging = FileSystemStorage(
+                current_app.config.get(
+                    'STORAGE_WRITE_BEHIND_DIR',
+                    os.path.join(tempfile.gettempdir(), 'flask-storage-write')
+                ),
+                durability='directory'
+            )
+        self.staging = staging
+        self.workers = workers or current_app.config.get(
+            'STORAGE_WRITE_BEHIND_WORKERS', 4)
+        if retries is None:
+            retries = current_app.config.get(
+                'STORAGE_WRITE_BEHIND_RETRIES', 5)
+        self.retries = retries
+        self.retry_delay = retry_delay or current_app.config.get(
+            'STORAGE_WRITE_BEHIND_RETRY_DELAY', 1)
+        self.app = current_app._get_current_object()
+        # tasks only carry names, so the queue is unbounded and saves never
+        # wait for uploads
+        self.pool = WorkerPool(self.workers, queue_size=0)
+        self._condition = threading.Condition()
+        # staging names waiting for upload by name, oldest first; the first
+        # one might be uploading right now
+        self._pending = {}
+        self._failed = {}
+
+    def _save(self, name, content):
+        staging_name = uuid.uuid4().hex
+        self.staging.save(staging_name, content, overwrite=True)
+        self.staging.save(
+            staging_name + '.json',
+            json.dumps({'name': name, 'staged_at': time.time()}),
+            overwrite=True
+        )
+        file_ = self.staging.open(staging_name)
+        # keep the staged file open, it is removed after the upload
+        file_.file
+        self._enqueue(name, staging_name)
+        return self.file_class(self, file_, name)
+
+    def _open(self, name, mode='rb'):
+        with self._condition:
+            staging_name = self._staged_name(name)
+            if staging_name is not None:
+                file_ = self.staging.open(staging_name)
+                file_.file
+                return self.file_class(self, file_, name)
+        return self.file_class(self, self.storage.open(name, mode))
+
+    def exists(self, name):
+        with self._condition:
+            if self._staged_name(name) is not None:
+                return True
+        return self.storage.exists(name)
+
+    def delete(self, name):
+        """
+        Discards the pending uploads of given file, waits for an upload in
+        progress and deletes the file from the wrapped storage.
+        """
+        with self._condition:
+            discarded = self._pending.get(name, [])[1:]
+            del self._pending.get(name, [])[1:]
+            if name in self._failed:
+                discarded.append(self._failed.pop(name)[0])
+            staged = bool(discarded) or name in self._pending
+            while name in self._pending:
+                self._condition.wait()
+        for staging_name in discarded:
+            self._unstage(staging_name)
+        try:
+            return self.storage.delete(name)
+        except FileNotFoundError:
+            if not staged:
+                raise
+
+    def delete_many(self, names):
+        return self._delete_each(list(names), workers=1)
+
+    def copy(self, src, dst):
+        self.flush_name(src)
+        return self.file_class(self, self.storage.copy(src, dst))
+
+    def move(self, src, dst):
+        self.flush_name(src)
+        return self.file_class(self, self.storage.move(src, dst))
+
+    def is_pending(self, name):
+        with self._condition:
+            return name in self._pending
+
+    def flush_name(self, name, timeout=None):
+        """
+        Waits until the pending uploads of given file are done. Returns
+        False if they didn't finish within `timeout` seconds.
+        """
+        return self._wait(lambda: name not in self._pending, timeout)
+
+    def flush(self, timeout=None):
+        """
+        Waits until all pending uploads are done. Returns False if they
+        didn't finish within `timeout` seconds.
+        """
+        return self._wait(lambda: not self._pending, timeout)
+
+    def failures(self):
+        """
+        Returns the exceptions of the uploads that failed after all
+        retries by name.
+        """
+        with self._condition:
+            return dict(
+                (name, error) for name, (_, error) in self._failed.items()
+            )
+
+    def recover(self):
+        """
+        Queues the uploads of all staged files again, oldest first.
+        """
+        with self._condition:
+            queued = set()
+            for staging_names in self._pending.values():
+                queued.update(staging_names)
+            self._failed.clear()
+        try:
+            staging_names = self.staging.list_files()
+        except OSError:
+            staging_names = []
+        journal = []
+        for staging_name in staging_names:
+            if not staging_name.endswith('.json'):
+                continue
+            staging_name = staging_name[:-len('.json')]
+            if staging_name in queued:
+                continue
+            try:
+                with open(self.staging.path(staging_name + '.json')) as f:
+                    entry = json.load(f)
+            except (IOError, ValueError):
+                # uploaded in the meantime or not completely staged
+                continue
+            journal.append((entry['staged_at'], entry['name'], staging_name))
+        for staged_at, name, staging_name in sorted(journal):
+            self._enqueue(name, staging_name)
+        return len(journal)
+
+    def shutdown(self, wait=True):
+        """
+        Stops the uploaders, waiting for pending uploads if `wait` is true.
+        """
+        if wait:
+            self.flush()
+        self.pool.shutdown(wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    @property
+    def file_class(self):
+        return WriteBehindStorageFile
+
+    def _staged_name(self, name):
+        if self._pending.get(name):
+            return self._pending[name][-1]
+        if name in self._failed:
+            return self._failed[name][0]
+
+    def _enqueue(self, name, staging_name):
+        with self._condition:
+            if name in self._failed:
+                obsolete = self._failed.pop(name)[0]
+            else:
+                obsolete = None
+            start = name not in self._pending
+            if start:
+                self._pending[name] = [staging_name]
+            else:
+                self._pending[name].append(staging_name)
+        # uploaders need the condition to finish, so submitting while
+        # holding it could wait for them forever
+        if start:
+            self.pool.submit(self._upload_name, name)
+        if obsolete is not None:
+            self._unstage(obsolete)
+
+    def _upload_name(self, name):
+        """
+        Uploads the latest staged version of given file until no newer
+        version is pending.
+        """
+        while True:
+            with self._condition:
+                staged = self._pending[name]
+                if not staged:
+                    del self._pending[name]
+                    self._condition.notify_all()
+                    return
+                obsolete = staged[:-1]
+                del staged[:-1]
+                staging_name = staged[0]
+            for obsolete_name in obsolete:
+                self._unstage(obsolete_name)
+            error = None
+            try:
+                self._upload(name, staging_name)
+            except Exception, e:
+                # anything else would leave the name pending forever
+                error = e
+            with self._condition:
+                staged.pop(0)
+                # failed uploads stay staged unless a newer save follows
+                if error is not None and not staged:
+                    self._failed[name] = (staging_name, error)
+                    staging_name = None
+                self._condition.notify_all()
+            if staging_name is not None:
+                self._unstage(staging_name)
+
+    def _upload(self, name, staging_name):
+        attempt = 0
+        while True:
+            try:
+                with self.app.app_context():
+                    with open(self.staging.path(staging_name), 'rb') as f:
+                        self.storage.save(name, f, overwrite=True)
+                return
+            except Exception, e:
+                attempt += 1
+                if attempt > self.retries or not _is_retryable(e):
+                    raise
+            time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+    def _unstage(self, staging_name):
+        for name in (staging_name + '.json', staging_name):
+            try:
+                self.staging.delete(name)
+            except StorageException:
+                pass
+
+    def _wait(self, predicate, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while not predicate():
+                if deadline is None:
+                    self._condition.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+
+def _is_retryable(error):
+    """
+    Returns True for connection errors and 5xx responses, including the
+    errors of the boto and cloudfiles clients that the backends don't wrap.
+    """
+    status = getattr(error, 'status', None)
+    if status is None:
+        status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status >= 500
+    return isinstance(error, CONNECTION_ERRORS + (StorageException,))
+
+
+class WriteBehindStorageFile(StorageFileWrapper):
+    """
+    A file of a :class:`WriteBehindStorage`, read from staging while its
+    upload is pending.
+    """
+
+    @property
+    def pending(self):
+        return self._storage.is_pending(self.name)
@@ -32,10 +32,14 @@ setup(
     zip_safe=False,
     platforms='any',
     install_requires=[
-        'Flask>=0.7',
+        'Flask>=0.9',
         'boto>=2.5.2',
         'python-cloudfiles>=1.7.10'
     ],
+    extras_require={
+        'scandir': ['scandir>=1.5'],
+        'sendfile': ['pysendfile>=2.0']
+    },
     cmdclass={'test': PyTest},
     classifiers=[
         'Development Status :: 4 - Beta',
@@ -1,13 +1,27 @@
 from __future__ import with_statement
 from datetime import datetime
+from StringIO import StringIO
+import re
+import time
+import zlib
 from pytest import raises
 
 from flexmock import flexmock
 from boto.s3.connection import S3Connection
 from boto.s3.key import Key
 from boto.s3.bucket import Bucket
+from boto.exception import S3ResponseError
 from tests import TestCase
-from flask_storage import S3BotoStorage, S3BotoStorageFile, FileNotFoundError
+from flask_storage import (
+    FileNotFoundError,
+    PermissionError,
+    S3BotoStorage,
+    S3BotoStorageFile,
+    StorageException
+)
+from flask_storage.amazon import connection_registry, signed_url_cache
+from flask_storage.utils import ConnectionRegistry
+import flask_storage.utils
 
 
 class MockKey(object):
@@ -20,17 +34,54 @@ class MockKey(object):
     def set_contents_from_string(self, s, **kwargs):
         pass
 
+    def set_contents_from_file(self, fp, **kwargs):
+        pass
+
     def open(self, *args, **kwargs):
         pass
 
     def read(self, size=-1):
+        return ''
+
+    def close(self):
+        pass
+
+    def get_contents_as_string(self, headers=None):
         pass
 
     last_modified = datetime(1971, 1, 1)
     size = 0
+    resp = None
+
+
+class MockMultiPartUpload(object):
+    def __init__(self, failures=None):
+        self.parts = {}
+        self.copied = []
+        self.failures = failures or {}
+        self.completed = False
+        self.cancelled = False
+
+    def copy_part_from_key(self, src_bucket_name, src_key_name, part_num,
+                           start=None, end=None):
+        self.copied.append((part_num, start, end))
+
+    def upload_part_from_file(self, fp, part_num, size=None):
+        if self.failures.get(part_num):
+            self.failures[part_num] -= 1
+            raise S3ResponseError(500, 'Internal Error')
+        self.parts[part_num] = fp.read()
+
+    def complete_upload(self):
+        self.completed = True
+
+    def cancel_upload(self):
+        self.cancelled = True
 
 
 class MockBucket(object):
+    name = 'some bucket'
+
     def __init__(self, *args, **kwargs):
         pass
 
@@ -40,17 +91,35 @@ class MockBucket(object):
     def lookup(self, key):
         return None
 
+    def get_key(self, key):
+        return None
+
     def delete_key(self, key):
         pass
 
+    def delete_keys(self, keys, quiet=False):
+        pass
+
+    def copy_key(self, new_key_name, src_bucket_name, src_key_name,
+                 **kwargs):
+        pass
+
     def new_key(self, key):
         return MockKey()
 
-    def list(self):
+    def list(self, prefix=''):
         return []
 
+    def get_all_keys(self, **params):
+        return MockResultSet([])
+
+    def initiate_multipart_upload(self, key_name, **kwargs):
+        return MockMultiPartUpload()
+
 
 def mock_s3():
+    connection_registry.clear()
+    signed_url_cache.clear()
     flexmock(Key).should_receive('__new__').replace_with(MockKey)
     flexmock(Bucket).should_receive('__new__').replace_with(MockBucket)
     (flexmock(S3Connection)
@@ -87,6 +156,19 @@ class TestS3BotoStorage(TestCase):
         with raises(FileNotFoundError):
             storage.delete('key')
 
+    def test_delete_can_skip_existence_check(self):
+        mock_s3()
+        (
+            flexmock(S3Connection)
+            .should_receive('get_bucket')
+            .and_return(MockBucket())
+        )
+        flexmock(MockBucket).should_receive('lookup').never()
+        flexmock(MockBucket).should_receive('delete_key').with_args('key') \
+            .once()
+        storage = S3BotoStorage('some bucket', delete_check_exists=False)
+        storage.delete('key')
+
     def test_list_files_returns_list_of_key_names(self):
         mock_s3()
         (
@@ -108,6 +190,525 @@ class TestS3BotoStorage(TestCase):
         storage.save('some_file', 'some content')
 
 
+class TestS3BotoStorageMultipartUpload(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        mock_s3()
+        (
+            flexmock(S3Connection)
+            .should_receive('get_bucket')
+            .and_return(MockBucket())
+        )
+        self.storage = S3BotoStorage(
+            'some bucket',
+            multipart_threshold=10,
+            multipart_part_size=4
+        )
+
+    def mock_upload(self, upload):
+        (
+            flexmock(MockBucket)
+            .should_receive('initiate_multipart_upload')
+            .once()
+            .and_return(upload)
+        )
+
+    def test_small_files_use_single_put(self):
+        flexmock(MockBucket).should_receive('initiate_multipart_upload') \
+            .never()
+        self.storage.save('some_file', StringIO('012345678'))
+
+    def test_uploads_large_files_in_parts(self):
+        upload = MockMultiPartUpload()
+        self.mock_upload(upload)
+        self.storage.save('some_file', StringIO('0123456789ab'))
+        assert upload.parts == {1: '0123', 2: '4567', 3: '89ab'}
+        assert upload.completed
+
+    def test_uploads_large_strings_in_parts(self):
+        upload = MockMultiPartUpload()
+        self.mock_upload(upload)
+        self.storage.save('some_file', '0123456789')
+        assert upload.parts == {1: '0123', 2: '4567', 3: '89'}
+
+    def test_retries_failed_parts(self):
+        upload = MockMultiPartUpload(failures={2: 2})
+        self.mock_upload(upload)
+        self.storage.save('some_file', StringIO('0123456789ab'))
+        assert upload.parts[2] == '4567'
+        assert upload.completed
+
+    def test_cancels_upload_when_part_runs_out_of_retries(self):
+        upload = MockMultiPartUpload(failures={2: 10})
+        self.mock_upload(upload)
+        with raises(S3ResponseError):
+            self.storage.save('some_file', StringIO('0123456789ab'))
+        assert upload.cancelled
+        assert not upload.completed
+
+    def test_cancels_upload_when_completion_fails(self):
+        upload = MockMultiPartUpload()
+        flexmock(upload).should_receive('complete_upload') \
+            .and_raise(S3ResponseError(400, 'InvalidPart'))
+        self.mock_upload(upload)
+        with raises(S3ResponseError):
+            self.storage.save('some_file', StringIO('0123456789ab'))
+        assert upload.cancelled
+
+
+class TestS3BotoStorageGzip(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        mock_s3()
+        (
+            flexmock(S3Connection)
+            .should_receive('get_bucket')
+            .and_return(MockBucket())
+        )
+        self.storage = S3BotoStorage('some bucket', gzip=True)
+        self.uploads = []
+        flexmock(MockKey).should_receive('set_contents_from_file') \
+            .replace_with(
+                lambda fp, **kwargs: self.uploads.append(
+                    (fp.read(), kwargs['headers'])
+                )
+            )
+
+    def test_compresses_matching_content_types(self):
+        content = 'body { color: red; }\n' * 100
+        self.storage.save('style.css', StringIO(content))
+        data, headers = self.uploads[0]
+        assert headers['Content-Encoding'] == 'gzip'
+        assert zlib.decompress(data, 16 + zlib.MAX_WBITS) == content
+
+    def test_compresses_strings(self):
+        content = 'body { color: red; }\n' * 100
+        self.storage.save('style.css', content)
+        data, headers = self.uploads[0]
+        assert headers['Content-Encoding'] == 'gzip'
+        assert zlib.decompress(data, 16 + zlib.MAX_WBITS) == content
+
+    def test_skips_content_that_does_not_shrink(self):
+        self.storage.save('style.css', StringIO('a'))
+        data, headers = self.uploads[0]
+        assert data == 'a'
+        assert 'Content-Encoding' not in headers
+
+    def test_skips_other_content_types(self):
+        self.storage.save('image.png', StringIO('a' * 1000))
+        data, headers = self.uploads[0]
+        assert data == 'a' * 1000
+        assert 'Content-Encoding' not in headers
+
+
+class TestS3BotoStorageSignedUrls(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        mock_s3()
+        (
+            flexmock(S3Connection)
+            .should_receive('get_bucket')
+            .and_return(MockBucket())
+        )
+        self.now = 1000
+        flexmock(flask_storage.utils.time).should_receive('time') \
+            .replace_with(lambda: self.now)
+        self.storage = S3BotoStorage('some bucket', querystring_expire=3600)
+
+    def mock_generate_url(self):
+        return (
+            flexmock(S3Connection)
+            .should_receive('generate_url')
+            .replace_with(lambda expires, key, **kwargs: '%s?%s' % (
+                key, expires
+            ))
+        )
+
+    def test_reuses_signed_url_within_window(self):
+        self.mock_generate_url().once()
+        assert self.storage.url('file') == 'file?3600'
+        self.now = 1700
+        assert self.storage.url('file') == 'file?3600'
+
+    def test_signs_again_in_next_window(self):
+        self.mock_generate_url().twice()
+        self.storage.url('file')
+        self.now = 1900
+        assert self.storage.url('file') == 'file?5400'
+
+    def test_signs_every_call_without_reuse(self):
+        self.storage.querystring_reuse = 0
+        (
+            flexmock(S3Connection)
+            .should_receive('generate_url')
+            .and_return('url')
+            .twice()
+        )
+        self.storage.url('file')
+        self.storage.url('file')
+
+    def test_urls(self):
+        self.mock_generate_url().twice()
+        self.storage.url('a')
+        assert self.storage.urls(['a', 'b', 'a']) == \
+            ['a?3600', 'b?3600', 'a?3600']
+
+
+class TestS3BotoStorageDeleteMany(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        mock_s3()
+        (
+            flexmock(S3Connection)
+            .should_receive('get_bucket')
+            .and_return(MockBucket())
+        )
+        self.storage = S3BotoStorage('some bucket')
+
+    def test_deletes_in_chunks_of_1000_keys(self):
+        requests = []
+        flexmock(MockBucket).should_receive('delete_keys').replace_with(
+            lambda keys, quiet: requests.append(keys) or flexmock(errors=[])
+        )
+        names = ['%d' % i for i in xrange(2500)]
+        results = self.storage.delete_many(names)
+        assert [len(keys) for keys in requests] == [1000, 1000, 500]
+        assert set(results) == set(names)
+        assert not any(results.values())
+
+    def test_returns_errors_per_name(self):
+        error = flexmock(key='b', code='AccessDenied', message='Denied')
+        (
+            flexmock(MockBucket)
+            .should_receive('delete_keys')
+            .and_return(flexmock(errors=[error]))
+        )
+        results = self.storage.delete_many(['a', 'b'])
+        assert results['a'] is None
+        assert isinstance(results['b'], PermissionError)
+
+    def test_failed_requests_fail_every_name_of_the_chunk(self):
+        (
+            flexmock(MockBucket)
+            .should_receive('delete_keys')
+            .and_raise(S3ResponseError(500, 'Internal Error'))
+        )
+        results = self.storage.delete_many(['a', 'b'])
+        assert all(results.values())
+
+
+class TestS3BotoStorageCopy(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        mock_s3()
+        (
+            flexmock(S3Connection)
+            .should_receive('get_bucket')
+            .and_return(MockBucket())
+        )
+        self.storage = S3BotoStorage(
+            'some bucket',
+            multipart_copy_threshold=10,
+            multipart_copy_part_size=4
+        )
+
+    def mock_source(self, size):
+        source = MockKey()
+        source.name = 'key'
+        source.size = size
+        source.etag = 'etag'
+        source.content_type = 'text/plain'
+        source.content_encoding = None
+        flexmock(MockBucket).should_receive('get_key').with_args('key') \
+            .and_return(source)
+
+    def test_copies_small_objects_with_single_request(self):
+        self.mock_source(9)
+        (
+            flexmock(MockBucket)
+            .should_receive('copy_key')
+            .with_args(
+                'other', 'some bucket', 'key',
+                storage_class='STANDARD',
+                headers={'x-amz-acl': 'public-read'}
+            )
+            .once()
+        )
+        assert self.storage.copy('key', 'other').name == 'other'
+
+    def test_copies_large_objects_in_parts(self):
+        self.mock_source(10)
+        upload = MockMultiPartUpload()
+        (
+            flexmock(MockBucket)
+            .should_receive('initiate_multipart_upload')
+            .and_return(upload)
+        )
+        self.storage.copy('key', 'other')
+        assert sorted(upload.copied) == [(1, 0, 3), (2, 4, 7), (3, 8, 9)]
+        assert upload.completed
+
+    def test_cancels_copy_when_completion_fails(self):
+        self.mock_source(10)
+        upload = MockMultiPartUpload()
+        flexmock(upload).should_receive('complete_upload') \
+            .and_raise(S3ResponseError(500, 'Internal Error'))
+        (
+            flexmock(MockBucket)
+            .should_receive('initiate_multipart_upload')
+            .and_return(upload)
+        )
+        with raises(StorageException):
+            self.storage.copy('key', 'other')
+        assert upload.cancelled
+
+    def test_raises_file_not_found_for_unknown_file(self):
+        with raises(FileNotFoundError):
+            self.storage.copy('unknown', 'other')
+
+    def test_move_deletes_source(self):
+        self.mock_source(9)
+        flexmock(MockBucket).should_receive('copy_key').once()
+        flexmock(MockBucket).should_receive('lookup').and_return(MockKey())
+        flexmock(MockBucket).should_receive('delete_key').with_args('key') \
+            .once()
+        self.storage.move('key', 'other')
+
+
+class TestS3BotoStorageConnectionSharing(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        mock_s3()
+
+    def test_storages_share_connection_and_bucket(self):
+        (
+            flexmock(S3Connection)
+            .should_receive('get_bucket')
+            .once()
+            .and_return(MockBucket())
+        )
+        storage = S3BotoStorage('some bucket')
+        other = S3BotoStorage('some bucket')
+        assert storage.connection is other.connection
+        assert storage.bucket is other.bucket
+
+    def test_different_credentials_do_not_share_connection(self):
+        storage = S3BotoStorage('some bucket', access_key='a')
+        other = S3BotoStorage('some bucket', access_key='b')
+        assert storage.connection is not other.connection
+
+    def test_sharing_can_be_disabled(self):
+        self.app.config['AWS_S3_SHARE_CONNECTIONS'] = False
+        storage = S3BotoStorage('some bucket')
+        other = S3BotoStorage('some bucket')
+        assert storage.connection is not other.connection
+
+    def test_save_many_shares_bucket_between_workers(self):
+        (
+            flexmock(S3Connection)
+            .should_receive('get_bucket')
+            .once()
+            .and_return(MockBucket())
+        )
+        storage = S3BotoStorage('some bucket', file_overwrite=True)
+        results = storage.save_many(
+            [('file%d' % i, 'value', True) for i in xrange(10)],
+            workers=4
+        )
+        assert len(results) == 10
+
+
+class TestConnectionRegistry(object):
+    def setup_method(self, method):
+        self.registry = ConnectionRegistry()
+
+    def test_creates_objects_only_once(self):
+        first = self.registry.get('key', object)
+        assert self.registry.get('key', object) is first
+
+    def test_evicts_least_recently_used_entries(self):
+        first = self.registry.get('first', object)
+        self.registry.get('second', object, max_size=2)
+        self.registry.get('first', object, max_size=2)
+        self.registry.get('third', object, max_size=2)
+        assert len(self.registry) == 2
+        assert self.registry.get('first', object) is first
+
+    def test_evicts_idle_entries(self):
+        first = self.registry.get('key', object)
+        (flexmock(flask_storage.utils.time)
+            .should_receive('time')
+            .and_return(10 ** 10))
+        assert self.registry.get('key', object, idle_timeout=60) is not first
+
+    def test_starts_from_scratch_after_fork(self):
+        first = self.registry.get('key', object)
+        (flexmock(flask_storage.utils.os)
+            .should_receive('getpid')
+            .and_return(-1))
+        assert self.registry.get('key', object) is not first
+
+
+def listed_key(name, size=3):
+    key = MockKey()
+    key.name = name
+    key.size = size
+    key.etag = '"etag"'
+    key.last_modified = '2012-01-01T00:00:00.000Z'
+    return key
+
+
+class TestS3BotoStoragePreloadMetadata(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        mock_s3()
+        (
+            flexmock(S3Connection)
+            .should_receive('get_bucket')
+            .and_return(MockBucket())
+        )
+        self.app.config['AWS_PRELOAD_METADATA'] = True
+        self.storage = S3BotoStorage('some bucket')
+
+    def mock_listing(self, *names):
+        return (
+            flexmock(MockBucket)
+            .should_receive('list')
+            .and_return([listed_key(name) for name in names])
+        )
+
+    def test_exists_is_answered_from_a_single_listing(self):
+        self.mock_listing('some_file').once()
+        flexmock(MockBucket).should_receive('lookup').never()
+        assert self.storage.exists('some_file')
+        assert S3BotoStorage('some bucket').exists('some_file')
+
+    def test_exists_looks_up_keys_missing_from_index(self):
+        self.mock_listing().once()
+        flexmock(MockBucket).should_receive('lookup') \
+            .with_args('other_file').and_return(listed_key('other_file')) \
+            .once()
+        assert self.storage.exists('other_file')
+        assert self.storage.exists('other_file')
+
+    def test_exists_returns_false_for_unknown_keys(self):
+        self.mock_listing()
+        assert not self.storage.exists('other_file')
+
+    def test_delete_finds_keys_missing_from_index(self):
+        self.mock_listing()
+        flexmock(MockBucket).should_receive('lookup') \
+            .and_return(listed_key('other_file'))
+        flexmock(MockBucket).should_receive('delete_key') \
+            .with_args('other_file').once()
+        self.storage.delete('other_file')
+
+    def test_index_is_rebuilt_after_ttl(self):
+        assert self.storage.preload_metadata_ttl == 300
+        self.storage.preload_metadata_ttl = 0.01
+        self.mock_listing('some_file').twice()
+        self.storage.exists('some_file')
+        time.sleep(0.02)
+        self.storage.exists('some_file')
+
+    def test_file_metadata_is_answered_from_index(self):
+        self.mock_listing('some_file')
+        flexmock(MockKey).should_receive('open').never()
+        file_ = self.storage.open('some_file')
+        assert file_.size == 3
+        assert file_.etag == '"etag"'
+        assert file_.last_modified == '2012-01-01T00:00:00.000Z'
+
+    def test_save_adds_key_to_index(self):
+        self.mock_listing().once()
+        self.storage.save('some_file', 'some content')
+        assert self.storage.exists('some_file')
+
+    def test_delete_removes_key_from_index(self):
+        self.mock_listing('some_file').once()
+        self.storage.delete('some_file')
+        assert not self.storage.exists('some_file')
+
+    def test_refresh_metadata_lists_bucket_again(self):
+        self.mock_listing('some_file').twice()
+        self.storage.exists('some_file')
+        self.storage.refresh_metadata()
+        self.storage.exists('some_file')
+
+    def test_entries_returns_a_copy_of_the_index(self):
+        self.mock_listing('some_file')
+        self.storage.entries.clear()
+        assert self.storage.exists('some_file')
+        assert list(self.storage.entries) == ['some_file']
+
+    def test_index_is_safe_to_update_while_listing_names(self):
+        self.mock_listing(*['file_%d.txt' % i for i in xrange(1000)])
+        self.storage.naming_strategy = 'listing'
+        results = self.storage.save_many(
+            ('file.txt', 'some content') for i in xrange(100)
+        )
+        assert not [
+            result for result in results
+            if isinstance(result, Exception)
+        ]
+
+    def test_listing_naming_uses_index(self):
+        self.mock_listing('some_file.txt', 'some_file_1.txt').once()
+        self.storage.naming_strategy = 'listing'
+        name = self.storage.get_available_name('some_file.txt')
+        assert name == 'some_file_2.txt'
+
+
+class MockResultSet(list):
+    is_truncated = False
+    next_marker = None
+
+
+class TestS3BotoStorageIterFiles(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        mock_s3()
+        (
+            flexmock(S3Connection)
+            .should_receive('get_bucket')
+            .and_return(MockBucket())
+        )
+        self.storage = S3BotoStorage('some bucket', location='media')
+
+    def test_list_page_strips_location_and_returns_marker(self):
+        result = MockResultSet([listed_key('media/a'), listed_key('media/b')])
+        result.is_truncated = True
+        (
+            flexmock(MockBucket)
+            .should_receive('get_all_keys')
+            .with_args(
+                prefix='media/pics/',
+                delimiter='',
+                max_keys=2,
+                marker='media/pics/0'
+            )
+            .and_return(result)
+        )
+        assert self.storage.list_page(
+            'pics/', page_size=2, marker='pics/0'
+        ) == (['a', 'b'], 'b')
+
+    def test_iter_files_fetches_pages_until_exhausted(self):
+        first = MockResultSet([listed_key('media/a')])
+        first.is_truncated = True
+        (
+            flexmock(MockBucket)
+            .should_receive('get_all_keys')
+            .twice()
+            .replace_with(
+                lambda **kwargs: first if not kwargs['marker'] else
+                MockResultSet([listed_key('media/b')])
+            )
+        )
+        files = list(self.storage.iter_files(page_size=1))
+        assert [f.name for f in files] == ['a', 'b']
+
+
 class TestS3BotoStorageOpenFile(TestCase):
     def test_open_returns_file_object(self):
         mock_s3()
@@ -124,6 +725,7 @@ class TestS3BotoStorageOpenFile(TestCase):
 class TestS3BotoStorageFile(TestCase):
     def setup_method(self, method):
         TestCase.setup_method(self, method)
+        connection_registry.clear()
         flexmock(S3BotoStorage) \
             .should_receive('_get_or_create_bucket') \
             .with_args('some_bucket') \
@@ -144,6 +746,7 @@ class TestS3BotoStorageFile(TestCase):
 
     def test_supports_last_modified(self):
         mock_s3()
+        flexmock(MockBucket).should_receive('get_key').and_return(MockKey())
         file_ = S3BotoStorageFile(self.storage, prefix='pics/')
         file_.name = 'some_key'
         file_.last_modified
@@ -168,18 +771,115 @@ class TestS3BotoStorageFile(TestCase):
             .never())
         S3BotoStorageFile(self.storage, prefix='pics/')
 
-    def test_opens_file_on_size_access(self):
+    def test_heads_key_on_metadata_access(self):
+        mock_s3()
+        key = MockKey()
+        key.size = 3
+        key.etag = '"etag"'
+        flexmock(MockKey).should_receive('open').never()
+        flexmock(MockBucket).should_receive('get_key') \
+            .with_args('pics/some_key').and_return(key).once()
+        file_ = S3BotoStorageFile(self.storage, 'some_key', prefix='pics/')
+        assert file_.size == 3
+        assert file_.etag == '"etag"'
+        assert file_.last_modified == key.last_modified
+
+    def test_metadata_of_unknown_key_raises_file_not_found(self):
+        mock_s3()
+        file_ = S3BotoStorageFile(self.storage, 'some_key')
+        with raises(FileNotFoundError):
+            file_.size
+
+    def test_opens_file_on_read(self):
         mock_s3()
         (flexmock(MockKey)
             .should_receive('open')
             .once())
         file_ = S3BotoStorageFile(self.storage, prefix='pics/')
-        file_.size
+        file_.read()
 
-    def test_opens_file_on_read(self):
+
+class TestS3BotoStorageFileRanges(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
         mock_s3()
+        flexmock(S3BotoStorage) \
+            .should_receive('_get_or_create_bucket') \
+            .and_return(MockBucket())
+        self.storage = S3BotoStorage('some_bucket')
+        self.file = S3BotoStorageFile(self.storage, 'some_file')
+
+    def test_tell_returns_current_position(self):
+        flexmock(MockKey).should_receive('read').and_return('0123')
+        self.file.read(4)
+        assert self.file.tell() == 4
+
+    def test_seek_opens_ranged_stream_on_read(self):
         (flexmock(MockKey)
             .should_receive('open')
+            .with_args('r', headers={'Range': 'bytes=5-'})
             .once())
-        file_ = S3BotoStorageFile(self.storage, prefix='pics/')
-        file_.read()
+        self.file.seek(5)
+        self.file.read(3)
+
+    def test_iter_chunks_reads_one_stream(self):
+        flexmock(MockKey).should_receive('read') \
+            .and_return('0123').and_return('45').and_return('')
+        flexmock(MockKey).should_receive('open').once()
+        assert list(self.file.iter_chunks(4)) == ['0123', '45']
+
+    def test_reads_nothing_after_end_of_file(self):
+        flexmock(MockKey).should_receive('read') \
+            .and_return('0123456789').and_return('') \
+            .and_return('0123456789')
+        flexmock(MockKey).should_receive('open').once()
+        assert self.file.read() == '0123456789'
+        assert self.file.read() == ''
+        assert self.file.read() == ''
+        assert self.file.tell() == 10
+
+    def test_reads_nothing_after_unsatisfiable_range(self):
+        flexmock(MockKey).should_receive('open') \
+            .and_raise(S3ResponseError(416, 'Range Not Satisfiable')).once()
+        self.file.seek(20)
+        assert self.file.read() == ''
+        assert self.file.read() == ''
+
+    def test_reopens_stream_when_seeking_back_from_end(self):
+        flexmock(MockKey).should_receive('read') \
+            .and_return('0123').and_return('').and_return('23')
+        flexmock(MockKey).should_receive('open').twice()
+        self.file.read()
+        self.file.read()
+        self.file.seek(2)
+        assert self.file.read() == '23'
+
+    def test_sequential_reads_share_one_stream(self):
+        flexmock(MockKey).should_receive('read').and_return('0123')
+        flexmock(MockKey).should_receive('open').once()
+        self.file.read(4)
+        self.file.read(4)
+
+    def test_download_to_fetches_ranges_in_parallel(self):
+        data = '0123456789'
+        key = MockKey()
+        key.size = len(data)
+        flexmock(MockBucket).should_receive('get_key').and_return(key)
+
+        def get_contents_as_string(headers=None):
+            start, end = re.match(
+                r'bytes=(\d+)-(\d+)', headers['Range']
+            ).groups()
+            return data[int(start):int(end) + 1]
+
+        (flexmock(MockKey)
+            .should_receive('get_contents_as_string')
+            .replace_with(get_contents_as_string)
+            .times(4))
+        io = StringIO()
+        self.file.download_to(io, workers=3, part_size=3)
+        assert io.getvalue() == data
+
+    def test_download_to_raises_file_not_found_for_unknown_file(self):
+        with raises(FileNotFoundError):
+            self.file.download_to(StringIO())
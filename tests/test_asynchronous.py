@@ -0,0 +1,92 @@
+from __future__ import with_statement
+import threading
+from pytest import raises
+
+from tests import TestCase
+from flask_storage import (
+    AsyncStorage,
+    FileNotFoundError,
+    MockAsyncStorage,
+    MockStorage,
+    MockStorageFile
+)
+
+
+class TestAsyncStorage(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        MockStorage._files = {}
+        self.storage = AsyncStorage(MockStorage(), workers=2)
+
+    def teardown_method(self, method):
+        self.storage.shutdown()
+        TestCase.teardown_method(self, method)
+
+    def test_runs_operations_in_worker_threads(self):
+        threads = []
+        storage = self.storage.storage
+        storage.exists = lambda name: threads.append(
+            threading.current_thread()
+        )
+        self.storage.exists('key').result()
+        assert threads[0] is not threading.current_thread()
+
+    def test_save_and_read(self):
+        self.storage.save('key', 'value').result()
+        assert self.storage.exists('key').result()
+        assert self.storage.read('key').result() == 'value'
+
+    def test_read_from_opened_file(self):
+        self.storage.save('key', 'value').result()
+        file_ = self.storage.open('key').result()
+        assert self.storage.read(file_, 2).result() == 'va'
+
+    def test_reraises_errors(self):
+        with raises(FileNotFoundError):
+            self.storage.delete('key').result()
+
+    def test_runs_in_application_context(self):
+        self.storage.storage.naming_strategy = None
+        self.storage.save('key', 'value').result()
+        file_ = self.storage.save('key', 'value').result()
+        assert file_.name == 'key_1'
+
+    def test_calls_done_callbacks(self):
+        done = threading.Event()
+        results = []
+
+        def callback(task):
+            results.append(task.result())
+            done.set()
+        self.storage.url('key').add_done_callback(callback)
+        done.wait(5)
+        assert results == ['key']
+
+    def test_iter_files_yields_task_per_page(self):
+        for name in ('a', 'b', 'c'):
+            self.storage.save(name, 'value').result()
+        pages = [
+            [file_.name for file_ in task.result()]
+            for task in self.storage.iter_files(page_size=2)
+        ]
+        assert pages == [['a', 'b'], ['c']]
+
+
+class TestMockAsyncStorage(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        MockStorage._files = {}
+        self.storage = MockAsyncStorage()
+
+    def test_returns_finished_tasks(self):
+        task = self.storage.save('key', 'value')
+        assert task.done()
+        assert isinstance(task.result(), MockStorageFile)
+        assert self.storage.read('key').result() == 'value'
+
+    def test_calls_done_callbacks_right_away(self):
+        results = []
+        self.storage.exists('key').add_done_callback(
+            lambda task: results.append(task.result())
+        )
+        assert results == [False]
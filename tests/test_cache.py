@@ -0,0 +1,196 @@
+from __future__ import with_statement
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+
+from flexmock import flexmock
+from tests import TestCase
+from flask_storage import (
+    CachedStorage,
+    CachedStorageFile,
+    MockStorage,
+    MockStorageFile
+)
+
+
+class EtagMockStorageFile(MockStorageFile):
+    @property
+    def etag(self):
+        return '"%s"' % hashlib.md5(self.file).hexdigest()
+
+
+class EtagMockStorage(MockStorage):
+    @property
+    def file_class(self):
+        return EtagMockStorageFile
+
+
+class CachedStorageTestCase(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        MockStorage._files = {}
+        self.cache_dir = tempfile.mkdtemp()
+        self.remote = EtagMockStorage()
+        self.storage = CachedStorage(self.remote, cache_dir=self.cache_dir)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        TestCase.teardown_method(self, method)
+
+    def read_path(self, name):
+        with open(self.storage.path(name), 'rb') as file_:
+            return file_.read()
+
+
+class TestCachedStorage(CachedStorageTestCase):
+    def test_path_returns_local_copy(self):
+        self.remote.save('key', 'value')
+        path = self.storage.path('key')
+        assert path.startswith(self.cache_dir)
+        assert self.read_path('key') == 'value'
+
+    def test_downloads_files_once(self):
+        self.remote.save('key', 'value')
+        self.storage.path('key')
+        flexmock(EtagMockStorageFile).should_receive('iter_chunks').never()
+        assert self.read_path('key') == 'value'
+
+    def test_downloads_changed_files_again(self):
+        self.remote.save('key', 'value')
+        self.storage.path('key')
+        self.remote.save('key', 'other value', overwrite=True)
+        assert self.read_path('key') == 'other value'
+
+    def test_skips_validation_if_disabled(self):
+        self.storage.validate = False
+        self.remote.save('key', 'value')
+        self.storage.path('key')
+        self.remote.save('key', 'other value', overwrite=True)
+        flexmock(EtagMockStorage).should_receive('_open').never()
+        assert self.read_path('key') == 'value'
+
+    def test_save_invalidates_cached_copy(self):
+        self.storage.save('key', 'value')
+        self.storage.path('key')
+        self.storage.validate = False
+        self.storage.save('key', 'other value', overwrite=True)
+        assert self.read_path('key') == 'other value'
+
+    def test_delete_removes_cached_copy(self):
+        self.storage.save('key', 'value')
+        path = self.storage.path('key')
+        self.storage.delete('key')
+        assert not os.path.exists(path)
+        assert not self.remote.exists('key')
+
+    def test_invalidate_removes_every_file(self):
+        self.remote.save('a', 'value')
+        self.remote.save('b', 'value')
+        paths = [self.storage.path('a'), self.storage.path('b')]
+        self.storage.invalidate()
+        assert not any(os.path.exists(path) for path in paths)
+
+    def test_separates_storages_sharing_the_cache(self):
+        self.remote.save('key', 'value')
+        other = CachedStorage(EtagMockStorage('other'), self.cache_dir)
+        assert self.storage.path('key') != other.path('key')
+
+
+class TestCachedStorageEviction(CachedStorageTestCase):
+    def setup_method(self, method):
+        CachedStorageTestCase.setup_method(self, method)
+        for name in ('a', 'b', 'c'):
+            self.remote.save(name, '1234')
+
+    def cache(self, name, accessed):
+        path = self.storage.path(name)
+        os.utime(path, (accessed, accessed))
+        return path
+
+    def test_evicts_least_recently_used_files(self):
+        self.storage.max_size = 10
+        a = self.cache('a', 1000)
+        b = self.cache('b', 2000)
+        self.cache('a', 3000)
+        c = self.storage.path('c')
+        assert os.path.exists(a)
+        assert not os.path.exists(b)
+        assert os.path.exists(c)
+
+    def test_evicts_least_frequently_used_files(self):
+        self.storage.max_size = 10
+        self.storage.policy = 'lfu'
+        a = self.cache('a', 2000)
+        b = self.cache('b', 1000)
+        self.storage.path('b')
+        os.utime(b, (1000, 1000))
+        self.storage.path('c')
+        assert not os.path.exists(a)
+        assert os.path.exists(b)
+
+    def test_keeps_files_within_max_size(self):
+        paths = [self.storage.path(name) for name in ('a', 'b', 'c')]
+        assert all(os.path.exists(path) for path in paths)
+
+    def test_scans_cache_only_when_counter_exceeds_max_size(self):
+        self.storage.path('a')
+        flexmock(CachedStorage).should_receive('_evict').never()
+        self.storage.path('b')
+        self.storage.path('c')
+        assert self.storage._update_size() == 12
+
+    def test_evicts_down_to_low_watermark(self):
+        self.remote.save('d', '1234')
+        self.storage.max_size = 13
+        for accessed, name in enumerate('abcd'):
+            self.cache(name, 1000 + accessed)
+        assert [
+            os.path.exists(self.storage.path(name)) for name in 'cd'
+        ] == [True, True]
+        assert self.storage._update_size() == 8
+
+    def test_invalidate_updates_size_counter(self):
+        self.storage.path('a')
+        self.storage.path('b')
+        self.storage.invalidate('a')
+        assert self.storage._update_size() == 4
+
+    def test_counts_hits_logarithmically(self):
+        self.storage.policy = 'lfu'
+        path = self.storage.path('a')
+        flexmock(random).should_receive('random').and_return(0.3)
+        for i in xrange(10):
+            self.storage.path('a')
+        assert self.storage._read_meta(path)['hits'] == 2
+
+
+class TestCachedStorageFile(CachedStorageTestCase):
+    def setup_method(self, method):
+        CachedStorageTestCase.setup_method(self, method)
+        self.remote.save('key', '0123456789')
+
+    def test_open_returns_cached_file(self):
+        file_ = self.storage.open('key')
+        assert isinstance(file_, CachedStorageFile)
+        assert file_.name == 'key'
+
+    def test_reads_from_cached_copy(self):
+        file_ = self.storage.open('key')
+        assert file_.read(4) == '0123'
+        file_.seek(8)
+        assert file_.read() == '89'
+        assert file_.tell() == 10
+        file_.close()
+        assert open(file_.path).read() == '0123456789'
+
+    def test_iterates_cached_copy(self):
+        file_ = self.storage.open('key')
+        file_.chunk_size = 4
+        assert list(file_) == ['0123', '4567', '89']
+        assert file_.size == 10
+
+    def test_does_not_download_on_open(self):
+        flexmock(EtagMockStorageFile).should_receive('iter_chunks').never()
+        self.storage.open('key').size
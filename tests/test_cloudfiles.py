@@ -1,12 +1,17 @@
 from __future__ import with_statement
+from StringIO import StringIO
 from pytest import raises
 
 from flexmock import flexmock
 import cloudfiles
 from tests import TestCase
+import flask_storage.cloudfiles
+import flask_storage.utils
+from flask_storage.utils import ObjectPool
 from flask_storage import (
     CloudFilesStorage,
     CloudFilesStorageFile,
+    FileNotFoundError,
     StorageException
 )
 
@@ -28,23 +33,60 @@ class MockContainer(object):
     def is_public(self):
         return True
 
+    def make_public(self):
+        pass
+
     def create_object(self, name):
         obj = MockCloubObject()
         self.objects[name] = obj
         return obj
 
+    def list_objects(self, **params):
+        names = sorted(
+            name for name in self.objects
+            if name.startswith(params.get('prefix', '')) and
+            name > params.get('marker', '')
+        )
+        # like Swift, listings are capped at 10000 names
+        return names[:params.get('limit', 10000)]
+
     def get_object(self, name):
         if name not in self.objects:
             raise cloudfiles.errors.NoSuchObject()
-        return self.objects[name]
+        obj = self.objects[name]
+        if hasattr(obj, 'content'):
+            # fetched objects know their metadata, unlike sent ones
+            obj.size = len(obj.content)
+            obj.last_modified = 'Sun, 06 Nov 1994 08:49:37 GMT'
+        return obj
 
 
 class MockCloubObject(object):
+    size = None
+    last_modified = None
+
     def send(self, content):
-        self.content = content
+        self.content = content.read()
+
+    def copy_to(self, container_name, name):
+        pass
+
+    def read(self, size=-1, offset=0):
+        self.reads = getattr(self, 'reads', []) + [(offset, size)]
+        if size < 0:
+            return self.content[offset:]
+        return self.content[offset:offset + size]
+
+    def stream(self, chunksize=8192, hdrs=None):
+        start = 0
+        if hdrs:
+            start = int(hdrs['Range'][len('bytes='):-1])
+        for offset in xrange(start, len(self.content), chunksize):
+            yield self.content[offset:offset + chunksize]
 
 
 def cloudfiles_mock_connection():
+    flask_storage.cloudfiles._public_containers.clear()
     return (
         flexmock(cloudfiles).should_receive('get_connection')
         .and_return(MockConnection())
@@ -58,6 +100,24 @@ class TestCloudFilesStorage(TestCase):
         with raises(StorageException):
             self.storage.delete('key')
 
+    def test_delete_many_returns_result_per_name(self):
+        cloudfiles_mock_connection()
+        storage = CloudFilesStorage()
+        results = storage.delete_many(['a', 'b'])
+        assert sorted(results) == ['a', 'b']
+        assert all(
+            isinstance(error, FileNotFoundError)
+            for error in results.values()
+        )
+
+    def test_copy_copies_on_server(self):
+        cloudfiles_mock_connection()
+        storage = CloudFilesStorage('container')
+        obj = storage.container.create_object('key')
+        flexmock(obj).should_receive('copy_to') \
+            .with_args('container', 'other').once()
+        assert storage.copy('key', 'other').name == 'other'
+
     def test_open_raises_exception_for_unknown_object(self):
         cloudfiles_mock_connection()
         self.storage = CloudFilesStorage()
@@ -78,9 +138,235 @@ class TestCloudFilesStorage(TestCase):
         self.storage.exists('key')
 
 
+class TestCloudFilesIterFiles(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        cloudfiles_mock_connection()
+        MockContainer.objects = {}
+        self.storage = CloudFilesStorage()
+        for name in ('a', 'b', 'c'):
+            self.storage.save(name, 'value')
+
+    def test_list_page_returns_marker_of_next_page(self):
+        assert self.storage.list_page(page_size=2) == (['a', 'b'], 'b')
+        assert self.storage.list_page(page_size=2, marker='b') == (
+            ['c'], None
+        )
+
+    def test_iter_files_yields_lazy_file_objects(self):
+        flexmock(MockContainer).should_receive('get_object').never()
+        files = list(self.storage.iter_files(page_size=2))
+        assert [f.name for f in files] == ['a', 'b', 'c']
+
+
 class TestCloudFileStorageFile(TestCase):
     def test_supports_file_objects_without_name(self):
         cloudfiles_mock_connection()
         storage = CloudFilesStorage()
         file_ = CloudFilesStorageFile(storage)
         assert bool(file_) is False
+
+    def test_does_not_fetch_object_on_creation(self):
+        cloudfiles_mock_connection()
+        storage = CloudFilesStorage()
+        flexmock(MockContainer).should_receive('get_object').never()
+        CloudFilesStorageFile(storage, 'some_unknown_object')
+
+    def test_save_does_not_fetch_object(self):
+        cloudfiles_mock_connection()
+        storage = CloudFilesStorage()
+        flexmock(MockContainer).should_receive('get_object').never()
+        storage.save('key', 'something', overwrite=True)
+
+    def test_save_sends_size_of_seekable_content(self):
+        cloudfiles_mock_connection()
+        storage = CloudFilesStorage()
+        storage.save('key', StringIO('something'), overwrite=True)
+        assert MockContainer.objects['key'].size == len('something')
+
+    def test_fetches_metadata_of_chunked_uploads(self):
+        cloudfiles_mock_connection()
+        storage = CloudFilesStorage()
+        content = flexmock(read=lambda: 'hello world')
+        file_ = storage.save('key', content, overwrite=True)
+        assert file_.size == 11
+        assert file_.last_modified == 'Sun, 06 Nov 1994 08:49:37 GMT'
+        assert file_.read() == 'hello world'
+
+    def test_iter_chunks_streams_from_position(self):
+        cloudfiles_mock_connection()
+        storage = CloudFilesStorage()
+        file_ = storage.save('key', '0123456789', overwrite=True)
+        flexmock(file_.file).should_receive('stream') \
+            .with_args(4, {'Range': 'bytes=2-'}) \
+            .replace_with(MockCloubObject.stream.__get__(file_.file)) \
+            .once()
+        file_.seek(2)
+        assert list(file_.iter_chunks(4)) == ['2345', '6789']
+        assert file_.tell() == 10
+        assert list(file_.iter_chunks(4)) == []
+
+
+class TestCloudFilesListingNaming(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        cloudfiles_mock_connection()
+        MockContainer.objects = {}
+
+    def teardown_method(self, method):
+        MockContainer.objects = {}
+        TestCase.teardown_method(self, method)
+
+    def test_lists_every_page_of_names(self):
+        storage = CloudFilesStorage()
+        storage.naming_strategy = 'listing'
+        storage.save('file.txt', 'value')
+        for i in xrange(1, 10001):
+            MockContainer.objects['file_%d.txt' % i] = MockCloubObject()
+        assert storage.get_available_name('file.txt') == 'file_10001.txt'
+
+
+class TestCloudFilesConnectionPool(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        self.connections = []
+
+        def get_connection(**kwargs):
+            self.connections.append(MockConnection())
+            return self.connections[-1]
+        cloudfiles_mock_connection().replace_with(get_connection)
+
+    def test_reuses_connections_across_worker_pools(self):
+        storage = CloudFilesStorage(delete_workers=4)
+        storage.delete_many(['file%d' % i for i in xrange(20)])
+        storage.delete_many(['file%d' % i for i in xrange(20)])
+        assert 1 <= len(self.connections) <= 4
+        assert len(storage._containers) == len(self.connections)
+
+    def test_keeps_connection_pool_size_idle_connections(self):
+        storage = CloudFilesStorage(
+            delete_workers=4, connection_pool_size=1
+        )
+        storage.delete_many(['file%d' % i for i in xrange(20)])
+        assert len(storage._containers) == 1
+
+    def test_files_use_container_of_reading_thread(self):
+        storage = CloudFilesStorage(read_ahead=0)
+        storage.save('key', 'value', overwrite=True)
+        file_ = storage.open('key')
+        file_.file.container = None
+        assert file_.read() == 'value'
+        assert file_.file.container is storage.container
+
+
+class TestObjectPool(object):
+    def setup_method(self, method):
+        self.pool = ObjectPool(object, max_idle=1)
+
+    def test_reuses_released_objects(self):
+        first = self.pool.acquire()
+        self.pool.release(first)
+        assert self.pool.acquire() is first
+
+    def test_creates_objects_for_concurrent_borrowers(self):
+        assert self.pool.acquire() is not self.pool.acquire()
+
+    def test_closes_objects_beyond_max_idle(self):
+        first, second = flexmock(), flexmock()
+        second.should_receive('close').once()
+        self.pool.release(first)
+        self.pool.release(second)
+        assert len(self.pool) == 1
+
+    def test_starts_from_scratch_after_fork(self):
+        first = self.pool.acquire()
+        self.pool.release(first)
+        (flexmock(flask_storage.utils.os)
+            .should_receive('getpid')
+            .and_return(-1))
+        assert self.pool.acquire() is not first
+
+
+class TestCloudFilesReadAhead(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        cloudfiles_mock_connection()
+        self.storage = CloudFilesStorage(read_ahead=4, read_ahead_max=8)
+        self.file = self.storage.save(
+            'key', '0123456789abcdefghijklmnopqrstuvwxyz', overwrite=True
+        )
+
+    def test_small_reads_share_one_request(self):
+        assert [self.file.read(1) for i in xrange(4)] == list('0123')
+        assert self.file.file.reads == [(0, 4)]
+
+    def test_window_grows_on_sequential_reads(self):
+        assert ''.join(self.file.read(2) for i in xrange(12)) == \
+            '0123456789abcdefghijklmn'
+        assert self.file.file.reads == [(0, 4), (4, 8), (12, 8), (20, 8)]
+
+    def test_large_reads_fetch_requested_size(self):
+        assert self.file.read(10) == '0123456789'
+        assert self.file.file.reads == [(0, 10)]
+
+    def test_seek_inside_buffer_keeps_it(self):
+        self.file.read(3)
+        self.file.seek(1)
+        assert self.file.read(3) == '123'
+        assert self.file.file.reads == [(0, 4)]
+
+    def test_seek_outside_buffer_resets_window(self):
+        self.file.read(4)
+        self.file.read(1)
+        self.file.seek(30)
+        assert self.file.read(1) == 'u'
+        assert self.file.file.reads == [(0, 4), (4, 8), (30, 4)]
+
+    def test_reads_stop_at_end_of_file(self):
+        self.file.seek(34)
+        assert self.file.read(4) == 'yz'
+        assert self.file.read(4) == ''
+        assert self.file.file.reads == [(34, 2)]
+
+    def test_read_all_returns_rest_of_file(self):
+        self.file.read(1)
+        assert self.file.read() == '123456789abcdefghijklmnopqrstuvwxyz'
+        assert self.file.file.reads == [(0, 4), (4, 32)]
+
+    def test_disabled_read_ahead_reads_directly(self):
+        self.storage.read_ahead = 0
+        assert self.file.read(1) == '0'
+        assert self.file.read(1) == '1'
+        assert self.file.file.reads == [(0, 1), (1, 1)]
+
+
+class TestCloudFilesContainerPublication(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        cloudfiles_mock_connection()
+
+    def test_checks_publication_once_per_ttl(self):
+        flexmock(MockContainer).should_receive('is_public') \
+            .once().and_return(True)
+        storage = CloudFilesStorage()
+        storage.exists('key')
+        storage.exists('key')
+        CloudFilesStorage().exists('key')
+
+    def test_checks_publication_again_after_ttl(self):
+        self.app.config['CLOUDFILES_PUBLIC_CHECK_TTL'] = 0
+        flexmock(MockContainer).should_receive('is_public') \
+            .twice().and_return(True)
+        storage = CloudFilesStorage()
+        storage.exists('key')
+        storage.exists('key')
+
+    def test_makes_private_container_public(self):
+        flexmock(MockContainer).should_receive('is_public').and_return(False)
+        flexmock(MockContainer).should_receive('make_public').once()
+        CloudFilesStorage().exists('key')
+
+    def test_publication_check_can_be_skipped(self):
+        self.app.config['CLOUDFILES_MAKE_CONTAINER_PUBLIC'] = False
+        flexmock(MockContainer).should_receive('is_public').never()
+        CloudFilesStorage().exists('key')
@@ -0,0 +1,119 @@
+from __future__ import with_statement
+import os
+import shutil
+from StringIO import StringIO
+from pytest import raises
+
+from flexmock import flexmock
+from tests import TestCase
+from flask_storage import (
+    ContentAddressedStorage,
+    ContentAddressedStorageFile,
+    FileNotFoundError,
+    FileSystemStorage,
+    MockStorage
+)
+
+
+class TestContentAddressedStorage(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        MockStorage._files = {}
+        self.storage = ContentAddressedStorage(MockStorage())
+
+    def blobs(self):
+        return [
+            name for name in MockStorage._files if name.startswith('blobs/')
+        ]
+
+    def test_save_returns_file_with_given_name(self):
+        file_ = self.storage.save('some_dir/key.txt', 'value')
+        assert isinstance(file_, ContentAddressedStorageFile)
+        assert file_.name == 'some_dir/key.txt'
+        assert file_.read() == 'value'
+
+    def test_stores_identical_content_once(self):
+        self.storage.save('first', 'value')
+        self.storage.save('second', StringIO('value'))
+        assert len(self.blobs()) == 1
+        assert self.storage.open('second').read() == 'value'
+
+    def test_skips_upload_of_existing_content(self):
+        self.storage.save('first', 'value')
+        blob = self.blobs()[0]
+        (flexmock(MockStorage)
+            .should_receive('_save')
+            .replace_with(lambda name, content: None)
+            .times(2))
+        self.storage.save('second', StringIO('value'))
+        assert blob in MockStorage._files
+
+    def test_uses_naming_strategy_for_taken_names(self):
+        self.storage.save('key', 'value')
+        assert self.storage.save('key', 'other').name == 'key_1'
+
+    def test_delete_keeps_content_referenced_by_other_names(self):
+        self.storage.save('first', 'value')
+        self.storage.save('second', 'value')
+        self.storage.delete('first')
+        assert not self.storage.exists('first')
+        assert self.storage.open('second').read() == 'value'
+
+    def test_delete_removes_unreferenced_content(self):
+        self.storage.save('first', 'value')
+        self.storage.save('second', 'value')
+        self.storage.delete('first')
+        self.storage.delete('second')
+        assert self.blobs() == []
+
+    def test_overwrite_releases_old_content(self):
+        self.storage.save('key', 'value')
+        self.storage.save('key', 'other', overwrite=True)
+        assert len(self.blobs()) == 1
+        assert self.storage.open('key').read() == 'other'
+
+    def test_delete_raises_file_not_found_for_unknown_file(self):
+        with raises(FileNotFoundError):
+            self.storage.delete('key')
+
+    def test_url_points_to_blob(self):
+        self.storage.save('key', 'value')
+        digest = self.storage.digest('key')
+        assert self.storage.url('key') == 'blobs/%s/%s' % (digest[:2], digest)
+
+    def test_copy_adds_name_without_copying_blob(self):
+        self.storage.save('key', 'value')
+        assert self.storage.copy('key', 'other').read() == 'value'
+        assert len(self.blobs()) == 1
+
+    def test_move_keeps_blob(self):
+        self.storage.save('key', 'value')
+        self.storage.move('key', 'other')
+        assert not self.storage.exists('key')
+        assert self.storage.open('other').read() == 'value'
+        assert len(self.blobs()) == 1
+
+    def test_lists_names(self):
+        self.storage.save('a', 'value')
+        self.storage.save('b', 'other')
+        assert self.storage.list_page() == (['a', 'b'], None)
+
+
+class TestContentAddressedFileSystemStorage(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        self.folder = os.path.join(os.path.dirname(__file__), 'uploads')
+        self.storage = ContentAddressedStorage(
+            FileSystemStorage(self.folder),
+            spool_size=4
+        )
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.folder, ignore_errors=True)
+        TestCase.teardown_method(self, method)
+
+    def test_spools_large_content_to_disk(self):
+        self.storage.save('first', StringIO('large value'))
+        self.storage.save('second', StringIO('large value'))
+        assert self.storage.open('second').read() == 'large value'
+        assert self.storage.path('first') == self.storage.path('second')
@@ -1,16 +1,24 @@
 from __future__ import with_statement
 import os
 import shutil
+import tempfile
+import threading
+import time
+import zlib
+from StringIO import StringIO
 from pytest import raises
 from flexmock import flexmock
 
 from tests import TestCase
 from flask_storage import (
+    FileNotFoundError,
     FileSystemStorage,
     FileSystemStorageFile,
+    ListingNaming,
     StorageException
 )
 import flask_storage.filesystem
+from flask_storage.filesystem import GroupCommit
 
 
 class FileSystemTestCase(TestCase):
@@ -150,9 +158,367 @@ class TestFileSystemDelete(FileSystemTestCase):
         with raises(StorageException):
             storage.delete('some_unknown_file')
 
+    def test_delete_many(self):
+        names = ['uploads/%d.txt' % i for i in xrange(10)]
+        for name in names:
+            self.storage.save(name, 'value')
+        results = self.storage.delete_many(names + ['uploads/unknown'])
+        assert [results[name] for name in names] == [None] * 10
+        assert isinstance(results['uploads/unknown'], FileNotFoundError)
+        assert not any(self.storage.exists(name) for name in names)
+
 
 class TestFileSystemStorageFile(FileSystemTestCase):
     def test_supports_prefixes(self):
         file_ = FileSystemStorageFile(self.storage, prefix='pics/')
         file_.name = 'some_pic.jpg'
         assert file_.name == 'pics/some_pic.jpg'
+
+    def test_readinto_reads_from_file(self):
+        file_ = self.storage.save(self.file, '012345')
+        buffer = bytearray(4)
+        assert file_.readinto(buffer) == 4
+        assert buffer == bytearray('0123')
+        assert list(file_.iter_chunks(1)) == ['4', '5']
+
+
+class TestFileSystemListingNaming(FileSystemTestCase):
+    def test_finds_next_free_name_with_one_listing(self):
+        self.storage.naming_strategy = ListingNaming()
+        self.storage.save('uploads/file.txt', 'value')
+        self.storage.save('uploads/file_1.txt', 'value')
+        flexmock(FileSystemStorage).should_receive('exists').never()
+        obj = self.storage.save('uploads/file.txt', 'value')
+        assert obj.name == 'uploads/file_2.txt'
+
+    def test_supports_missing_directories(self):
+        self.storage.naming_strategy = ListingNaming()
+        obj = self.storage.save('uploads/images/file.txt', 'value')
+        assert obj.name == 'uploads/images/file.txt'
+
+
+class TestFileSystemIterFiles(FileSystemTestCase):
+    def setup_method(self, method):
+        FileSystemTestCase.setup_method(self, method)
+        for name in ('a.txt', 'b/c.txt', 'b/d.txt', 'e.txt'):
+            self.storage.save('uploads/' + name, 'value')
+
+    def test_yields_files_recursively_in_sorted_order(self):
+        files = list(self.storage.iter_files('uploads/'))
+        assert all(isinstance(f, FileSystemStorageFile) for f in files)
+        assert [f.name for f in files] == [
+            'uploads/a.txt', 'uploads/b/c.txt', 'uploads/b/d.txt',
+            'uploads/e.txt'
+        ]
+
+    def test_list_page_returns_marker_of_next_page(self):
+        names, marker = self.storage.list_page('uploads/', page_size=2)
+        assert names == ['uploads/a.txt', 'uploads/b/c.txt']
+        names, marker = self.storage.list_page(
+            'uploads/', page_size=2, marker=marker
+        )
+        assert names == ['uploads/b/d.txt', 'uploads/e.txt']
+        assert self.storage.list_page(
+            'uploads/', page_size=2, marker=marker
+        ) == ([], None)
+
+    def test_list_page_rolls_up_folders_with_delimiter(self):
+        names, marker = self.storage.list_page('uploads/', delimiter='/')
+        assert names == ['uploads/a.txt', 'uploads/b/', 'uploads/e.txt']
+        assert marker is None
+
+    def test_list_page_supports_name_prefixes(self):
+        names, marker = self.storage.list_page('uploads/b')
+        assert names == ['uploads/b/c.txt', 'uploads/b/d.txt']
+
+
+class TestFileSystemWalkFiles(FileSystemTestCase):
+    def test_yields_names_sizes_and_modification_times(self):
+        self.storage.save('uploads/a.txt', 'value')
+        self.storage.save('uploads/b/c.txt', 'other value')
+        files = sorted(self.storage.walk_files('uploads/'))
+        assert [(name, size) for name, size, mtime in files] == [
+            ('uploads/a.txt', 5), ('uploads/b/c.txt', 11)
+        ]
+        assert files[0][2] == os.path.getmtime(
+            self.storage.path('uploads/a.txt')
+        )
+
+    def test_supports_name_prefixes(self):
+        self.storage.save('uploads/a.txt', 'value')
+        self.storage.save('uploads/b/c.txt', 'value')
+        assert [f[0] for f in self.storage.walk_files('uploads/b')] == [
+            'uploads/b/c.txt'
+        ]
+
+    def test_yields_nothing_for_missing_folder(self):
+        assert list(self.storage.walk_files('uploads/missing/')) == []
+
+
+class TestFileSystemSaveFromFile(FileSystemTestCase):
+    def setup_method(self, method):
+        FileSystemTestCase.setup_method(self, method)
+        self.source_path = os.path.join(
+            os.path.dirname(__file__), 'uploads', 'source.txt'
+        )
+        self.storage.save('uploads/source.txt', 'file contents')
+
+    def read(self, name):
+        with open(self.storage.path(name), 'rb') as destination:
+            return destination.read()
+
+    def test_copies_real_files(self):
+        with open(self.source_path, 'rb') as source:
+            self.storage.save('uploads/copy.txt', source)
+        assert self.read('uploads/copy.txt') == 'file contents'
+
+    def test_copies_file_like_objects_with_small_buffers(self):
+        storage = FileSystemStorage(os.path.dirname(__file__), buffer_size=2)
+        storage.save('uploads/copy.txt', StringIO('file contents'))
+        assert self.read('uploads/copy.txt') == 'file contents'
+
+    def test_does_not_roll_over_spooled_files(self):
+        source = tempfile.SpooledTemporaryFile(max_size=1024)
+        source.write('file contents')
+        source.seek(0)
+        self.storage.save('uploads/copy.txt', source)
+        assert not source._rolled
+        assert self.read('uploads/copy.txt') == 'file contents'
+
+    def test_saves_unicode_strings_as_utf8(self):
+        self.storage.save('uploads/copy.txt', u'\xe4')
+        assert self.read('uploads/copy.txt') == '\xc3\xa4'
+
+    def test_supports_hard_links(self):
+        storage = FileSystemStorage(os.path.dirname(__file__), hard_link=True)
+        with open(self.source_path, 'rb') as source:
+            storage.save('uploads/copy.txt', source)
+        assert os.path.samefile(
+            self.source_path, storage.path('uploads/copy.txt')
+        )
+
+    def test_does_not_hard_link_by_default(self):
+        with open(self.source_path, 'rb') as source:
+            self.storage.save('uploads/copy.txt', source)
+        assert not os.path.samefile(
+            self.source_path, self.storage.path('uploads/copy.txt')
+        )
+
+
+class TestFileSystemAtomicSave(FileSystemTestCase):
+    def test_does_not_leave_temporary_files_behind(self):
+        self.storage.save('uploads/file.txt', 'value')
+        assert os.listdir(self.storage.path('uploads')) == ['file.txt']
+
+    def test_keeps_old_content_if_save_fails(self):
+        self.storage.save('uploads/file.txt', 'value')
+        (flexmock(FileSystemStorage)
+            .should_receive('_copy')
+            .and_raise(IOError(28, 'No space left on device')))
+        with raises(StorageException):
+            self.storage.save(
+                'uploads/file.txt', StringIO('other'), overwrite=True
+            )
+        assert self.storage.open('uploads/file.txt').read() == 'value'
+        assert os.listdir(self.storage.path('uploads')) == ['file.txt']
+
+    def test_overwrites_existing_files(self):
+        self.storage.save('uploads/file.txt', 'value')
+        self.storage.save('uploads/file.txt', 'other', overwrite=True)
+        assert self.storage.open('uploads/file.txt').read() == 'other'
+
+    def test_fsyncs_file_and_directory(self):
+        storage = FileSystemStorage(
+            os.path.dirname(__file__), durability='directory'
+        )
+        (flexmock(flask_storage.filesystem)
+            .should_receive('fsync_path')
+            .twice())
+        storage.save('uploads/file.txt', 'value')
+
+    def test_does_not_fsync_by_default(self):
+        (flexmock(flask_storage.filesystem)
+            .should_receive('fsync_path')
+            .never())
+        self.storage.save('uploads/file.txt', 'value')
+
+    def test_rejects_unknown_durability(self):
+        with raises(StorageException):
+            FileSystemStorage(os.path.dirname(__file__), durability='disk')
+
+
+class TestFileSystemTempFiles(FileSystemTestCase):
+    def setup_method(self, method):
+        FileSystemTestCase.setup_method(self, method)
+        self.storage.save('uploads/b/c.txt', 'value')
+        self.temp_path = flask_storage.filesystem.temporary_path(
+            self.storage.path('uploads/b/c.txt')
+        )
+        with open(self.temp_path, 'wb') as temp_file:
+            temp_file.write('partial')
+
+    def test_listings_skip_temporary_files(self):
+        assert [f[0] for f in self.storage.walk_files('uploads/')] == [
+            'uploads/b/c.txt'
+        ]
+        assert self.storage.list_page('uploads/b/') == (
+            ['uploads/b/c.txt'], None
+        )
+        assert self.storage._names_with_prefix('uploads/b/') == [
+            'uploads/b/c.txt'
+        ]
+        storage = FileSystemStorage(self.storage.path('uploads/b'))
+        assert storage.list_files() == ['c.txt']
+
+    def test_removes_stale_temporary_files(self):
+        os.utime(self.temp_path, (1000, 1000))
+        assert self.storage.remove_temp_files() == [self.temp_path]
+        assert os.listdir(self.storage.path('uploads/b')) == ['c.txt']
+
+    def test_keeps_recent_temporary_files(self):
+        assert self.storage.remove_temp_files() == []
+        assert os.path.exists(self.temp_path)
+        assert self.storage.remove_temp_files(max_age=0) == [self.temp_path]
+
+
+class TestGroupCommit(object):
+    def test_concurrent_syncs_share_fsync_calls(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow_fsync(path):
+            calls.append(path)
+            started.set()
+            release.wait()
+
+        (flexmock(flask_storage.filesystem)
+            .should_receive('fsync_path')
+            .replace_with(slow_fsync))
+        group_commit = GroupCommit()
+        first = threading.Thread(target=group_commit.sync, args=('dir', ))
+        first.start()
+        started.wait()
+        waiting = [
+            threading.Thread(target=group_commit.sync, args=('dir', ))
+            for i in range(5)
+        ]
+        for thread in waiting:
+            thread.start()
+        directory_sync = group_commit._directories.get('dir')
+        while directory_sync._requested < 6:
+            time.sleep(0.001)
+        release.set()
+        for thread in [first] + waiting:
+            thread.join()
+        assert calls == ['dir', 'dir']
+
+
+class TestFileSystemDirectoryCache(FileSystemTestCase):
+    def setup_method(self, method):
+        FileSystemTestCase.setup_method(self, method)
+        flask_storage.filesystem.known_directories.clear()
+
+    def test_does_not_create_known_directories_again(self):
+        self.storage.save('uploads/file.txt', 'value')
+        (flexmock(flask_storage.filesystem.os)
+            .should_receive('makedirs')
+            .never())
+        self.storage.save('uploads/other.txt', 'value')
+
+    def test_delete_folder_invalidates_cache(self):
+        self.storage.save('uploads/images/file.txt', 'value')
+        self.storage.delete_folder('uploads')
+        self.storage.save('uploads/images/file.txt', 'value')
+        assert self.storage.exists('uploads/images/file.txt')
+
+    def test_recreates_directories_removed_by_others(self):
+        self.storage.save('uploads/images/file.txt', 'value')
+        shutil.rmtree(self.storage.path('uploads'))
+        self.storage.save('uploads/images/file.txt', 'value')
+        assert self.storage.exists('uploads/images/file.txt')
+
+
+class TestFileSystemGzip(FileSystemTestCase):
+    def setup_method(self, method):
+        FileSystemTestCase.setup_method(self, method)
+        self.storage = FileSystemStorage(
+            os.path.dirname(__file__),
+            gzip=True
+        )
+        self.content = 'body { color: red; }\n' * 100
+
+    def read(self, name):
+        with open(self.storage.path(name), 'rb') as f:
+            return f.read()
+
+    def test_writes_compressed_sibling(self):
+        self.storage.save('uploads/style.css', self.content)
+        assert self.read('uploads/style.css') == self.content
+        compressed = self.read('uploads/style.css.gz')
+        assert zlib.decompress(compressed, 16 + zlib.MAX_WBITS) == \
+            self.content
+
+    def test_skips_other_content_types(self):
+        self.storage.save('uploads/image.png', self.content)
+        assert not self.storage.exists('uploads/image.png.gz')
+
+    def test_removes_stale_sibling_when_content_does_not_shrink(self):
+        self.storage.save('uploads/style.css', self.content)
+        self.storage.save('uploads/style.css', 'a', overwrite=True)
+        assert not self.storage.exists('uploads/style.css.gz')
+
+    def test_delete_removes_sibling(self):
+        self.storage.save('uploads/style.css', self.content)
+        self.storage.delete('uploads/style.css')
+        assert not self.storage.exists('uploads/style.css.gz')
+
+
+class TestFileSystemCopyAndMove(FileSystemTestCase):
+    def test_copy(self):
+        self.storage.save('uploads/file.txt', 'value')
+        file_ = self.storage.copy('uploads/file.txt', 'uploads/a/copy.txt')
+        assert file_.read() == 'value'
+        assert self.storage.exists('uploads/file.txt')
+        assert not os.path.samefile(
+            self.storage.path('uploads/file.txt'),
+            self.storage.path('uploads/a/copy.txt')
+        )
+
+    def test_copy_hard_links_when_enabled(self):
+        storage = FileSystemStorage(os.path.dirname(__file__), hard_link=True)
+        storage.save('uploads/file.txt', 'value')
+        storage.copy('uploads/file.txt', 'uploads/copy.txt')
+        assert os.path.samefile(
+            storage.path('uploads/file.txt'),
+            storage.path('uploads/copy.txt')
+        )
+
+    def test_copy_raises_file_not_found_for_unknown_file(self):
+        with raises(FileNotFoundError):
+            self.storage.copy('uploads/unknown', 'uploads/copy.txt')
+
+    def test_move_renames_file(self):
+        self.storage.save('uploads/file.txt', 'value')
+        inode = os.stat(self.storage.path('uploads/file.txt')).st_ino
+        file_ = self.storage.move('uploads/file.txt', 'uploads/a/moved.txt')
+        assert file_.read() == 'value'
+        assert os.stat(file_.path).st_ino == inode
+        assert not self.storage.exists('uploads/file.txt')
+
+    def test_move_raises_file_not_found_for_unknown_file(self):
+        with raises(FileNotFoundError):
+            self.storage.move('uploads/unknown', 'uploads/moved.txt')
+
+    def test_move_takes_gzipped_sibling_along(self):
+        storage = FileSystemStorage(os.path.dirname(__file__), gzip=True)
+        storage.save('uploads/style.css', 'body { color: red; }\n' * 100)
+        storage.move('uploads/style.css', 'uploads/moved.css')
+        assert storage.exists('uploads/moved.css.gz')
+        assert not storage.exists('uploads/style.css.gz')
+
+    def test_rename(self):
+        file_ = self.storage.save('uploads/file.txt', 'value')
+        file_.rename('uploads/renamed.txt')
+        assert file_.name == 'uploads/renamed.txt'
+        assert self.storage.open('uploads/renamed.txt').read() == 'value'
@@ -0,0 +1,138 @@
+from __future__ import with_statement
+import os
+import shutil
+import tempfile
+
+from flexmock import flexmock
+from tests import TestCase
+from flask_storage import (
+    FileSystemStorage,
+    FileSystemStorageFile,
+    MockStorage,
+    send_storage_file
+)
+
+
+class SendStorageFileTestCase(TestCase):
+    def send(self, file_, headers=None, **kwargs):
+        with self.app.test_request_context(headers=headers or {}):
+            response = send_storage_file(file_, **kwargs)
+            response.direct_passthrough = False
+            return response
+
+
+class TestSendStorageFile(SendStorageFileTestCase):
+    def setup_method(self, method):
+        SendStorageFileTestCase.setup_method(self, method)
+        MockStorage._files = {}
+        self.storage = MockStorage()
+        self.file = self.storage.save('dir/file.txt', '0123456789')
+
+    def test_streams_whole_file(self):
+        response = self.send(self.file, chunk_size=3)
+        assert response.status_code == 200
+        assert response.get_data() == '0123456789'
+        assert response.headers['Content-Length'] == '10'
+        assert response.headers['Accept-Ranges'] == 'bytes'
+        assert response.mimetype == 'text/plain'
+
+    def test_answers_ranges_with_partial_content(self):
+        response = self.send(self.file, {'Range': 'bytes=2-5'})
+        assert response.status_code == 206
+        assert response.get_data() == '2345'
+        assert response.headers['Content-Range'] == 'bytes 2-5/10'
+        assert response.headers['Content-Length'] == '4'
+
+    def test_answers_suffix_ranges(self):
+        response = self.send(self.file, {'Range': 'bytes=-3'})
+        assert response.get_data() == '789'
+
+    def test_answers_unsatisfiable_ranges(self):
+        response = self.send(self.file, {'Range': 'bytes=20-30'})
+        assert response.status_code == 416
+        assert response.headers['Content-Range'] == 'bytes */10'
+
+    def test_sends_whole_file_for_multiple_ranges(self):
+        response = self.send(self.file, {'Range': 'bytes=0-1,4-5'})
+        assert response.status_code == 200
+
+    def test_ignores_range_if_etag_changed(self):
+        response = self.send(
+            self.file, {'Range': 'bytes=2-5', 'If-Range': '"other"'}
+        )
+        assert response.status_code == 200
+        assert response.get_data() == '0123456789'
+
+    def test_honors_range_if_etag_matches(self):
+        etag = self.send(self.file).headers['ETag']
+        response = self.send(
+            self.file, {'Range': 'bytes=2-5', 'If-Range': etag}
+        )
+        assert response.status_code == 206
+
+    def test_answers_matching_etag_with_not_modified(self):
+        etag = self.send(self.file).headers['ETag']
+        response = self.send(self.file, {'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.get_data() == ''
+
+    def test_answers_if_modified_since_with_not_modified(self):
+        last_modified = self.send(self.file).headers['Last-Modified']
+        response = self.send(
+            self.file, {'If-Modified-Since': last_modified}
+        )
+        assert response.status_code == 304
+
+    def test_uses_etag_of_file(self):
+        self.file.etag = '"abc"'
+        response = self.send(self.file, {'If-None-Match': '"abc"'})
+        assert response.status_code == 304
+
+    def test_sends_as_attachment(self):
+        response = self.send(self.file, as_attachment=True)
+        assert response.headers['Content-Disposition'] == \
+            'attachment; filename="file.txt"'
+
+
+class TestSendFileSystemStorageFile(SendStorageFileTestCase):
+    def setup_method(self, method):
+        SendStorageFileTestCase.setup_method(self, method)
+        self.storage = FileSystemStorage(os.path.dirname(__file__))
+        self.file = self.storage.save('uploads/file.txt', '0123456789')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.storage.path('uploads'), ignore_errors=True)
+        SendStorageFileTestCase.teardown_method(self, method)
+
+    def test_streams_whole_file(self):
+        response = self.send(self.file)
+        assert response.get_data() == '0123456789'
+
+    def test_answers_ranges_with_partial_content(self):
+        response = self.send(self.file, {'Range': 'bytes=2-5'})
+        assert response.status_code == 206
+        assert response.get_data() == '2345'
+
+    def test_uses_x_sendfile(self):
+        self.app.use_x_sendfile = True
+        response = self.send(self.file)
+        assert response.headers['X-Sendfile'] == self.file.path
+        assert response.get_data() == ''
+
+    def test_uses_x_accel_redirect(self):
+        self.app.config['STORAGE_X_ACCEL_REDIRECT_PREFIX'] = '/protected/'
+        response = self.send(self.file)
+        assert response.headers['X-Accel-Redirect'] == \
+            '/protected/uploads/file.txt'
+        assert response.get_data() == ''
+
+    def test_streams_files_outside_of_storage_folder(self):
+        self.app.config['STORAGE_X_ACCEL_REDIRECT_PREFIX'] = '/protected/'
+        with tempfile.NamedTemporaryFile() as outside:
+            outside.write('outside')
+            outside.flush()
+            flexmock(FileSystemStorageFile).should_receive('path') \
+                .and_return(outside.name)
+            response = self.send(self.file)
+            assert 'X-Accel-Redirect' not in response.headers
+            assert response.get_data() == 'outside'
@@ -0,0 +1,97 @@
+from __future__ import with_statement
+from pytest import raises
+
+from flexmock import flexmock
+from tests import TestCase
+from flask_storage import (
+    FileNotFoundError,
+    MetadataCacheStorage,
+    MetadataCacheStorageFile,
+    MockStorage,
+    MockStorageFile
+)
+
+
+class MetadataCacheTestCase(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        MockStorage._files = {}
+        self.storage = MetadataCacheStorage(MockStorage())
+
+
+class TestMetadataCacheStorage(MetadataCacheTestCase):
+    def test_caches_exists(self):
+        self.storage.storage.save('key', 'value')
+        flexmock(MockStorage).should_receive('exists').once().and_return(True)
+        assert self.storage.exists('key')
+        assert self.storage.exists('key')
+
+    def test_does_not_cache_misses_by_default(self):
+        flexmock(MockStorage).should_receive('exists').twice() \
+            .and_return(False)
+        assert not self.storage.exists('key')
+        assert not self.storage.exists('key')
+
+    def test_supports_negative_caching(self):
+        storage = MetadataCacheStorage(MockStorage(), negative_ttl=10)
+        flexmock(MockStorage).should_receive('exists').once() \
+            .and_return(False)
+        assert not storage.exists('key')
+        assert not storage.exists('key')
+
+    def test_save_invalidates_cached_entry(self):
+        storage = MetadataCacheStorage(MockStorage(), negative_ttl=10)
+        assert not storage.exists('key')
+        storage.save('key', 'value')
+        assert storage.exists('key')
+        assert storage.size('key') == 5
+
+    def test_delete_invalidates_cached_entry(self):
+        self.storage.save('key', 'value')
+        assert self.storage.exists('key')
+        self.storage.delete('key')
+        assert not self.storage.exists('key')
+
+    def test_caches_size(self):
+        self.storage.save('key', 'value')
+        self.storage.size('key')
+        flexmock(MockStorage).should_receive('open').never()
+        assert self.storage.size('key') == 5
+
+    def test_size_raises_file_not_found_for_unknown_file(self):
+        with raises(FileNotFoundError):
+            self.storage.size('key')
+
+    def test_evicts_least_recently_used_names(self):
+        storage = MetadataCacheStorage(MockStorage(), max_size=1)
+        storage.save('first', 'value')
+        storage.save('second', 'value')
+        storage.exists('first')
+        storage.exists('second')
+        flexmock(MockStorage).should_receive('exists').once() \
+            .and_return(True)
+        storage.exists('first')
+
+    def test_save_uses_cache_for_available_name(self):
+        self.storage.save('key', 'value')
+        self.storage.exists('key')
+        flexmock(MockStorage).should_receive('exists').once() \
+            .and_return(False)
+        assert self.storage.save('key', 'value').name == 'key_1'
+
+
+class TestMetadataCacheStorageFile(MetadataCacheTestCase):
+    def test_open_returns_file_with_cached_metadata(self):
+        self.storage.save('key', 'value')
+        file_ = self.storage.open('key')
+        assert isinstance(file_, MetadataCacheStorageFile)
+        assert file_.size == 5
+        assert file_.read() == 'value'
+
+    def test_new_file_saves_through_cache(self):
+        assert not self.storage.exists('key')
+        file_ = self.storage.new_file()
+        assert isinstance(file_, MockStorageFile)
+        file_.name = 'key'
+        file_.save('value')
+        assert self.storage.exists('key')
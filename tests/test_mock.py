@@ -1,10 +1,13 @@
 from __future__ import with_statement
 from StringIO import StringIO
+import threading
 from pytest import raises
 
+from flexmock import flexmock
 from tests import TestCase
 from flask_storage import (
-    MockStorage, MockStorageFile, StorageException, FileNotFoundError
+    MockStorage, MockStorageFile, StorageException, FileNotFoundError,
+    HashNaming, ListingNaming
 )
 
 
@@ -66,6 +69,26 @@ class TestMockStorage(TestCase):
         with raises(FileNotFoundError):
             storage.delete('key')
 
+    def test_delete_many_returns_result_per_name(self):
+        storage = MockStorage()
+        storage.save('key', '')
+        results = storage.delete_many(['key', 'unknown'])
+        assert results['key'] is None
+        assert isinstance(results['unknown'], FileNotFoundError)
+        assert not storage.exists('key')
+
+    def test_copy(self):
+        storage = MockStorage()
+        storage.save('key', 'value')
+        assert storage.copy('key', 'other').read() == 'value'
+        assert storage.exists('key')
+
+    def test_move(self):
+        storage = MockStorage()
+        storage.save('key', 'value')
+        assert storage.move('key', 'other').read() == 'value'
+        assert not storage.exists('key')
+
     def test_new_file(self):
         storage = MockStorage()
         assert isinstance(storage.new_file(), MockStorageFile)
@@ -93,6 +116,24 @@ class TestMockStorageFile(TestCase):
         file_ = storage.open('key')
         assert file_.read() == '123123'
 
+    def test_iter_chunks_yields_rest_of_file(self):
+        file_ = self.storage.save('key', '0123456789')
+        file_.read(2)
+        assert list(file_.iter_chunks(3)) == ['234', '567', '89']
+
+    def test_iterates_in_chunks(self):
+        file_ = self.storage.save('key', '0123456789')
+        file_.chunk_size = 4
+        assert list(file_) == ['0123', '4567', '89']
+
+    def test_readinto_fills_buffer(self):
+        file_ = self.storage.save('key', '012345')
+        buffer = bytearray(4)
+        assert file_.readinto(buffer) == 4
+        assert buffer == bytearray('0123')
+        assert file_.readinto(buffer) == 2
+        assert buffer[:2] == bytearray('45')
+
     def test_supports_file_objects_without_name(self):
         storage = MockStorage('uploads')
         file_ = MockStorageFile(storage)
@@ -133,6 +174,7 @@ class TestMockStorageFile(TestCase):
         file_.last_modified
 
     def test_equality_operator(self):
+        self.storage.save('some_key', '')
         file_ = MockStorageFile(self.storage)
         file_.name = 'some_key'
         file2 = MockStorageFile(self.storage)
@@ -141,9 +183,176 @@ class TestMockStorageFile(TestCase):
         file2.rename('some other key')
         assert file_ != file2
 
+    def test_rename_moves_content(self):
+        file_ = self.storage.save('some_key', 'something')
+        file_.rename('some other key')
+        assert file_.name == 'some other key'
+        assert file_.read() == 'something'
+        assert not self.storage.exists('some_key')
+
     def test_equality_operator_with_none_values(self):
         file_ = MockStorageFile(self.storage)
         file_.name = 'some_key'
         none = None
         assert not file_ == none
         assert file_ != none
+
+
+class TestMockStorageNaming(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        MockStorage._files = {}
+        self.storage = MockStorage()
+
+    def test_sequential_naming_is_used_by_default(self):
+        self.storage.save('some_dir/key.txt', 'value')
+        obj = self.storage.save('some_dir/key.txt', 'value')
+        assert obj.name == 'some_dir/key_1.txt'
+
+    def test_naming_strategy_can_be_set_in_config(self):
+        self.app.config['STORAGE_NAMING_STRATEGY'] = 'listing'
+        assert isinstance(self.storage.naming_strategy, ListingNaming)
+
+    def test_listing_naming_does_not_call_exists(self):
+        self.storage.naming_strategy = ListingNaming()
+        self.storage.save('key.txt', 'value')
+        self.storage.save('key_1.txt', 'value')
+        flexmock(MockStorage).should_receive('exists').never()
+        obj = self.storage.save('key.txt', 'value')
+        assert obj.name == 'key_2.txt'
+
+    def test_uuid_naming_does_not_call_exists(self):
+        self.storage.naming_strategy = 'uuid'
+        flexmock(MockStorage).should_receive('exists').never()
+        obj = self.storage.save('some_dir/key.txt', 'value')
+        assert obj.name.startswith('some_dir/key_')
+        assert obj.name.endswith('.txt')
+
+    def test_hash_naming_uses_content_digest(self):
+        self.storage.naming_strategy = HashNaming()
+        io = StringIO()
+        io.write('value')
+        first = self.storage.save('key.txt', io)
+        second = self.storage.save('key.txt', 'value')
+        assert first.name == second.name
+        assert first.read() == 'value'
+
+
+class TestMockStorageIterFiles(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        MockStorage._files = {}
+        self.storage = MockStorage()
+        for name in ('a.txt', 'b/c.txt', 'b/d.txt', 'e.txt'):
+            self.storage.save(name, 'value')
+
+    def test_yields_files_in_sorted_order(self):
+        files = list(self.storage.iter_files(page_size=3))
+        assert all(isinstance(f, MockStorageFile) for f in files)
+        assert [f.name for f in files] == [
+            'a.txt', 'b/c.txt', 'b/d.txt', 'e.txt'
+        ]
+
+    def test_supports_markers(self):
+        names, marker = self.storage.list_page(page_size=2)
+        assert (names, marker) == (['a.txt', 'b/c.txt'], 'b/c.txt')
+        assert [f.name for f in self.storage.iter_files(marker=marker)] == [
+            'b/d.txt', 'e.txt'
+        ]
+
+    def test_rolls_up_names_with_delimiter(self):
+        names, marker = self.storage.list_page(delimiter='/')
+        assert names == ['a.txt', 'b/', 'e.txt']
+        names = [f.name for f in self.storage.iter_files(delimiter='/')]
+        assert names == ['a.txt', 'e.txt']
+
+
+class BlockingContent(object):
+    def __init__(self, released):
+        self.released = released
+
+    def seek(self, offset):
+        pass
+
+    def read(self):
+        self.released.wait()
+        return 'value'
+
+
+class TestMockStorageSaveMany(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        MockStorage._files = {}
+        self.storage = MockStorage()
+
+    def test_saves_items_concurrently(self):
+        results = self.storage.save_many(
+            (('key%d' % i, 'value%d' % i) for i in xrange(20)),
+            workers=4
+        )
+        assert [file_.name for file_ in results] == \
+            ['key%d' % i for i in xrange(20)]
+        assert self.storage.open('key19').read() == 'value19'
+
+    def test_supports_overwrite_flag_per_item(self):
+        self.storage.save('key', 'old')
+        results = self.storage.save_many([
+            ('key', 'new'),
+            ('key', 'newer', True),
+        ], workers=1)
+        assert [file_.name for file_ in results] == ['key_1', 'key']
+        assert self.storage.open('key').read() == 'newer'
+
+    def test_continues_after_failures(self):
+        def save(name, content):
+            if name == 'bad':
+                raise StorageException('failed')
+            return MockStorage._save(self.storage, name, content)
+        self.storage._save = save
+        results = self.storage.save_many(
+            [('good', 'value'), ('bad', 'value'), ('other', 'value')],
+            workers=2
+        )
+        assert results[0].name == 'good'
+        assert isinstance(results[1], StorageException)
+        assert results[2].name == 'other'
+
+    def test_wraps_backend_errors_per_item(self):
+        def save(name, content):
+            if name == 'bad':
+                raise IOError('connection reset')
+            return MockStorage._save(self.storage, name, content)
+        self.storage._save = save
+        results = self.storage.save_many(
+            [('good', 'value'), ('bad', 'value'), ('other', 'value')],
+            workers=2
+        )
+        assert isinstance(results[1], StorageException)
+        assert isinstance(results[1].wrapped_exception, IOError)
+        assert self.storage.open('other').read() == 'value'
+
+    def test_raises_programming_errors(self):
+        def save(name, content):
+            raise TypeError('unsupported operand')
+        self.storage._save = save
+        with raises(TypeError):
+            self.storage.save_many([('good', 'value')], workers=2)
+
+    def test_consumes_items_only_as_fast_as_they_are_saved(self):
+        released = threading.Event()
+        consumed = []
+
+        def items():
+            for i in xrange(100):
+                consumed.append(i)
+                yield 'key%d' % i, BlockingContent(released)
+
+        def release():
+            consumed_while_blocked.append(len(consumed))
+            released.set()
+        consumed_while_blocked = []
+        timer = threading.Timer(0.2, release)
+        timer.start()
+        results = self.storage.save_many(items(), workers=2)
+        assert consumed_while_blocked[0] <= 5
+        assert len(results) == 100
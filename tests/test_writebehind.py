@@ -0,0 +1,207 @@
+from __future__ import with_statement
+import json
+import shutil
+import tempfile
+import threading
+import time
+
+from boto.exception import S3ResponseError
+from flexmock import flexmock
+from pytest import raises
+from tests import TestCase
+from flask_storage import (
+    FileNotFoundError,
+    FileSystemStorage,
+    MockStorage,
+    StorageException,
+    WriteBehindStorage,
+    WriteBehindStorageFile
+)
+
+
+class WriteBehindTestCase(TestCase):
+    def setup_method(self, method):
+        TestCase.setup_method(self, method)
+        MockStorage._files = {}
+        self.staging_dir = tempfile.mkdtemp()
+        self.remote = MockStorage()
+        self.staging = FileSystemStorage(self.staging_dir)
+        self.storage = WriteBehindStorage(
+            self.remote, self.staging, workers=2, retries=2,
+            retry_delay=0.001
+        )
+
+    def teardown_method(self, method):
+        self.storage.shutdown()
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        TestCase.teardown_method(self, method)
+
+    def block_uploads(self):
+        """
+        Makes uploads wait for the returned event and records the
+        uploaded contents.
+        """
+        release = threading.Event()
+        uploads = []
+        save = MockStorage._save.im_func
+
+        def blocking_save(storage, name, content):
+            release.wait()
+            uploads.append(content.read())
+            content.seek(0)
+            return save(storage, name, content)
+        flexmock(MockStorage).should_receive('_save') \
+            .replace_with(lambda name, content: blocking_save(
+                self.remote, name, content))
+        return release, uploads
+
+
+class TestWriteBehindStorage(WriteBehindTestCase):
+    def test_save_returns_before_upload(self):
+        release, uploads = self.block_uploads()
+        file_ = self.storage.save('key', 'value')
+        assert isinstance(file_, WriteBehindStorageFile)
+        assert file_.name == 'key'
+        assert file_.pending
+        assert not self.remote.exists('key')
+        release.set()
+        assert self.storage.flush(timeout=5)
+        assert self.remote.open('key').read() == 'value'
+        assert not file_.pending
+
+    def test_reads_pending_files_from_staging(self):
+        release, uploads = self.block_uploads()
+        self.storage.save('key', 'value')
+        assert self.storage.exists('key')
+        assert self.storage.open('key').read() == 'value'
+        release.set()
+
+    def test_removes_staged_files_after_upload(self):
+        self.storage.save('key', 'value')
+        self.storage.flush(timeout=5)
+        assert self.staging.list_files() == []
+        assert self.storage.open('key').read() == 'value'
+
+    def test_uploads_latest_version_in_order(self):
+        release, uploads = self.block_uploads()
+        self.storage.save('key', 'one')
+        time.sleep(0.05)
+        self.storage.save('key', 'two', overwrite=True)
+        self.storage.save('key', 'three', overwrite=True)
+        assert self.storage.open('key').read() == 'three'
+        release.set()
+        self.storage.flush(timeout=5)
+        assert uploads == ['one', 'three']
+        assert self.remote.open('key').read() == 'three'
+
+    def test_flush_times_out(self):
+        release, uploads = self.block_uploads()
+        self.storage.save('key', 'value')
+        assert not self.storage.flush(timeout=0.01)
+        release.set()
+
+    def test_retries_failed_uploads(self):
+        attempts = []
+        save = MockStorage._save.im_func
+
+        def flaky_save(name, content):
+            attempts.append(name)
+            if len(attempts) < 3:
+                raise StorageException('unavailable', 503)
+            return save(self.remote, name, content)
+        flexmock(MockStorage).should_receive('_save') \
+            .replace_with(flaky_save)
+        self.storage.save('key', 'value')
+        self.storage.flush(timeout=5)
+        assert len(attempts) == 3
+        assert self.storage.failures() == {}
+        assert self.remote.open('key').read() == 'value'
+
+    def test_retries_backend_server_errors(self):
+        attempts = []
+        save = MockStorage._save.im_func
+
+        def flaky_save(name, content):
+            attempts.append(name)
+            if len(attempts) < 3:
+                raise S3ResponseError(503, 'Slow Down')
+            return save(self.remote, name, content)
+        flexmock(MockStorage).should_receive('_save') \
+            .replace_with(flaky_save)
+        self.storage.save('key', 'value')
+        self.storage.flush(timeout=5)
+        assert len(attempts) == 3
+        assert self.remote.open('key').read() == 'value'
+
+    def test_does_not_retry_backend_client_errors(self):
+        flexmock(MockStorage).should_receive('_save') \
+            .and_raise(S3ResponseError(403, 'Forbidden')).once()
+        self.storage.save('key', 'value')
+        self.storage.flush(timeout=5)
+        assert isinstance(self.storage.failures()['key'], S3ResponseError)
+
+    def test_saves_do_not_wait_for_busy_uploaders(self):
+        storage = WriteBehindStorage(self.remote, self.staging, workers=1)
+        release, uploads = self.block_uploads()
+        for i in xrange(10):
+            storage.save('key%d' % i, 'value')
+        release.set()
+        assert storage.flush(timeout=5)
+        assert len(uploads) == 10
+        storage.shutdown()
+
+    def test_keeps_failed_uploads_staged(self):
+        flexmock(MockStorage).should_receive('_save') \
+            .and_raise(StorageException('forbidden', 403))
+        self.storage.save('key', 'value')
+        self.storage.flush(timeout=5)
+        assert list(self.storage.failures()) == ['key']
+        assert self.storage.open('key').read() == 'value'
+        assert len(self.staging.list_files()) == 2
+
+    def test_delete_discards_pending_uploads(self):
+        release, uploads = self.block_uploads()
+        self.storage.save('key', 'one')
+        time.sleep(0.05)
+        self.storage.save('key', 'two', overwrite=True)
+        deleting = threading.Thread(target=self.storage.delete, args=('key',))
+        deleting.start()
+        time.sleep(0.05)
+        release.set()
+        deleting.join()
+        assert uploads == ['one']
+        assert not self.storage.exists('key')
+        with raises(FileNotFoundError):
+            self.storage.delete('key')
+
+
+class TestWriteBehindStorageRecovery(WriteBehindTestCase):
+    def stage(self, staging_name, name, content, staged_at):
+        self.staging.save(staging_name, content)
+        self.staging.save(
+            staging_name + '.json',
+            json.dumps({'name': name, 'staged_at': staged_at})
+        )
+
+    def test_recover_uploads_staged_files_in_order(self):
+        self.stage('b', 'key', 'new', 2)
+        self.stage('a', 'key', 'old', 1)
+        self.stage('c', 'other', 'value', 3)
+        assert self.storage.recover() == 3
+        self.storage.flush(timeout=5)
+        assert self.remote.open('key').read() == 'new'
+        assert self.remote.open('other').read() == 'value'
+        assert self.staging.list_files() == []
+
+    def test_recover_retries_failed_uploads(self):
+        flexmock(MockStorage).should_receive('_save') \
+            .and_raise(StorageException('forbidden', 403))
+        self.storage.save('key', 'value')
+        self.storage.flush(timeout=5)
+        flexmock(MockStorage).should_receive('_save') \
+            .replace_with(lambda name, content: self.remote._files.update(
+                {name: content.read()}))
+        assert self.storage.recover() == 1
+        self.storage.flush(timeout=5)
+        assert self.storage.failures() == {}
+        assert self.remote._files['key'] == 'value'